@@ -0,0 +1,264 @@
+"""
+Async Generator - Sinh Q&A song song bằng asyncio
+Giữ tối đa N request Gemini cùng lúc thay vì gọi tuần tự từng chủ đề
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+from dotenv import load_dotenv
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+# Số request tối đa chạy cùng lúc (có thể đặt MAX_IN_FLIGHT trong .env)
+DEFAULT_MAX_IN_FLIGHT = int(os.getenv('MAX_IN_FLIGHT', '4'))
+# Số chủ đề gộp vào một request trong mỗi lượt (1 = mỗi request một chủ đề như cũ)
+DEFAULT_TOPICS_PER_REQUEST = int(os.getenv('TOPICS_PER_REQUEST', '1'))
+
+
+class AsyncQAEngine:
+    def __init__(self, generator, max_in_flight=None, should_continue=None, topics_per_request=None,
+                 scheduler=None):
+        """Khởi tạo engine async bọc quanh một QAGenerator
+
+        generator: QAGenerator (dùng generate_qa_pairs_async của backend)
+        max_in_flight: số request tối đa đang chờ phản hồi cùng lúc
+        should_continue: hàm không tham số, trả về False để ngừng gửi request mới
+        topics_per_request: số chủ đề gộp vào một request trong generate_round
+        (mặc định lấy từ TOPICS_PER_REQUEST trong .env)
+        scheduler: TopicScheduler tùy chọn để generate_dataset chọn chủ đề
+        theo hiệu suất thay vì ngẫu nhiên đều
+        """
+        self.generator = generator
+        self.scheduler = scheduler
+        self.max_in_flight = max(1, max_in_flight or DEFAULT_MAX_IN_FLIGHT)
+        self.topics_per_request = max(1, topics_per_request or DEFAULT_TOPICS_PER_REQUEST)
+        self.should_continue = should_continue or (lambda: True)
+        self.retry_delay = 2
+
+    async def _generate(self, semaphore, topic_key, num_pairs, on_pair=None):
+        """Sinh Q&A cho một chủ đề, trả về (topic_key, qa_pairs, thời gian)
+
+        Nếu có on_pair thì dùng chế độ stream, mỗi cặp được chuyển đi ngay.
+        """
+        async with semaphore:
+            if not self.should_continue():
+                return topic_key, [], 0.0
+            start_time = time.time()
+            if on_pair:
+                qa_pairs = await self.generator.generate_qa_pairs_stream_async(topic_key, num_pairs, on_pair)
+            else:
+                qa_pairs = await self.generator.generate_qa_pairs_async(topic_key, num_pairs)
+            return topic_key, qa_pairs, time.time() - start_time
+
+    async def _generate_batch(self, semaphore, topic_counts, on_pair=None):
+        """Sinh Q&A cho nhiều chủ đề ({khóa: số cặp}) trong một request, trả về [(topic_key, qa_pairs, thời gian)]"""
+        async with semaphore:
+            if not self.should_continue():
+                return [(topic_key, [], 0.0) for topic_key in topic_counts]
+            start_time = time.time()
+            results = await self.generator.generate_qa_batch_async(topic_counts, on_pair)
+            elapsed = time.time() - start_time
+            return [(topic_key, results[topic_key], elapsed) for topic_key in topic_counts]
+
+    async def generate_round(self, topic_keys, num_pairs=30, on_pair=None, on_result=None):
+        """Sinh đồng thời cho tất cả chủ đề, kết quả giữ đúng thứ tự topic_keys
+
+        num_pairs: số cặp cho mọi chủ đề, hoặc dict {khóa chủ đề: số cặp}
+        (vd. khi tiếp tục một lượt dở dang).
+        on_result: gọi với (topic_key, qa_pairs, thời gian) ngay khi mỗi chủ đề xong.
+        Với topics_per_request > 1, các chủ đề liên tiếp được gộp thành một
+        request (thời gian của mỗi chủ đề là thời gian của cả request).
+        """
+        counts = num_pairs if isinstance(num_pairs, dict) else dict.fromkeys(topic_keys, num_pairs)
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        def report(task):
+            if on_result and not task.cancelled() and task.exception() is None:
+                result = task.result()
+                for item in (result if isinstance(result, list) else [result]):
+                    on_result(*item)
+
+        if self.topics_per_request == 1:
+            tasks = [asyncio.ensure_future(self._generate(semaphore, key, counts[key], on_pair))
+                     for key in topic_keys]
+            for task in tasks:
+                task.add_done_callback(report)
+            return await asyncio.gather(*tasks)
+
+        groups = [topic_keys[i:i + self.topics_per_request]
+                  for i in range(0, len(topic_keys), self.topics_per_request)]
+        tasks = [asyncio.ensure_future(self._generate_batch(semaphore, {key: counts[key] for key in group}, on_pair))
+                 for group in groups]
+        for task in tasks:
+            task.add_done_callback(report)
+        return [result for batch in await asyncio.gather(*tasks) for result in batch]
+
+    async def generate_dataset(self, total_pairs, on_pairs, batch_size=10):
+        """Sinh total_pairs cặp Q&A, luôn giữ max_in_flight request đang chạy
+
+        on_pairs được gọi với mỗi lô Q&A ngay khi request hoàn thành.
+        Trả về tổng số cặp đã sinh.
+        """
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        topic_keys = list(self.generator.topics.keys())
+        total_generated = 0
+        pending = {}  # task -> số cặp đã yêu cầu
+
+        while True:
+            # Bổ sung request cho đủ max_in_flight (không yêu cầu vượt quá tổng)
+            while self.should_continue() and len(pending) < self.max_in_flight:
+                requested = total_generated + sum(pending.values())
+                if requested >= total_pairs:
+                    break
+                size = min(batch_size, total_pairs - requested)
+                topic_key = self.scheduler.pick() if self.scheduler else random.choice(topic_keys)
+                if topic_key is None:
+                    break
+                task = asyncio.ensure_future(self._generate(semaphore, topic_key, size))
+                pending[task] = size
+
+            if not pending:
+                if self.scheduler and total_generated < total_pairs and self.should_continue():
+                    print(f"🏁 Dừng sớm: {self.scheduler.describe()}")
+                break
+
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                del pending[task]
+                topic_key, qa_pairs, elapsed = task.result()
+                if self.scheduler:
+                    self.scheduler.observe(topic_key)
+                if qa_pairs:
+                    total_generated += len(qa_pairs)
+                    on_pairs(qa_pairs)
+                elif self.should_continue():
+                    print("⚠️ Không sinh được Q&A, thử lại...")
+                    await asyncio.sleep(self.retry_delay)
+
+        return total_generated
+
+    def run_round(self, topic_keys, num_pairs=30, on_pair=None, on_result=None):
+        """Phiên bản đồng bộ của generate_round"""
+        return asyncio.run(self.generate_round(topic_keys, num_pairs, on_pair, on_result))
+
+    def run_dataset(self, total_pairs, on_pairs, batch_size=10):
+        """Phiên bản đồng bộ của generate_dataset"""
+        return asyncio.run(self.generate_dataset(total_pairs, on_pairs, batch_size))
+
+
+def benchmark_throughput(generator, num_pairs=30, max_in_flight=None, topic_keys=None):
+    """So sánh tốc độ (câu/phút) giữa cách sinh tuần tự và engine async
+
+    Chạy một lượt đầy đủ các chủ đề theo từng cách, trả về dict kết quả.
+    """
+    if topic_keys is None:
+        topic_keys = sorted(generator.topics.keys(), key=int)
+
+    # Tuần tự: gọi generate_qa_pairs lần lượt như marathon cũ (không tính sleep)
+    start_time = time.time()
+    sequential_pairs = 0
+    for topic_key in topic_keys:
+        sequential_pairs += len(generator.generate_qa_pairs(topic_key, num_pairs))
+    sequential_time = time.time() - start_time
+
+    # Song song: một lượt qua AsyncQAEngine
+    engine = AsyncQAEngine(generator, max_in_flight)
+    start_time = time.time()
+    results = engine.run_round(topic_keys, num_pairs)
+    concurrent_time = time.time() - start_time
+    concurrent_pairs = sum(len(qa_pairs) for _, qa_pairs, _ in results)
+
+    result = {
+        'topics': len(topic_keys),
+        'max_in_flight': engine.max_in_flight,
+        'sequential_pairs': sequential_pairs,
+        'sequential_seconds': sequential_time,
+        'sequential_pairs_per_minute': sequential_pairs / (sequential_time / 60) if sequential_time else 0.0,
+        'concurrent_pairs': concurrent_pairs,
+        'concurrent_seconds': concurrent_time,
+        'concurrent_pairs_per_minute': concurrent_pairs / (concurrent_time / 60) if concurrent_time else 0.0,
+    }
+
+    print("\n📊 === SO SÁNH TỐC ĐỘ ===")
+    print(f"🐢 Tuần tự : {sequential_pairs} câu trong {sequential_time:.1f}s "
+          f"| {result['sequential_pairs_per_minute']:.1f} câu/phút")
+    print(f"⚡ Song song ({engine.max_in_flight} request): {concurrent_pairs} câu trong {concurrent_time:.1f}s "
+          f"| {result['concurrent_pairs_per_minute']:.1f} câu/phút")
+    if result['sequential_pairs_per_minute']:
+        speedup = result['concurrent_pairs_per_minute'] / result['sequential_pairs_per_minute']
+        print(f"🏆 Nhanh hơn: x{speedup:.1f}")
+    return result
+
+
+def benchmark_batching(generator, num_pairs=10, topics_per_request=3, topic_keys=None):
+    """So sánh số cặp/request và cặp/token đầu vào: mỗi request một chủ đề vs gộp nhiều chủ đề
+
+    Chạy một lượt đầy đủ các chủ đề theo từng cách, trả về dict kết quả.
+    """
+    if topic_keys is None:
+        topic_keys = sorted(generator.topics.keys(), key=int)
+
+    def measure(per_request):
+        before = dict(generator.usage)
+        engine = AsyncQAEngine(generator, topics_per_request=per_request)
+        start_time = time.time()
+        engine.run_round(topic_keys, num_pairs)
+        elapsed = time.time() - start_time
+        requests = generator.usage['requests'] - before['requests']
+        tokens = generator.usage['input_tokens'] - before['input_tokens']
+        pairs = generator.usage['pairs'] - before['pairs']
+        return {
+            'requests': requests,
+            'input_tokens': tokens,
+            'pairs': pairs,
+            'seconds': elapsed,
+            'pairs_per_request': pairs / requests if requests else 0.0,
+            'pairs_per_1k_input_tokens': pairs * 1000 / tokens if tokens else 0.0,
+        }
+
+    result = {'single': measure(1), 'batched': measure(topics_per_request),
+              'topics_per_request': topics_per_request}
+
+    print("\n📊 === SO SÁNH GỘP CHỦ ĐỀ ===")
+    for label, key in (("1 chủ đề/request", 'single'),
+                       (f"{topics_per_request} chủ đề/request", 'batched')):
+        stats = result[key]
+        print(f"   {label:>18}: {stats['requests']} request | {stats['pairs']} cặp | "
+              f"{stats['pairs_per_request']:.1f} cặp/request | "
+              f"{stats['pairs_per_1k_input_tokens']:.2f} cặp/1000 token đầu vào | {stats['seconds']:.1f}s")
+    return result
+
+
+def main():
+    """Chạy benchmark tuần tự vs song song"""
+    parser = argparse.ArgumentParser(description="Benchmark engine sinh Q&A async")
+    parser.add_argument('--live', action='store_true', help='Dùng Gemini thật thay cho backend giả lập')
+    parser.add_argument('--latency', type=float, default=1.0, help='Độ trễ (giây) của backend giả lập')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Dao động độ trễ (giây) của backend giả lập')
+    parser.add_argument('--pairs', type=int, default=30, help='Số cặp Q&A mỗi chủ đề')
+    parser.add_argument('--max-in-flight', type=int, default=None, help='Số request song song')
+    parser.add_argument('--topics-per-request', type=int, default=None,
+                        help='So sánh thêm chế độ gộp N chủ đề vào một request')
+    args = parser.parse_args()
+
+    from generator_google import QAGenerator
+    from llm_backends import StubBackend
+
+    try:
+        # Không cache / dedup / metrics: lần chạy thứ hai không được phát lại response cũ
+        backend = None if args.live else StubBackend(args.latency, args.jitter)
+        generator = QAGenerator(backend=backend, cache=False, dedup=False, metrics=False)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    benchmark_throughput(generator, args.pairs, args.max_in_flight)
+    if args.topics_per_request:
+        benchmark_batching(generator, args.pairs, args.topics_per_request)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+"""
+Benchmark Suite - Đo hiệu năng các đường xử lý nóng: parse, ghi, merge, phân tích
+Sinh dữ liệu Q&A tiếng Việt tổng hợp (có tỉ lệ trùng lặp), chạy từng phép đo
+trong một tiến trình riêng để lấy đúng thời gian, bộ nhớ đỉnh (RSS) và số
+dòng/giây; so với baseline JSON và báo lỗi khi hiệu năng giảm quá ngưỡng
+"""
+import io
+import os
+import sys
+import csv
+import json
+import time
+import random
+import platform
+import argparse
+import contextlib
+import multiprocessing
+from datetime import datetime
+from dotenv import load_dotenv
+
+try:
+    import resource
+except ImportError:  # Windows: không đo được RSS đỉnh
+    resource = None
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+BENCH_BASELINE = os.getenv('BENCH_BASELINE', 'bench_baseline.json')
+# Chậm hơn (dòng/giây) hoặc tốn bộ nhớ hơn (RSS đỉnh) quá tỉ lệ này so với baseline = hồi quy
+BENCH_THRESHOLD = float(os.getenv('BENCH_THRESHOLD', '0.2'))
+BENCH_DATA_DIR = os.getenv('BENCH_DATA_DIR', os.path.join('.qa_cache', 'bench'))
+# Chênh lệch RSS nhỏ hơn mức này (MB) không tính là hồi quy (nhiễu của allocator)
+RSS_TOLERANCE_MB = 16
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000, '10m': 10_000_000}
+RESPONSE_SIZES = (10, 30, 100, 300)
+CASES = ('parse', 'save_to_csv', 'merge', 'analyze')
+# Số cặp mỗi lần gọi save_to_csv (một chủ đề của một lượt marathon)
+SAVE_BATCH = 30
+# Tỉ lệ cặp trùng hoàn toàn trong dữ liệu tổng hợp
+DUPLICATE_RATE = 0.1
+
+# Kho từ để ghép câu hỏi / câu trả lời của người cao tuổi
+CALLS = ["", "Cháu ơi, ", "Ôi, ", "Này con, ", "Tôi hỏi chút, ", "Bà nói thật nhé, ", "Ông hỏi cái này, "]
+COMPLAINTS = [
+    "tôi quên uống thuốc huyết áp", "dạo này tôi mất ngủ", "đầu gối tôi nhức mỏi", "tôi thấy chóng mặt",
+    "con cháu đi làm hết", "tôi không biết gọi video", "có người gọi bảo tôi trúng thưởng",
+    "tôi muốn nấu canh chua", "nhà cửa bừa bộn quá", "tôi hay quên chìa khóa", "bụng tôi hơi đầy",
+    "mắt tôi dạo này mờ", "tôi muốn nghe cải lương", "sắp đến ngày giỗ ông nhà", "trời trở lạnh",
+    "tôi bị ho khan", "huyết áp tôi đo được 150", "tôi muốn tập thể dục nhẹ", "cháu tôi sắp thi đại học",
+    "điện thoại báo hết dung lượng", "tôi ăn không thấy ngon", "lưng tôi đau âm ỉ", "tôi buồn quá",
+    "tôi muốn gửi tiền tiết kiệm", "Zalo cứ hiện thông báo lạ", "tôi quên lịch tái khám",
+]
+TIMES = ["sáng nay", "tối qua", "mấy hôm nay", "từ tuần trước", "cả tháng nay", "lúc nãy", "chiều qua",
+         "hôm kia", "đêm qua", "mỗi khi trời mưa", "sau bữa trưa", "từ hồi Tết"]
+ENDINGS = ["giờ phải làm sao?", "có sao không cháu?", "cháu chỉ tôi với", "có nên đi khám không?",
+           "cháu nghĩ sao?", "tôi lo quá", "làm thế nào bây giờ?", "có cách nào không con?"]
+ANSWERS = [
+    "Dạ bác đừng lo lắng quá nhé.", "Cháu hiểu cảm giác của bác ạ.", "Bác nên nghỉ ngơi và uống nước ấm.",
+    "Nếu tình trạng kéo dài hơn hai ngày, bác nên đi khám bác sĩ ạ.", "Bác thử đi bộ nhẹ mười lăm phút mỗi sáng.",
+    "Cháu sẽ nhắc bác vào đúng giờ, bác yên tâm ạ.", "Bác tuyệt đối không chuyển tiền cho người lạ nhé.",
+    "Bác gọi cho con cháu để hỏi lại trước đã ạ.", "Bác ăn thêm rau xanh và chia nhỏ bữa ăn.",
+    "Bác đo lại huyết áp sau khi ngồi nghỉ năm phút.", "Cháu hướng dẫn bác từng bước một nhé.",
+    "Bác giữ ấm cổ và đầu gối khi trời lạnh ạ.", "Bác nhớ mang theo sổ khám bệnh khi đi tái khám.",
+    "Bác có thể nghe một bài cải lương cho thư giãn.", "Bác để chìa khóa cố định ở một chỗ dễ thấy.",
+]
+
+
+def synthetic_pairs(rows, seed=0, duplicate_rate=DUPLICATE_RATE):
+    """Sinh rows cặp Q&A tiếng Việt tổng hợp (xác định theo seed)
+
+    Khoảng duplicate_rate số cặp là bản lặp lại của một cặp gần đó (trùng hoàn
+    toàn, như model sinh lại câu cũ); phần còn lại hầu như không trùng.
+    """
+    rng = random.Random(seed)
+    recent = []
+    for i in range(rows):
+        if recent and rng.random() < duplicate_rate:
+            yield dict(rng.choice(recent))
+            continue
+        question = (f"{rng.choice(CALLS)}{rng.choice(COMPLAINTS)} {rng.choice(TIMES)}, "
+                    f"{rng.choice(ENDINGS)}").capitalize()
+        answer = " ".join(rng.sample(ANSWERS, rng.randint(2, 5)))
+        qa = {'input': question, 'output': f"{answer} (#{i})", 'topic': str(i % 12 + 1)}
+        recent.append(qa)
+        if len(recent) > 1000:
+            recent.pop(0)
+        yield qa
+
+
+def synthetic_response(num_pairs, seed=0):
+    """Văn bản response dạng INPUT:/OUTPUT:/--- như Gemini, có lời dẫn và câu trả lời nhiều dòng"""
+    blocks = ["Dưới đây là các cặp dữ liệu theo yêu cầu:"]
+    for i, qa in enumerate(synthetic_pairs(num_pairs, seed, duplicate_rate=0)):
+        output = qa['output'].replace('. ', '.\n', 1) if i % 5 == 0 else qa['output']
+        blocks.append(f"INPUT: {qa['input']}\nOUTPUT: {output}")
+    return "\n---\n".join(blocks) + "\n---\n"
+
+
+def write_synthetic_dataset(path, rows, seed=0, duplicate_rate=DUPLICATE_RATE):
+    """Ghi dataset tổng hợp ra CSV theo kiểu stream (ghi file tạm rồi đổi tên)"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['input', 'output', 'topic'])
+        writer.writeheader()
+        writer.writerows(synthetic_pairs(rows, seed, duplicate_rate))
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def dataset_files(rows, data_dir=BENCH_DATA_DIR):
+    """Các file dữ liệu của một mức (sinh một lần, dùng lại giữa các lần chạy)
+
+    main: rows cặp; delta: rows/4 cặp, một nửa trùng với main (đầu vào của merge).
+    """
+    main_path = os.path.join(data_dir, f"synthetic_{rows}.csv")
+    delta_path = os.path.join(data_dir, f"synthetic_{rows}_delta.csv")
+    if not os.path.exists(main_path):
+        print(f"🧪 Đang sinh dữ liệu tổng hợp {rows:,} dòng: {main_path}")
+        write_synthetic_dataset(main_path, rows, seed=rows)
+    if not os.path.exists(delta_path):
+        delta_rows = max(1, rows // 4)
+        with open(delta_path + '.tmp', 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['input', 'output', 'topic'])
+            writer.writeheader()
+            # Cùng seed với main nên nửa đầu trùng đúng các dòng đầu của main
+            writer.writerows(synthetic_pairs(delta_rows // 2, seed=rows))
+            writer.writerows(synthetic_pairs(delta_rows - delta_rows // 2, seed=rows + 1))
+        os.replace(delta_path + '.tmp', delta_path)
+    return main_path, delta_path
+
+
+def _peak_rss_mb():
+    """RSS đỉnh (MB) của tiến trình này và các tiến trình con của nó"""
+    if resource is None:
+        return None
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024  # macOS trả về byte, Linux trả về KB
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak / scale, 1)
+
+
+def _bench_parse(rows, response_pairs, data_dir):
+    from generator_google import QAGenerator
+    from llm_backends import StubBackend
+
+    generator = QAGenerator(backend=StubBackend(seed=0), cache=False, dedup=False, metrics=False)
+    text = synthetic_response(response_pairs)
+    responses = -(-rows // response_pairs)
+    parsed = 0
+    start = time.perf_counter()
+    for _ in range(responses):
+        parsed += len(generator.parse_qa_response(text, '1'))
+    return parsed, time.perf_counter() - start
+
+
+def _bench_save_to_csv(rows, _, data_dir):
+    from generator_google import QAGenerator
+    from llm_backends import StubBackend
+
+    generator = QAGenerator(backend=StubBackend(seed=0), cache=False, dedup=False, metrics=False)
+    # Kho cặp cố định, ghi lặp vòng: bộ nhớ không phụ thuộc số dòng cần ghi
+    pool = list(synthetic_pairs(min(rows, 100_000)))
+    path = os.path.join(data_dir, f"bench_save_to_csv_{os.getpid()}.csv")
+    written = 0
+    try:
+        start = time.perf_counter()
+        while written < rows:
+            offset = written % len(pool)
+            batch = pool[offset:offset + min(SAVE_BATCH, rows - written)]
+            generator.save_to_csv(batch, path, verbose=False)
+            written += len(batch)
+        return written, time.perf_counter() - start
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _bench_merge(rows, _, data_dir):
+    from qa_manager import QAManager
+
+    files = [os.path.abspath(path) for path in dataset_files(rows, data_dir)]
+    input_rows = rows + max(1, rows // 4)
+    workdir = os.path.join(data_dir, f"merge_{os.getpid()}")
+    os.makedirs(workdir, exist_ok=True)
+    previous = os.getcwd()
+    os.chdir(workdir)  # _merge_files ghi merged_dataset_<thời gian> vào thư mục hiện tại
+    try:
+        start = time.perf_counter()
+        QAManager()._merge_files(files)
+        return input_rows, time.perf_counter() - start
+    finally:
+        os.chdir(previous)
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+
+def _bench_analyze(rows, _, data_dir):
+    from dataset_catalog import sidecar_path
+    from qa_manager import QAManager
+
+    path = dataset_files(rows, data_dir)[0]
+    # Luôn đo trường hợp chưa có sidecar (phải đọc và tính thống kê toàn bộ file)
+    if os.path.exists(sidecar_path(path)):
+        os.remove(sidecar_path(path))
+    start = time.perf_counter()
+    QAManager()._analyze_file(path)
+    return rows, time.perf_counter() - start
+
+
+BENCHMARKS = {
+    'parse': _bench_parse,
+    'save_to_csv': _bench_save_to_csv,
+    'merge': _bench_merge,
+    'analyze': _bench_analyze,
+}
+
+
+def _case_worker(case, rows, param, data_dir, connection):
+    """Chạy một phép đo trong tiến trình riêng, gửi kết quả về qua connection"""
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            measured_rows, seconds = BENCHMARKS[case](rows, param, data_dir)
+        connection.send({'rows': measured_rows, 'seconds': round(seconds, 4),
+                         'rows_per_sec': round(measured_rows / seconds, 1) if seconds else None,
+                         'peak_rss_mb': _peak_rss_mb()})
+    except Exception as e:
+        connection.send({'error': f"{type(e).__name__}: {e}"})
+    finally:
+        connection.close()
+
+
+def run_case(case, rows, param=None, data_dir=BENCH_DATA_DIR):
+    """Chạy một phép đo trong tiến trình mới (spawn) để RSS đỉnh không lẫn với phép đo khác"""
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_case_worker, args=(case, rows, param, data_dir, sender))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {'error': f"tiến trình đo thoát với mã {process.exitcode}"}
+    process.join()
+    return result
+
+
+def case_id(case, rows, param=None):
+    label = next((name for name, value in SIZES.items() if value == rows), str(rows))
+    return f"{case}[{param} cặp/response]@{label}" if case == 'parse' else f"{case}@{label}"
+
+
+def run_suite(sizes, cases=CASES, response_sizes=RESPONSE_SIZES, repeat=1, data_dir=BENCH_DATA_DIR,
+              on_result=None):
+    """Chạy các phép đo cho từng mức số dòng, trả về {mã phép đo: kết quả}
+
+    repeat > 1: lấy lần chạy nhanh nhất (thời gian) và RSS đỉnh lớn nhất.
+    on_result(mã, kết quả) được gọi sau mỗi phép đo.
+    """
+    results = {}
+    for rows in sizes:
+        if {'merge', 'analyze'} & set(cases):
+            dataset_files(rows, data_dir)  # Sinh dữ liệu trước, ngoài thời gian đo
+        for case in cases:
+            for param in (response_sizes if case == 'parse' else (None,)):
+                runs = [run_case(case, rows, param, data_dir) for _ in range(repeat)]
+                errors = [run['error'] for run in runs if 'error' in run]
+                if errors:
+                    result = {'error': errors[0]}
+                else:
+                    result = dict(min(runs, key=lambda run: run['seconds']))
+                    peaks = [run['peak_rss_mb'] for run in runs if run['peak_rss_mb'] is not None]
+                    result['peak_rss_mb'] = max(peaks) if peaks else None
+                results[case_id(case, rows, param)] = result
+                if on_result:
+                    on_result(case_id(case, rows, param), result)
+    return results
+
+
+def compare(results, baseline, threshold=BENCH_THRESHOLD):
+    """So với baseline, trả về danh sách (mã phép đo, mô tả hồi quy)"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base or 'error' in base:
+            continue
+        if 'error' in result:
+            regressions.append((name, f"lỗi: {result['error']}"))
+            continue
+        if base.get('rows_per_sec') and result['rows_per_sec'] < base['rows_per_sec'] * (1 - threshold):
+            regressions.append((name, f"{result['rows_per_sec']:,.0f} dòng/giây, baseline "
+                                      f"{base['rows_per_sec']:,.0f} ({result['rows_per_sec'] / base['rows_per_sec'] - 1:+.0%})"))
+        if (base.get('peak_rss_mb') and result.get('peak_rss_mb')
+                and result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + threshold)
+                and result['peak_rss_mb'] - base['peak_rss_mb'] > RSS_TOLERANCE_MB):
+            regressions.append((name, f"RSS đỉnh {result['peak_rss_mb']:.0f} MB, baseline "
+                                      f"{base['peak_rss_mb']:.0f} MB ({result['peak_rss_mb'] / base['peak_rss_mb'] - 1:+.0%})"))
+    return regressions
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_baseline(path, results):
+    """Ghi kết quả thành baseline, giữ lại các phép đo cũ không chạy lần này"""
+    baseline = load_baseline(path) or {'results': {}}
+    baseline['results'].update(results)
+    baseline.update(version=1, updated_at=datetime.now().isoformat(timespec='seconds'), machine=machine_info())
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def machine_info():
+    return {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()}
+
+
+def _parse_sizes(spec):
+    sizes = []
+    for item in filter(None, (part.strip().lower() for part in spec.split(','))):
+        if item in SIZES:
+            sizes.append(SIZES[item])
+        elif item.isdigit():
+            sizes.append(int(item))
+        else:
+            raise argparse.ArgumentTypeError(f"mức không hợp lệ: {item} (vd. {', '.join(SIZES)} hoặc số dòng)")
+    return sizes
+
+
+def main():
+    """Chạy benchmark từ dòng lệnh; mã thoát 1 nếu có hồi quy so với baseline"""
+    parser = argparse.ArgumentParser(description="Benchmark parse / save_to_csv / merge / analyze")
+    parser.add_argument('--sizes', type=_parse_sizes, default=[SIZES['10k']],
+                        help='Các mức số dòng, vd. 10k,1m,10m (mặc định 10k)')
+    parser.add_argument('--cases', default=','.join(CASES), help=f"Các phép đo ({', '.join(CASES)})")
+    parser.add_argument('--response-sizes', default=','.join(map(str, RESPONSE_SIZES)),
+                        help='Số cặp mỗi response của phép đo parse')
+    parser.add_argument('--repeat', type=int, default=3, help='Số lần chạy mỗi phép đo (lấy lần nhanh nhất)')
+    parser.add_argument('--baseline', default=BENCH_BASELINE, help='File baseline JSON')
+    parser.add_argument('--threshold', type=float, default=BENCH_THRESHOLD,
+                        help='Tỉ lệ chậm hơn / tốn bộ nhớ hơn được coi là hồi quy (mặc định 0.2)')
+    parser.add_argument('--save-baseline', action='store_true', help='Ghi kết quả lần này làm baseline')
+    parser.add_argument('--output', help='Ghi kết quả lần này ra file JSON')
+    parser.add_argument('--data-dir', default=BENCH_DATA_DIR, help='Thư mục dữ liệu tổng hợp')
+    args = parser.parse_args()
+
+    cases = [case.strip() for case in args.cases.split(',') if case.strip()]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error(f"phép đo không hợp lệ: {', '.join(sorted(unknown))}")
+    response_sizes = [int(size) for size in args.response_sizes.split(',') if size.strip()]
+    baseline = None if args.save_baseline else load_baseline(args.baseline)
+
+    print(f"🏁 Benchmark: {', '.join(cases)} | mức {', '.join(f'{rows:,}' for rows in args.sizes)} dòng | "
+          f"{args.repeat} lần/phép đo")
+    print(f"   {'Phép đo':<34} | {'Dòng':>10} | {'Giây':>8} | {'Dòng/giây':>12} | {'RSS đỉnh':>9} | So với baseline")
+
+    def report(name, result):
+        if 'error' in result:
+            print(f"   {name:<34} | ❌ {result['error']}")
+            return
+        base = (baseline or {}).get('results', {}).get(name)
+        delta = (f"{result['rows_per_sec'] / base['rows_per_sec'] - 1:+.0%}"
+                 if base and base.get('rows_per_sec') and result['rows_per_sec'] else '-')
+        rss = f"{result['peak_rss_mb']:.0f} MB" if result['peak_rss_mb'] is not None else '-'
+        print(f"   {name:<34} | {result['rows']:>10,} | {result['seconds']:>8.2f} | "
+              f"{result['rows_per_sec'] or 0:>12,.0f} | {rss:>9} | {delta}")
+
+    results = run_suite(args.sizes, cases, response_sizes, max(1, args.repeat), args.data_dir, report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'machine': machine_info(), 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"📁 Kết quả: {args.output}")
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"💾 Đã lưu baseline: {args.baseline}")
+        return
+    if baseline is None:
+        print(f"ℹ️ Chưa có baseline ({args.baseline}); chạy với --save-baseline để tạo")
+        return
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n❌ {len(regressions)} hồi quy vượt ngưỡng {args.threshold:.0%}:")
+        for name, message in regressions:
+            print(f"   {name}: {message}")
+        sys.exit(1)
+    print(f"\n✅ Không có hồi quy vượt ngưỡng {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
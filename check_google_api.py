@@ -3,7 +3,7 @@ Kiểm tra kết nối Google Gemini API
 """
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
+from llm_backends import GeminiBackend
 
 def check_google_api():
     """Kiểm tra Google Gemini API"""
@@ -21,11 +21,10 @@ def check_google_api():
     
     try:
         # Cấu hình và test API
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
+        backend = GeminiBackend(api_key)
         
         # Test với câu hỏi đơn giản
-        response = model.generate_content("Xin chào! Bạn có khỏe không?")
+        response = backend.generate("Xin chào! Bạn có khỏe không?")
         
         print("✅ Kết nối Google Gemini API thành công!")
         print(f"📝 Phản hồi test: {response.text[:100]}...")
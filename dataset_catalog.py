@@ -0,0 +1,189 @@
+"""
+Dataset Catalog - Danh mục các file dataset kèm thống kê lưu sẵn trong file sidecar
+Mỗi file X.csv có sidecar .X.csv.stats.json (số dòng, dung lượng, schema, thống kê của dataset_stats);
+sidecar hết hạn khi kích thước hoặc mtime của file thay đổi, file mới được tính ở nền
+"""
+import os
+import sys
+import json
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from dataset_io import scan_dataset_files
+from dataset_stats import analyze_file
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+# Số luồng tính thống kê ở nền
+CATALOG_WORKERS = int(os.getenv('CATALOG_WORKERS', '2'))
+# Tăng khi nội dung sidecar thay đổi để các sidecar cũ được tính lại
+STATS_VERSION = 2
+
+
+def sidecar_path(path):
+    """Đường dẫn sidecar (file ẩn cạnh file dữ liệu)"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f'.{name}.stats.json')
+
+
+class DatasetCatalog:
+    def __init__(self, root='.', workers=None):
+        """Danh mục các file CSV/Parquet dưới root
+
+        Thống kê của mỗi file được lưu trong sidecar và dùng lại khi kích thước
+        và mtime của file không đổi; file mới/đã đổi được tính ở nền bằng
+        ThreadPoolExecutor (CATALOG_WORKERS luồng).
+        """
+        self.root = root
+        self.workers = workers or CATALOG_WORKERS
+        self._executor = None
+        self._pending = {}  # path -> Future
+        self._memory = {}   # path -> stats (khi không ghi được sidecar)
+        self._lock = threading.Lock()
+
+    def _load_sidecar(self, path, size, mtime):
+        """Thống kê đã lưu nếu còn hợp lệ, ngược lại None
+
+        Bản trong bộ nhớ (lỗi đọc file, thư mục chỉ đọc) được ưu tiên khi còn
+        hợp lệ; bản cũ bị bỏ để sidecar trên đĩa được dùng.
+        """
+        def valid(cached):
+            return (cached.get('version') == STATS_VERSION and cached.get('size') == size
+                    and cached.get('mtime') == mtime)
+
+        cached = self._memory.get(path)
+        if cached is not None:
+            if valid(cached):
+                return cached
+            self._memory.pop(path, None)
+        try:
+            with open(sidecar_path(path), encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cached if valid(cached) else None
+
+    def _compute(self, path, size, mtime):
+        """Tính thống kê và ghi sidecar (ghi file tạm rồi đổi tên)
+
+        File không đọc được chỉ được ghi nhớ lỗi trong bộ nhớ (không tính lại
+        cho đến khi file thay đổi).
+        """
+        try:
+            stats = analyze_file(path).summary()
+        except Exception as e:
+            stats = {'error': str(e), 'version': STATS_VERSION, 'size': size, 'mtime': mtime}
+            self._memory[path] = stats
+            return stats
+        stats.update(version=STATS_VERSION, size=size, mtime=mtime,
+                     computed_at=datetime.now().isoformat(timespec='seconds'))
+        target = sidecar_path(path)
+        try:
+            with open(target + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(stats, f, ensure_ascii=False)
+            os.replace(target + '.tmp', target)
+            self._memory.pop(path, None)
+        except OSError:
+            # Thư mục chỉ đọc: giữ thống kê trong bộ nhớ cho phiên này
+            self._memory[path] = stats
+        return stats
+
+    def _submit(self, path, size, mtime):
+        with self._lock:
+            future = self._pending.get(path)
+            if future is None or future.done():
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix='catalog')
+                future = self._executor.submit(self._compute, path, size, mtime)
+                self._pending[path] = future
+            return future
+
+    def entries(self, exclude_outputs=False, exclude=()):
+        """Danh sách file kèm thống kê, trả về ngay lập tức
+
+        Mỗi phần tử: {'path', 'size', 'mtime', 'stats'}; 'stats' là None khi
+        file đang được tính ở nền (gọi wait() hoặc stats() để chờ).
+        """
+        result = []
+        for path, stat in scan_dataset_files(self.root, exclude_outputs, exclude):
+            stats = self._load_sidecar(path, stat.st_size, stat.st_mtime)
+            if stats is None:
+                self._submit(path, stat.st_size, stat.st_mtime)
+            result.append({'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime, 'stats': stats})
+        return result
+
+    def stats(self, path):
+        """Thống kê của một file, tính ngay (và ghi sidecar) nếu chưa có"""
+        stat = os.stat(path)
+        stats = self._load_sidecar(path, stat.st_size, stat.st_mtime)
+        if stats is None:
+            stats = self._submit(path, stat.st_size, stat.st_mtime).result()
+        return stats
+
+    def pending(self):
+        """Số file còn đang được tính ở nền"""
+        with self._lock:
+            return sum(1 for future in self._pending.values() if not future.done())
+
+    def wait(self):
+        """Chờ mọi phép tính nền hoàn tất; trả về số file không đọc được"""
+        with self._lock:
+            futures = list(self._pending.values())
+        return sum(1 for future in futures if 'error' in future.result())
+
+    def forget(self, path):
+        """Xóa sidecar của một file (gọi khi xóa file dữ liệu)"""
+        self._memory.pop(path, None)
+        if os.path.exists(sidecar_path(path)):
+            os.remove(sidecar_path(path))
+
+    def close(self):
+        """Dừng luồng nền, bỏ các phép tính chưa bắt đầu"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def describe_entry(entry):
+    """Mô tả ngắn một file trong danh mục: dung lượng và số dòng"""
+    size = entry['size'] / 1024
+    size_text = f"{size / 1024:.1f} MB" if size >= 1024 else f"{size:.1f} KB"
+    if entry['stats'] is None:
+        return f"{size_text}, đang đếm dòng..."
+    if 'error' in entry['stats']:
+        return f"{size_text}, không đọc được"
+    return f"{size_text}, {entry['stats']['rows']} dòng"
+
+
+def main():
+    """Liệt kê các file dataset kèm số dòng (tính và lưu sidecar cho file mới)"""
+    parser = argparse.ArgumentParser(description="Danh mục dataset với thống kê lưu sẵn")
+    parser.add_argument('root', nargs='?', default='.', help='Thư mục cần quét')
+    parser.add_argument('--workers', type=int, default=None, help='Số luồng tính thống kê')
+    args = parser.parse_args()
+
+    catalog = DatasetCatalog(args.root, args.workers)
+    entries = catalog.entries()
+    if not entries:
+        print("📭 Không tìm thấy file dataset nào")
+        sys.exit(0)
+    if catalog.pending():
+        print(f"⏳ Đang tính thống kê cho {catalog.pending()} file mới...")
+        failed = catalog.wait()
+        if failed:
+            print(f"⚠️ {failed} file không đọc được")
+        entries = catalog.entries()
+    total_rows = 0
+    for entry in entries:
+        print(f"   📄 {entry['path']} ({describe_entry(entry)})")
+        total_rows += (entry['stats'] or {}).get('rows', 0)
+    print(f"📊 {len(entries)} file | {total_rows} dòng")
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main()
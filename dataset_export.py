@@ -0,0 +1,238 @@
+"""
+Dataset Export - Xuất dataset Q&A sang JSONL, định dạng chat (system/user/assistant) hoặc Alpaca
+Đọc và ghi theo kiểu stream, chia thành các shard giới hạn dung lượng,
+nén gzip/zstd song song theo từng khối (các khối nén nối tiếp nhau vẫn là file hợp lệ)
+"""
+import os
+import sys
+import json
+import gzip
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from dataset_io import FIELDNAMES, iter_dataset
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+# Dung lượng tối đa (chưa nén) của mỗi shard và của mỗi khối nén
+EXPORT_SHARD_MB = float(os.getenv('EXPORT_SHARD_MB', '256'))
+EXPORT_BLOCK_MB = float(os.getenv('EXPORT_BLOCK_MB', '4'))
+# Số luồng nén song song (zlib/zstd nhả GIL khi nén)
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', '0')) or os.cpu_count() or 1
+EXPORT_COMPRESSION = os.getenv('EXPORT_COMPRESSION', 'gzip').lower()
+DEFAULT_SYSTEM_PROMPT = os.getenv(
+    'EXPORT_SYSTEM_PROMPT',
+    "Bạn là trợ lý ảo chăm sóc người cao tuổi Việt Nam: luôn lễ phép, kiên nhẫn, "
+    "trả lời ngắn gọn, dễ hiểu và thật ân cần.")
+
+EXPORT_FORMATS = ('jsonl', 'chat', 'alpaca')
+COMPRESSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def require_zstandard():
+    """Báo lỗi rõ ràng nếu chưa cài zstandard"""
+    if zstandard is None:
+        raise ImportError("❌ Cần cài zstandard để nén zstd: pip install zstandard")
+
+
+def format_record(qa, export_format, system_prompt=None):
+    """Chuyển một cặp Q&A thành dict theo định dạng xuất"""
+    if export_format == 'chat':
+        return {'messages': [
+            {'role': 'system', 'content': system_prompt or DEFAULT_SYSTEM_PROMPT},
+            {'role': 'user', 'content': qa['input']},
+            {'role': 'assistant', 'content': qa['output']},
+        ]}
+    if export_format == 'alpaca':
+        return {'instruction': qa['input'], 'input': '', 'output': qa['output']}
+    return {'input': qa['input'], 'output': qa['output'], 'topic': qa.get('topic') or ''}
+
+
+def _compress_block(data, compression):
+    """Nén một khối thành một gzip member / zstd frame độc lập"""
+    if compression == 'gzip':
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return data
+
+
+class ShardWriter:
+    """Ghi các dòng JSONL vào chuỗi shard prefix-00000.jsonl[.gz|.zst]
+
+    Dữ liệu được gom thành khối EXPORT_BLOCK_MB và nén song song trên
+    ThreadPoolExecutor; các khối được ghi theo đúng thứ tự. Số khối đang
+    nén bị giới hạn nên bộ nhớ không phụ thuộc kích thước dataset.
+    Mỗi shard tối đa shard_bytes dữ liệu chưa nén, không cắt đôi một dòng.
+    executor: ThreadPoolExecutor dùng chung giữa nhiều writer (vd. một writer
+    cho mỗi tập × chủ đề khi chia dataset); khi đó mỗi writer chỉ giữ một
+    khối đang nén và không tự dừng executor.
+    """
+
+    def __init__(self, prefix, compression=None, shard_bytes=None, block_bytes=None, workers=None,
+                 executor=None):
+        self.prefix = prefix
+        self.compression = (compression or EXPORT_COMPRESSION).lower()
+        if self.compression not in COMPRESSIONS:
+            raise ValueError(f"❌ Kiểu nén không hợp lệ: {self.compression} (chọn {', '.join(COMPRESSIONS)})")
+        if self.compression == 'zstd':
+            require_zstandard()
+        self.shard_bytes = int(shard_bytes or EXPORT_SHARD_MB * 1024 * 1024)
+        self.block_bytes = min(int(block_bytes or EXPORT_BLOCK_MB * 1024 * 1024), self.shard_bytes)
+        self.workers = max(1, workers or EXPORT_WORKERS)
+        self.shards = []  # [{'path', 'rows', 'bytes', 'compressed_bytes'}]
+
+        directory = os.path.dirname(prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='export')
+        self._max_in_flight = self.workers * 2 if self._owns_executor else 1
+        self._in_flight = deque()
+        self._block = []
+        self._block_size = 0
+        self._file = None
+        self._shard = None
+
+    def _open_shard(self):
+        path = f"{self.prefix}-{len(self.shards):05d}.jsonl{COMPRESSIONS[self.compression]}"
+        self._file = open(path + '.tmp', 'wb')
+        self._shard = {'path': path, 'rows': 0, 'bytes': 0, 'compressed_bytes': 0}
+        self.shards.append(self._shard)
+
+    def _drain(self, limit):
+        """Ghi các khối đã nén (theo thứ tự) cho đến khi còn tối đa limit khối đang nén"""
+        while len(self._in_flight) > limit:
+            data = self._in_flight.popleft().result()
+            self._file.write(data)
+            self._shard['compressed_bytes'] += len(data)
+
+    def _submit_block(self):
+        if not self._block:
+            return
+        data = b''.join(self._block)
+        self._block = []
+        self._block_size = 0
+        self._in_flight.append(self._executor.submit(_compress_block, data, self.compression))
+        self._drain(self._max_in_flight)
+
+    def _close_shard(self):
+        if self._file is None:
+            return
+        self._submit_block()
+        self._drain(0)
+        self._file.close()
+        os.replace(self._file.name, self._shard['path'])
+        self._file = None
+
+    def write_line(self, line):
+        """Thêm một dòng JSON (không có ký tự xuống dòng)"""
+        data = line.encode('utf-8') + b'\n'
+        if self._file is not None and self._shard['bytes'] + len(data) > self.shard_bytes and self._shard['rows']:
+            self._close_shard()
+        if self._file is None:
+            self._open_shard()
+        self._block.append(data)
+        self._block_size += len(data)
+        self._shard['rows'] += 1
+        self._shard['bytes'] += len(data)
+        if self._block_size >= self.block_bytes:
+            self._submit_block()
+
+    def close(self):
+        """Ghi nốt khối cuối, đóng shard và dừng các luồng nén (nếu executor là của riêng writer)"""
+        self._close_shard()
+        if self._owns_executor:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def export_dataset(files, prefix, export_format='jsonl', compression=None, shard_bytes=None,
+                   workers=None, system_prompt=None, chunksize=50_000, on_file=None):
+    """Xuất các file CSV/Parquet thành shard JSONL theo định dạng export_format
+
+    Dữ liệu đi qua từng chunk một, nên bộ nhớ không phụ thuộc số cặp.
+    Cặp thiếu input/output bị bỏ qua. Ghi thêm prefix.manifest.json liệt kê
+    các shard. on_file(path, rows, error) được gọi sau mỗi file.
+    Trả về dict thống kê.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"❌ Định dạng không hợp lệ: {export_format} (chọn {', '.join(EXPORT_FORMATS)})")
+    stats = {'rows': 0, 'skipped': 0, 'files': 0, 'failed': []}
+    with ShardWriter(prefix, compression, shard_bytes, workers=workers) as writer:
+        for path in files:
+            rows = 0
+            try:
+                for chunk in iter_dataset(path, FIELDNAMES, chunksize):
+                    chunk = chunk.reindex(columns=FIELDNAMES)
+                    chunk['topic'] = chunk['topic'].astype(object).fillna('')
+                    valid = chunk['input'].notna() & chunk['output'].notna()
+                    stats['skipped'] += int((~valid).sum())
+                    for qa in chunk[valid].to_dict('records'):
+                        writer.write_line(json.dumps(format_record(qa, export_format, system_prompt),
+                                                     ensure_ascii=False))
+                    rows += int(valid.sum())
+            except Exception as e:
+                stats['failed'].append(path)
+                if on_file:
+                    on_file(path, rows, e)
+                continue
+            stats['files'] += 1
+            stats['rows'] += rows
+            if on_file:
+                on_file(path, rows, None)
+
+    manifest = {'format': export_format, 'compression': writer.compression, 'rows': stats['rows'],
+                'sources': [path for path in files if path not in stats['failed']], 'shards': writer.shards}
+    with open(prefix + '.manifest.json', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    stats['shards'] = writer.shards
+    stats['manifest'] = prefix + '.manifest.json'
+    return stats
+
+
+def main():
+    """Xuất dataset từ dòng lệnh"""
+    parser = argparse.ArgumentParser(description="Xuất dataset Q&A sang JSONL / chat / Alpaca theo shard")
+    parser.add_argument('files', nargs='+', help='Các file CSV/Parquet cần xuất')
+    parser.add_argument('-o', '--output', required=True, help='Tiền tố shard (vd. exports/elderly_chat)')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='jsonl', help='Định dạng bản ghi')
+    parser.add_argument('--compression', choices=list(COMPRESSIONS), default=None,
+                        help='Kiểu nén (mặc định EXPORT_COMPRESSION)')
+    parser.add_argument('--shard-mb', type=float, default=None, help='Dung lượng tối đa mỗi shard (chưa nén)')
+    parser.add_argument('--workers', type=int, default=None, help='Số luồng nén')
+    args = parser.parse_args()
+
+    def report(path, rows, error):
+        if error:
+            print(f"   ❌ {path}: {error}")
+        else:
+            print(f"   ✅ {path}: {rows} cặp")
+
+    try:
+        stats = export_dataset(args.files, args.output, args.format, args.compression,
+                               args.shard_mb and int(args.shard_mb * 1024 * 1024), args.workers, on_file=report)
+    except (ImportError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+    for shard in stats['shards']:
+        print(f"   📦 {shard['path']}: {shard['rows']} cặp | {shard['bytes'] / 1024 / 1024:.1f} MB → "
+              f"{shard['compressed_bytes'] / 1024 / 1024:.1f} MB")
+    print(f"📊 Đã xuất {stats['rows']} cặp ({stats['skipped']} cặp thiếu dữ liệu bị bỏ qua)")
+    print(f"📁 Manifest: {stats['manifest']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,630 @@
+"""
+Dataset IO - Đọc/ghi dataset Q&A dạng CSV hoặc Parquet (cột, nén, topic mã hóa từ điển)
+Parquet cần pyarrow (tùy chọn); không có pyarrow thì vẫn dùng CSV như cũ
+"""
+import os
+import csv
+import sys
+import fnmatch
+import shutil
+import time
+import argparse
+import pandas as pd
+from dotenv import load_dotenv
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+FIELDNAMES = ['input', 'output', 'topic']
+
+# Định dạng file đầu ra mặc định: 'csv' hoặc 'parquet'
+OUTPUT_FORMAT = os.getenv('OUTPUT_FORMAT', 'csv').lower()
+# Số dòng mỗi row group và codec nén của Parquet
+PARQUET_ROW_GROUP_SIZE = int(os.getenv('PARQUET_ROW_GROUP_SIZE', '100000'))
+PARQUET_COMPRESSION = os.getenv('PARQUET_COMPRESSION', 'zstd')
+# DatasetWriter: ghi bộ đệm xuống file sau mỗi N dòng hoặc T giây, và chính sách fsync
+# 'batch' = fsync mỗi lần flush, 'close' = chỉ fsync khi đóng, 'never' = để hệ điều hành tự ghi
+DATASET_FLUSH_ROWS = int(os.getenv('DATASET_FLUSH_ROWS', '500'))
+DATASET_FLUSH_SECONDS = float(os.getenv('DATASET_FLUSH_SECONDS', '2.0'))
+DATASET_FSYNC = os.getenv('DATASET_FSYNC', 'batch').lower()
+FSYNC_POLICIES = ('batch', 'close', 'never')
+
+# Tên file kết quả gộp: không được coi là dữ liệu đầu vào khi gộp lần sau
+MERGED_OUTPUT_PATTERNS = ('merged_dataset_*',)
+
+# Parquet không ghi nối được: dòng thêm vào X.parquet nằm trong các segment (mỗi segment
+# một file Parquet hoàn chỉnh) trong thư mục ẩn .X.parquet.segments/, tên theo khoảng số
+# thứ tự lần ghi nối mà nó chứa (00000003-00000004.parquet). File chính ghi trong metadata
+# số thứ tự segment cuối cùng đã được gộp vào nó; segment cũ hơn bị bỏ qua.
+SEGMENTS_METADATA_KEY = b'qa_segments_through'
+
+
+def require_pyarrow():
+    """Báo lỗi rõ ràng nếu chưa cài pyarrow"""
+    if pa is None:
+        raise ImportError("❌ Cần cài pyarrow để dùng Parquet: pip install pyarrow")
+
+
+def is_parquet(path):
+    return str(path).lower().endswith('.parquet')
+
+
+def scan_dataset_files(root='.', exclude_outputs=False, exclude=()):
+    """Duyệt cây thư mục bằng os.scandir, trả về [(đường dẫn, os.stat_result)] của mọi CSV/Parquet
+
+    Thư mục/file ẩn (vd. .qa_cache, sidecar thống kê) được bỏ qua; stat lấy
+    luôn từ DirEntry nên không tốn thêm lời gọi hệ thống cho mỗi file.
+    exclude_outputs: bỏ các file kết quả gộp trước đó (MERGED_OUTPUT_PATTERNS)
+    exclude: các đường dẫn cần bỏ thêm (vd. dataset chính)
+    """
+    excluded = {os.path.abspath(path) for path in exclude}
+    result = []
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+                continue
+            if not entry.name.lower().endswith(('.csv', '.parquet')):
+                continue
+            if exclude_outputs and any(fnmatch.fnmatch(entry.name, pattern) for pattern in MERGED_OUTPUT_PATTERNS):
+                continue
+            path = os.path.normpath(entry.path)
+            if os.path.abspath(path) in excluded:
+                continue
+            try:
+                result.append((path, entry.stat()))
+            except OSError:
+                continue
+    return sorted(result)
+
+
+def find_dataset_files(root='.', exclude_outputs=False, exclude=()):
+    """Tìm mọi file CSV/Parquet dưới root (mỗi file một lần, đã sắp xếp)"""
+    return [path for path, _ in scan_dataset_files(root, exclude_outputs, exclude)]
+
+
+def dataset_extension(output_format=None):
+    """Phần mở rộng file theo định dạng đầu ra ('.csv' hoặc '.parquet')"""
+    return '.parquet' if (output_format or OUTPUT_FORMAT) == 'parquet' else '.csv'
+
+
+def parquet_schema():
+    """Schema Parquet: input/output dạng chuỗi, topic mã hóa từ điển (ít giá trị lặp lại)"""
+    require_pyarrow()
+    return pa.schema([
+        ('input', pa.string()),
+        ('output', pa.string()),
+        ('topic', pa.dictionary(pa.int32(), pa.string())),
+    ])
+
+
+def _record_batch(inputs, outputs, topics, schema):
+    """Tạo RecordBatch từ ba cột (list hoặc Series); topic rỗng được lưu là null"""
+    columns = [
+        pa.array(inputs, type=pa.string(), from_pandas=True),
+        pa.array(outputs, type=pa.string(), from_pandas=True),
+        pa.array([topic or None for topic in topics], type=pa.string()).dictionary_encode(),
+    ]
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def segments_dir(path):
+    """Thư mục ẩn chứa các segment ghi nối của một dataset Parquet"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f'.{name}.segments')
+
+
+def _segment_files(path):
+    """[(đầu, cuối, đường dẫn)] của mọi file segment (kể cả segment đã cũ), theo thứ tự"""
+    directory = segments_dir(path)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    segments = []
+    for name in names:
+        stem, extension = os.path.splitext(name)
+        first, _, last = stem.partition('-')
+        if extension == '.parquet' and first.isdigit() and last.isdigit():
+            segments.append((int(first), int(last), os.path.join(directory, name)))
+    return sorted(segments)
+
+
+def _segments_through(path):
+    """Số thứ tự segment cuối cùng đã được gộp vào file chính (0 nếu chưa có)"""
+    if not os.path.exists(path):
+        return 0
+    metadata = pq.read_schema(path).metadata or {}
+    return int(metadata.get(SEGMENTS_METADATA_KEY, b'0'))
+
+
+def _live_segments(path):
+    """Các segment còn hiệu lực: chưa được gộp vào file chính hay vào segment lớn hơn
+
+    Segment cũ chỉ còn sót lại khi tiến trình bị ngắt giữa lúc gộp; chúng
+    bị bỏ qua khi đọc và được xóa ở lần gộp sau.
+    """
+    through = _segments_through(path)
+    segments = [segment for segment in _segment_files(path) if segment[1] > through]
+    return [(first, last, segment_path) for first, last, segment_path in segments
+            if not any(other[0] <= first and last <= other[1] and (other[0], other[1]) != (first, last)
+                       for other in segments)]
+
+
+def parquet_parts(path):
+    """Các file Parquet tạo nên dataset, theo thứ tự dòng: file chính rồi các segment"""
+    parts = [path] if os.path.exists(path) else []
+    return parts + [segment_path for _, _, segment_path in _live_segments(path)]
+
+
+def remove_parquet_segments(path, through=None):
+    """Xóa các segment có số thứ tự <= through (mặc định: mọi segment) của dataset"""
+    for _, last, segment_path in _segment_files(path):
+        if through is None or last <= through:
+            os.remove(segment_path)
+    try:
+        os.rmdir(segments_dir(path))
+    except OSError:
+        pass
+
+
+def remove_dataset(path):
+    """Xóa một file dataset cùng các segment Parquet của nó"""
+    if os.path.exists(path):
+        os.remove(path)
+    if is_parquet(path):
+        remove_parquet_segments(path)
+
+
+def replace_dataset(source, target):
+    """Chuyển source thành target (có thể khác ổ đĩa), bỏ các segment của target cũ"""
+    shutil.move(source, target)
+    if is_parquet(target):
+        remove_parquet_segments(target)
+
+
+class ParquetDatasetWriter:
+    """Ghi dataset Q&A ra một file Parquet, gom dòng thành từng row group
+
+    Dữ liệu được ghi ra file tạm và chỉ đổi tên thành path khi close(),
+    nên file Parquet luôn hoàn chỉnh (có footer) khi xuất hiện. File mới
+    thay thế cả các segment ghi nối cũ của path (xem append_parquet).
+    """
+
+    def __init__(self, path, row_group_size=None, compression=None, fsync=True):
+        require_pyarrow()
+        self.path = path
+        self.row_group_size = row_group_size or PARQUET_ROW_GROUP_SIZE
+        self.compression = compression or PARQUET_COMPRESSION
+        self.schema = parquet_schema()
+        self.fsync = fsync
+        self.rows_written = 0
+        self._rows = []
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._temp_path = path + '.tmp'
+        # Mọi segment đang có được coi là đã nằm trong file mới (file mới thay thế cả dataset)
+        self._through = max((last for _, last, _ in _segment_files(path)), default=0)
+        schema = self.schema.with_metadata({SEGMENTS_METADATA_KEY: str(self._through).encode()})
+        self._writer = pq.ParquetWriter(self._temp_path, schema, compression=self.compression)
+
+    def write(self, qa):
+        """Thêm một cặp Q&A, ghi row group khi đủ row_group_size dòng"""
+        self._rows.append(qa)
+        if len(self._rows) >= self.row_group_size:
+            self.flush()
+
+    def write_many(self, qa_pairs):
+        for qa in qa_pairs:
+            self.write(qa)
+
+    def write_frame(self, frame):
+        """Ghi một DataFrame có các cột input, output (và topic nếu có), không qua dict từng dòng"""
+        self.flush()
+        if frame.empty:
+            return
+        topics = frame['topic'].astype(object).where(frame['topic'].notna(), None) \
+            if 'topic' in frame.columns else [None] * len(frame)
+        batch = _record_batch(frame['input'].astype(object), frame['output'].astype(object), topics, self.schema)
+        self._writer.write_batch(batch, row_group_size=self.row_group_size)
+        self.rows_written += len(frame)
+
+    def append_file(self, path):
+        """Chép toàn bộ dòng của một dataset Parquet khác (cùng các cột) vào cuối file này"""
+        self.flush()
+        for part in parquet_parts(path):
+            for batch in pq.ParquetFile(part).iter_batches(batch_size=self.row_group_size, columns=FIELDNAMES):
+                batch = pa.RecordBatch.from_arrays(batch.columns, schema=batch.schema.remove_metadata())
+                self._writer.write_batch(batch.cast(self.schema), row_group_size=self.row_group_size)
+                self.rows_written += batch.num_rows
+
+    def flush(self):
+        """Ghi các dòng đang đệm thành một row group"""
+        if self._rows:
+            batch = _record_batch([row.get('input') for row in self._rows],
+                                  [row.get('output') for row in self._rows],
+                                  [row.get('topic') for row in self._rows], self.schema)
+            self._writer.write_batch(batch)
+            self.rows_written += len(self._rows)
+            self._rows = []
+
+    def close(self):
+        """Ghi nốt dữ liệu, đóng file, đổi tên nguyên tử thành path rồi xóa các segment đã thay thế"""
+        if self._writer is None:
+            return
+        self.flush()
+        self._writer.close()
+        self._writer = None
+        if self.fsync:
+            with open(self._temp_path, 'rb+') as f:
+                os.fsync(f.fileno())
+        os.replace(self._temp_path, self.path)
+        remove_parquet_segments(self.path, self._through)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class DatasetWriter:
+    """Writer dùng cho cả một phiên: mở file một lần, đệm dòng, flush theo ngưỡng
+
+    Mỗi cặp Q&A được ghi đúng một lần. Bộ đệm được ghi xuống sau
+    flush_rows dòng hoặc flush_seconds giây (cái nào đến trước) và fsync
+    theo chính sách fsync ('batch', 'close', 'never'). File CSV đã có sẵn
+    được ghi tiếp với đúng header cũ. Với Parquet, mỗi lần flush ghi một
+    segment hoàn chỉnh (append_parquet): dữ liệu bền vững theo từng lần
+    flush (một row group), không phải từng dòng.
+    """
+
+    def __init__(self, path, flush_rows=None, flush_seconds=None, fsync=None, fieldnames=FIELDNAMES,
+                 on_flush=None):
+        """on_flush(rows, seconds, path): gọi sau mỗi lần ghi bộ đệm xuống file
+        (vd. MetricsRecorder.record_write để đo độ trễ ghi đĩa)"""
+        self.path = path
+        self.on_flush = on_flush
+        self.flush_rows = flush_rows or DATASET_FLUSH_ROWS
+        self.flush_seconds = flush_seconds or DATASET_FLUSH_SECONDS
+        self.fsync = (fsync or DATASET_FSYNC).lower()
+        if self.fsync not in FSYNC_POLICIES:
+            raise ValueError(f"❌ Chính sách fsync không hợp lệ: {self.fsync} (hỗ trợ: {', '.join(FSYNC_POLICIES)})")
+        self.rows_written = 0
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._file = None
+        self._parquet = is_parquet(path)
+        self._closed = False
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self._parquet:
+            require_pyarrow()
+            return
+
+        has_header = os.path.exists(path) and os.path.getsize(path) > 0
+        if has_header:
+            with open(path, newline='', encoding='utf-8') as existing:
+                fieldnames = next(csv.reader(existing), None) or fieldnames
+        self.fieldnames = fieldnames
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=fieldnames, extrasaction='ignore')
+        if not has_header:
+            self._writer.writeheader()
+
+    def write(self, qa):
+        """Thêm một cặp Q&A vào bộ đệm, tự flush khi đủ ngưỡng"""
+        self._buffer.append(qa)
+        self.rows_written += 1
+        if (len(self._buffer) >= self.flush_rows
+                or time.monotonic() - self._last_flush >= self.flush_seconds):
+            self.flush()
+
+    def write_many(self, qa_pairs):
+        for qa in qa_pairs:
+            self.write(qa)
+
+    def flush(self):
+        """Ghi bộ đệm xuống file (fsync nếu chính sách là 'batch')"""
+        self._flush(self.fsync == 'batch')
+
+    def _flush(self, fsync):
+        """Ghi bộ đệm xuống file, fsync nếu được yêu cầu, rồi gọi on_flush"""
+        self._last_flush = time.monotonic()
+        rows = len(self._buffer)
+        start = time.perf_counter()
+        if self._parquet:
+            if self._buffer:
+                append_parquet(self.path, self._buffer, fsync=fsync)
+                self._buffer = []
+                if self.on_flush:
+                    self.on_flush(rows, time.perf_counter() - start, self.path)
+            return
+        if self._file is None:
+            return
+        if self._buffer:
+            self._writer.writerows(self._buffer)
+            self._buffer = []
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+        if self.on_flush and rows:
+            self.on_flush(rows, time.perf_counter() - start, self.path)
+
+    def close(self):
+        """Ghi nốt bộ đệm và đóng file"""
+        if self._parquet:
+            if not self._closed:
+                self._closed = True
+                # Segment cuối cũng qua _flush để on_flush đo được lần ghi này
+                self._flush(self.fsync != 'never')
+            return
+        if self._file is None:
+            return
+        self.flush()
+        if self.fsync == 'close':
+            os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def read_dataset(path, columns=None):
+    """Đọc dataset CSV hoặc Parquet thành DataFrame, chỉ đọc các cột cần thiết
+
+    Với Parquet, các cột không yêu cầu không được giải nén; cột thiếu
+    trong file (vd. 'topic' ở file CSV cũ) được bỏ qua.
+    """
+    if is_parquet(path):
+        require_pyarrow()
+        available = pq.read_schema(path).names
+        selected = [c for c in columns if c in available] if columns else None
+        tables = [pq.read_table(part, columns=selected).replace_schema_metadata(None)
+                  for part in parquet_parts(path)]
+        return pa.concat_tables(tables).to_pandas()
+    available = pd.read_csv(path, nrows=0).columns
+    selected = [c for c in columns if c in available] if columns else None
+    return pd.read_csv(path, usecols=selected, dtype={'topic': str})
+
+
+def iter_dataset(path, columns=None, chunksize=100_000, skip_rows=0, as_text=False):
+    """Đọc dataset theo từng DataFrame tối đa chunksize dòng (bộ nhớ giới hạn)
+
+    skip_rows: bỏ qua N dòng đầu; với Parquet, file và row group nằm trọn
+    trong phần bị bỏ qua không được đọc (chỉ xem metadata).
+    as_text: đọc mọi cột CSV dạng chuỗi, ô trống là '' (không suy kiểu số/NaN).
+    """
+    if is_parquet(path):
+        require_pyarrow()
+        available = pq.read_schema(path).names
+        selected = [c for c in columns if c in available] if columns else None
+        remaining = skip_rows
+        for part in parquet_parts(path):
+            parquet_file = pq.ParquetFile(part)
+            if remaining >= parquet_file.metadata.num_rows:
+                remaining -= parquet_file.metadata.num_rows
+                continue
+            first_group = 0
+            while remaining >= parquet_file.metadata.row_group(first_group).num_rows:
+                remaining -= parquet_file.metadata.row_group(first_group).num_rows
+                first_group += 1
+            row_groups = range(first_group, parquet_file.num_row_groups)
+            for batch in parquet_file.iter_batches(batch_size=chunksize, row_groups=row_groups, columns=selected):
+                if remaining:
+                    if remaining >= batch.num_rows:
+                        remaining -= batch.num_rows
+                        continue
+                    batch, remaining = batch.slice(remaining), 0
+                yield batch.to_pandas()
+        return
+    available = pd.read_csv(path, nrows=0).columns
+    selected = [c for c in columns if c in available] if columns else None
+    yield from pd.read_csv(path, usecols=selected, dtype=str if as_text else {'topic': str},
+                           keep_default_na=not as_text, chunksize=chunksize,
+                           skiprows=range(1, skip_rows + 1) if skip_rows else None)
+
+
+def write_dataset(frame, path):
+    """Ghi DataFrame ra CSV hoặc Parquet theo phần mở rộng của path"""
+    if is_parquet(path):
+        with ParquetDatasetWriter(path) as writer:
+            writer.write_frame(frame)
+    else:
+        frame.to_csv(path, index=False)
+
+
+def parquet_rows(path):
+    """Tổng số dòng của dataset Parquet (chỉ đọc footer của từng file)"""
+    return sum(pq.ParquetFile(part).metadata.num_rows for part in parquet_parts(path))
+
+
+def append_parquet(path, rows, fsync=True):
+    """Thêm dòng (danh sách cặp Q&A hoặc DataFrame) vào dataset Parquet, trả về tổng số dòng
+
+    Chi phí tỉ lệ với số dòng mới: dòng mới được ghi thành một segment
+    (file Parquet hoàn chỉnh, một row group) rồi các segment được gộp dần
+    theo kích thước (compact_parquet), nên mỗi dòng chỉ bị ghi lại O(log n) lần.
+    Dataset chưa tồn tại thì được tạo trực tiếp. mtime của file chính được
+    cập nhật để danh mục / chỉ mục tìm kiếm thấy dataset đã thay đổi.
+    """
+    require_pyarrow()
+    if not os.path.exists(path):
+        with ParquetDatasetWriter(path, fsync=fsync) as writer:
+            _write_rows(writer, rows)
+        return parquet_rows(path)
+    segments = _segment_files(path)
+    sequence = max([_segments_through(path)] + [last for _, last, _ in segments]) + 1
+    os.makedirs(segments_dir(path), exist_ok=True)
+    segment_path = os.path.join(segments_dir(path), f"{sequence:08d}-{sequence:08d}.parquet")
+    with ParquetDatasetWriter(segment_path, fsync=fsync) as writer:
+        _write_rows(writer, rows)
+    os.utime(path)
+    compact_parquet(path)
+    return parquet_rows(path)
+
+
+def _write_rows(writer, rows):
+    if isinstance(rows, pd.DataFrame):
+        writer.write_frame(rows)
+    else:
+        writer.write_many(rows)
+
+
+def compact_parquet(path, full=False):
+    """Gộp các segment của dataset Parquet theo kích thước (như bộ đếm nhị phân)
+
+    Hai phần cuối được gộp khi phần trước không lớn hơn hai lần phần sau, nên
+    số segment chỉ còn O(log n). full=True: gộp mọi segment vào file chính.
+    Mỗi lần gộp ghi file mới rồi mới xóa file cũ; bị ngắt giữa chừng thì
+    file cũ chỉ còn là segment cũ bị bỏ qua.
+    """
+    while True:
+        parts = parquet_parts(path)
+        if len(parts) < 2:
+            break
+        previous, last = parts[-2], parts[-1]
+        if not full and pq.ParquetFile(previous).metadata.num_rows > 2 * pq.ParquetFile(last).metadata.num_rows:
+            break
+        if previous == path:
+            # Chỉ còn một segment: ghi lại file chính (segment được đánh dấu đã gộp)
+            with ParquetDatasetWriter(path) as writer:
+                writer.append_file(path)
+            continue
+        first = int(os.path.basename(previous).split('-')[0])
+        last_sequence = int(os.path.splitext(os.path.basename(last))[0].split('-')[1])
+        merged_path = os.path.join(segments_dir(path), f"{first:08d}-{last_sequence:08d}.parquet")
+        with ParquetDatasetWriter(merged_path) as writer:
+            writer.append_file(previous)
+            writer.append_file(last)
+        os.remove(previous)
+        os.remove(last)
+    # Dọn các segment cũ còn sót lại sau lần gộp bị ngắt
+    live = {segment_path for _, _, segment_path in _live_segments(path)}
+    for _, _, segment_path in _segment_files(path):
+        if segment_path not in live:
+            os.remove(segment_path)
+
+
+def convert_dataset(source, target, chunksize=100_000):
+    """Chuyển dataset giữa CSV và Parquet theo kiểu stream, trả về số dòng"""
+    rows = 0
+    if is_parquet(target):
+        with ParquetDatasetWriter(target) as writer:
+            for frame in iter_dataset(source, FIELDNAMES, chunksize):
+                writer.write_frame(frame)
+                rows += len(frame)
+        return rows
+
+    header = True
+    temp_path = target + '.tmp'
+    for frame in iter_dataset(source, FIELDNAMES, chunksize):
+        frame.to_csv(temp_path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+        rows += len(frame)
+    os.replace(temp_path, target)
+    return rows
+
+
+def benchmark_writers(total_rows=100_000, batch_size=30, directory='.'):
+    """So sánh tốc độ ghi (dòng/giây): save_to_csv mỗi lô vs một DatasetWriter cho cả phiên
+
+    batch_size: số cặp mỗi lần gọi save_to_csv (vd. 30 cặp một chủ đề của marathon).
+    """
+    from generator_google import QAGenerator
+    from llm_backends import StubBackend
+
+    generator = QAGenerator(backend=StubBackend(seed=0), cache=False, dedup=False)
+    rows = [{'input': f"Câu hỏi số {i} của người cao tuổi", 'output': "Dạ cháu xin trả lời bác ạ. " * 4,
+             'topic': str(i % 12 + 1)} for i in range(total_rows)]
+    batches = [rows[i:i + batch_size] for i in range(0, total_rows, batch_size)]
+    old_path = os.path.join(directory, 'bench_save_to_csv.csv')
+    new_path = os.path.join(directory, 'bench_dataset_writer.csv')
+    result = {}
+    try:
+        start_time = time.time()
+        for batch in batches:
+            generator.save_to_csv(batch, old_path, verbose=False)
+        result['save_to_csv'] = total_rows / (time.time() - start_time)
+
+        for policy in FSYNC_POLICIES:
+            if os.path.exists(new_path):
+                os.remove(new_path)
+            start_time = time.time()
+            with DatasetWriter(new_path, fsync=policy) as writer:
+                for batch in batches:
+                    writer.write_many(batch)
+            result[f'DatasetWriter (fsync={policy})'] = total_rows / (time.time() - start_time)
+    finally:
+        for path in (old_path, new_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    print(f"\n📊 === TỐC ĐỘ GHI ({total_rows} dòng, lô {batch_size}) ===")
+    for label, rate in result.items():
+        print(f"   {label:>28}: {rate:,.0f} dòng/giây")
+    return result
+
+
+def main():
+    """Chuyển CSV <-> Parquet và so sánh dung lượng / thời gian đọc"""
+    parser = argparse.ArgumentParser(description="Chuyển đổi dataset CSV <-> Parquet")
+    parser.add_argument('source', nargs='?', help='File nguồn (.csv hoặc .parquet)')
+    parser.add_argument('target', nargs='?', help='File đích (mặc định đổi phần mở rộng)')
+    parser.add_argument('--benchmark-writer', type=int, metavar='ROWS',
+                        help='So sánh tốc độ ghi của save_to_csv và DatasetWriter')
+    args = parser.parse_args()
+
+    if args.benchmark_writer:
+        benchmark_writers(args.benchmark_writer)
+        return
+    if not args.source:
+        parser.error("cần chỉ định file nguồn")
+    if not os.path.exists(args.source):
+        print(f"❌ Không tìm thấy file: {args.source}")
+        sys.exit(1)
+    target = args.target or os.path.splitext(args.source)[0] + ('.csv' if is_parquet(args.source) else '.parquet')
+
+    try:
+        start_time = time.time()
+        rows = convert_dataset(args.source, target)
+    except ImportError as e:
+        print(e)
+        sys.exit(1)
+    print(f"✅ Đã chuyển {rows} dòng trong {time.time() - start_time:.1f}s: {target}")
+
+    print("\n📊 === SO SÁNH ===")
+    for path in (args.source, target):
+        start_time = time.time()
+        frame = read_dataset(path, ['input', 'topic'])
+        elapsed = time.time() - start_time
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        print(f"   {os.path.basename(path)}: {size_mb:.2f} MB | đọc cột input, topic ({len(frame)} dòng) "
+              f"trong {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Dataset Split - Chia dataset Q&A thành train/validation/test theo hash ổn định
+Mỗi cặp được gán vào một tập chỉ dựa trên hash nội dung đã chuẩn hóa (kèm salt),
+nên thêm dữ liệu mới không bao giờ làm một cặp cũ đổi tập; dữ liệu được ghi
+theo kiểu stream thành các shard JSONL
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import tempfile
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from dedup_index import DedupIndex, normalize_text, pair_hash
+from dataset_io import FIELDNAMES, iter_dataset
+from dataset_export import EXPORT_FORMATS, EXPORT_WORKERS, COMPRESSIONS, ShardWriter, format_record
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+SPLIT_NAMES = ('train', 'validation', 'test')
+SPLIT_RATIOS = os.getenv('SPLIT_RATIOS', '0.8,0.1,0.1')
+# Đổi salt sẽ xáo lại toàn bộ các tập; giữ nguyên giữa các lần chạy
+SPLIT_SALT = os.getenv('SPLIT_SALT', 'elderly-care-qa')
+SPLIT_OUTPUT_DIR = os.getenv('SPLIT_OUTPUT_DIR', 'splits')
+# 'input': cùng câu hỏi luôn vào cùng tập (tránh rò rỉ câu hỏi giữa train và test)
+# 'pair': hash cả câu hỏi và câu trả lời
+SPLIT_KEYS = ('input', 'pair')
+MANIFEST_NAME = 'split.manifest.json'
+# Phân giải của phép gán: 2^53 ô, đủ chính xác cho mọi tỉ lệ thập phân
+BUCKETS = 1 << 53
+# Khối nén của mỗi writer khi chia theo chủ đề (nhỏ hơn EXPORT_BLOCK_MB vì có thể mở rất nhiều writer)
+STRATIFIED_BLOCK_BYTES = int(float(os.getenv('SPLIT_STRATIFIED_BLOCK_MB', '1')) * 1024 * 1024)
+
+
+def parse_ratios(text):
+    """'0.8,0.1,0.1' hoặc '80/10/10' -> (train, validation, test) đã chuẩn hóa tổng bằng 1"""
+    parts = [float(part) for part in text.replace('/', ',').split(',') if part.strip()]
+    if len(parts) != len(SPLIT_NAMES) or any(part < 0 for part in parts) or sum(parts) <= 0:
+        raise ValueError(f"❌ Tỉ lệ không hợp lệ: {text} (cần 3 số không âm, vd. 0.8,0.1,0.1)")
+    total = sum(parts)
+    return tuple(part / total for part in parts)
+
+
+def split_key(input_text, output_text, key='input'):
+    """Khóa ổn định (64-bit) quyết định tập của một cặp"""
+    if key == 'pair':
+        return pair_hash(input_text, output_text)
+    return int.from_bytes(hashlib.blake2b(normalize_text(input_text).encode('utf-8'),
+                                          digest_size=8).digest(), 'little')
+
+
+class SplitAssigner:
+    """Gán một khóa 64-bit vào tập theo tỉ lệ, chỉ phụ thuộc khóa, salt và tỉ lệ"""
+
+    def __init__(self, ratios, salt=SPLIT_SALT):
+        self.ratios = ratios
+        self.salt = salt
+        self._salt = hashlib.blake2b(salt.encode('utf-8'), digest_size=8).digest()
+        self._bounds = []
+        cumulative = 0.0
+        for ratio in ratios[:-1]:
+            cumulative += ratio
+            self._bounds.append(round(cumulative * BUCKETS))
+
+    def bucket(self, key):
+        """Vị trí 0..2^53 của khóa sau khi trộn với salt"""
+        digest = hashlib.blake2b(key.to_bytes(8, 'little'), digest_size=8, key=self._salt).digest()
+        return int.from_bytes(digest, 'little') >> 11
+
+    def assign(self, key):
+        """Tên tập ('train'/'validation'/'test') của khóa"""
+        bucket = self.bucket(key)
+        for name, bound in zip(SPLIT_NAMES, self._bounds):
+            if bucket < bound:
+                return name
+        return SPLIT_NAMES[-1]
+
+
+def load_manifest(output_dir):
+    """Manifest của lần chia trước trong output_dir, hoặc None"""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def check_compatible(manifest, ratios, salt, key):
+    """Báo lỗi nếu tỉ lệ/salt/khóa khác lần trước (các cặp cũ sẽ bị đổi tập)"""
+    if manifest is None:
+        return
+    previous = (tuple(manifest['ratios']), manifest['salt'], manifest['key'])
+    if any(abs(a - b) > 1e-9 for a, b in zip(previous[0], ratios)) or previous[1:] != (salt, key):
+        raise ValueError(
+            f"❌ Cấu hình chia khác lần trước (tỉ lệ {previous[0]}, salt {previous[1]!r}, khóa {previous[2]}); "
+            "các cặp cũ sẽ bị đổi tập. Dùng --force nếu thật sự muốn chia lại")
+
+
+def split_dataset(files, output_dir=None, ratios=None, stratify=False, key='input', salt=None,
+                  export_format='jsonl', compression=None, shard_bytes=None, workers=None,
+                  chunksize=50_000, force=False, on_file=None):
+    """Chia các file CSV/Parquet thành shard train/validation/test trong output_dir
+
+    Tập của một cặp chỉ phụ thuộc hash của nội dung đã chuẩn hóa, salt và tỉ
+    lệ, không phụ thuộc các cặp khác hay thứ tự file. Vì vậy chạy lại sau khi
+    gộp thêm round mới chỉ thêm cặp mới vào các tập; cặp cũ giữ nguyên tập.
+    Cấu hình được lưu trong split.manifest.json và được kiểm tra ở lần sau.
+
+    stratify=True ghi riêng shard cho từng chủ đề (<tập>/topic_<mã>-00000...)
+    và báo tỉ lệ thực tế theo chủ đề; phép gán theo hash vẫn độc lập với chủ
+    đề nên mỗi chủ đề được chia theo đúng tỉ lệ (sai lệch ~1/sqrt(số cặp)).
+    Cặp trùng lặp chính xác chỉ được ghi một lần. Kết quả được ghi vào thư mục
+    tạm rồi mới thay thư mục cũ. on_file(path, rows, error) sau mỗi file.
+    Trả về manifest.
+    """
+    output_dir = output_dir or SPLIT_OUTPUT_DIR
+    ratios = ratios or parse_ratios(SPLIT_RATIOS)
+    salt = SPLIT_SALT if salt is None else salt
+    if key not in SPLIT_KEYS:
+        raise ValueError(f"❌ Khóa không hợp lệ: {key} (chọn {', '.join(SPLIT_KEYS)})")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"❌ Định dạng không hợp lệ: {export_format} (chọn {', '.join(EXPORT_FORMATS)})")
+    if not force:
+        check_compatible(load_manifest(output_dir), ratios, salt, key)
+
+    assigner = SplitAssigner(ratios, salt)
+    staging = output_dir.rstrip(os.sep) + '.tmp'
+    if os.path.exists(staging):
+        shutil.rmtree(staging)
+    writers = {}
+    # Chia theo chủ đề có thể mở hàng trăm writer (tập × chủ đề): dùng chung
+    # một pool luồng nén và khối nhỏ hơn để số luồng và bộ đệm không tăng theo số chủ đề
+    executor = ThreadPoolExecutor(max_workers=max(1, workers or EXPORT_WORKERS),
+                                  thread_name_prefix='split') if stratify else None
+    counts = {name: 0 for name in SPLIT_NAMES}
+    topics = {}
+    stats = {'rows': 0, 'duplicates': 0, 'skipped': 0, 'failed': []}
+
+    def writer_for(split, topic):
+        name = (split, topic if stratify else None)
+        if name not in writers:
+            prefix = os.path.join(staging, split, f"topic_{topic or 'none'}" if stratify else 'part')
+            writers[name] = ShardWriter(prefix, compression, shard_bytes, workers=workers, executor=executor,
+                                        block_bytes=STRATIFIED_BLOCK_BYTES if stratify else None)
+        return writers[name]
+
+    with tempfile.TemporaryDirectory(prefix='split_') as temp_dir:
+        seen = DedupIndex(os.path.join(temp_dir, 'seen.bin'))
+        try:
+            for path in files:
+                rows = 0
+                try:
+                    for chunk in iter_dataset(path, FIELDNAMES, chunksize):
+                        chunk = chunk.reindex(columns=FIELDNAMES)
+                        chunk['topic'] = chunk['topic'].astype(object).fillna('').astype(str)
+                        valid = chunk['input'].notna() & chunk['output'].notna()
+                        stats['skipped'] += int((~valid).sum())
+                        for qa in chunk[valid].to_dict('records'):
+                            rows += 1
+                            if not seen.add_pair(qa):
+                                stats['duplicates'] += 1
+                                continue
+                            split = assigner.assign(split_key(qa['input'], qa['output'], key))
+                            writer_for(split, qa['topic']).write_line(
+                                json.dumps(format_record(qa, export_format), ensure_ascii=False))
+                            counts[split] += 1
+                            topic_counts = topics.setdefault(qa['topic'], dict.fromkeys(SPLIT_NAMES, 0))
+                            topic_counts[split] += 1
+                except Exception as e:
+                    stats['failed'].append(path)
+                    if on_file:
+                        on_file(path, rows, e)
+                    continue
+                stats['rows'] += rows
+                if on_file:
+                    on_file(path, rows, None)
+        finally:
+            for writer in writers.values():
+                writer.close()
+            if executor is not None:
+                executor.shutdown()
+            seen.close()
+
+    shards = {name: [] for name in SPLIT_NAMES}
+    for (split, _), writer in sorted(writers.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+        for shard in writer.shards:
+            shard = dict(shard, path=os.path.relpath(shard['path'].replace(staging, output_dir, 1), output_dir))
+            shards[split].append(shard)
+    manifest = {
+        'ratios': list(ratios), 'salt': salt, 'key': key, 'stratify': stratify,
+        'format': export_format, 'compression': next(iter(writers.values())).compression if writers else None,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'sources': [path for path in files if path not in stats['failed']],
+        'rows': stats['rows'], 'duplicates': stats['duplicates'], 'skipped': stats['skipped'],
+        'counts': counts, 'topics': topics, 'shards': shards,
+    }
+    os.makedirs(staging, exist_ok=True)
+    with open(os.path.join(staging, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    # Thay thư mục cũ: đổi tên cũ → .old, tạm → chính thức, rồi xóa bản cũ
+    previous = output_dir.rstrip(os.sep) + '.old'
+    if os.path.exists(output_dir):
+        if os.path.exists(previous):
+            shutil.rmtree(previous)
+        os.replace(output_dir, previous)
+    os.replace(staging, output_dir)
+    if os.path.exists(previous):
+        shutil.rmtree(previous)
+    manifest['failed'] = stats['failed']
+    return manifest
+
+
+def main():
+    """Chia dataset thành train/validation/test từ dòng lệnh"""
+    parser = argparse.ArgumentParser(description="Chia dataset Q&A thành train/validation/test theo hash ổn định")
+    parser.add_argument('files', nargs='+', help='Các file CSV/Parquet (vd. master_dataset.csv)')
+    parser.add_argument('-o', '--output', default=None, help='Thư mục kết quả (mặc định SPLIT_OUTPUT_DIR)')
+    parser.add_argument('--ratios', default=None, help='Tỉ lệ train,validation,test (vd. 0.8,0.1,0.1 hoặc 90/5/5)')
+    parser.add_argument('--stratify', action='store_true', help='Ghi shard riêng cho từng chủ đề')
+    parser.add_argument('--key', choices=SPLIT_KEYS, default='input', help='Nội dung dùng để hash')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='jsonl', help='Định dạng bản ghi')
+    parser.add_argument('--compression', choices=list(COMPRESSIONS), default=None,
+                        help='Kiểu nén (mặc định EXPORT_COMPRESSION)')
+    parser.add_argument('--force', action='store_true', help='Cho phép đổi tỉ lệ/salt/khóa so với lần trước')
+    args = parser.parse_args()
+
+    def report(path, rows, error):
+        if error:
+            print(f"   ❌ {path}: {error}")
+        else:
+            print(f"   ✅ {path}: {rows} cặp")
+
+    try:
+        ratios = parse_ratios(args.ratios) if args.ratios else None
+        manifest = split_dataset(args.files, args.output, ratios, args.stratify, args.key,
+                                 export_format=args.format, compression=args.compression,
+                                 force=args.force, on_file=report)
+    except (ImportError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+    print(f"📊 {manifest['rows']} cặp | {manifest['duplicates']} trùng lặp bỏ qua | "
+          f"{manifest['skipped']} cặp thiếu dữ liệu")
+    for name in SPLIT_NAMES:
+        count = manifest['counts'][name]
+        share = count / max(1, sum(manifest['counts'].values())) * 100
+        print(f"   📦 {name:<10} {count:>8} cặp ({share:.1f}%) | {len(manifest['shards'][name])} shard")
+    print(f"📁 {os.path.abspath(args.output or SPLIT_OUTPUT_DIR)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Dedup Index - Chỉ mục chống trùng lặp chính xác dùng chung giữa các phiên sinh dữ liệu
+Lưu hash 64-bit của cặp Q&A đã chuẩn hóa (NFC, khoảng trắng, chữ hoa/thường)
+"""
+import os
+import csv
+import sys
+import hashlib
+import argparse
+import unicodedata
+import numpy as np
+from dotenv import load_dotenv
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+DEFAULT_DEDUP_PATH = os.path.join('.qa_cache', 'dedup_index.bin')
+
+# Gộp các hash mới vào mảng đã sắp xếp sau mỗi N hash (giữ bộ nhớ ~8 byte/cặp)
+MERGE_THRESHOLD = 100_000
+
+
+def normalize_text(text):
+    """Chuẩn hóa văn bản tiếng Việt để so trùng: Unicode NFC, gộp khoảng trắng, casefold"""
+    text = unicodedata.normalize('NFC', str(text))
+    return ' '.join(text.split()).casefold()
+
+
+def pair_hash(input_text, output_text):
+    """Hash 64-bit của một cặp Q&A đã chuẩn hóa"""
+    key = normalize_text(input_text) + '\x1f' + normalize_text(output_text)
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class DedupIndex:
+    def __init__(self, path=DEFAULT_DEDUP_PATH):
+        """Mở (hoặc tạo) chỉ mục tại path
+
+        Hash đã biết được giữ trong một mảng numpy uint64 đã sắp xếp (tra cứu
+        bằng tìm kiếm nhị phân), hash mới nằm trong một set nhỏ cho đến khi
+        được gộp vào mảng. File trên đĩa là chuỗi hash 8 byte append-only.
+
+        Hash chỉ được ghi xuống đĩa khi gọi flush(), và người gọi phải flush
+        dữ liệu trước: chỉ mục không bao giờ chứa cặp chưa nằm trong dataset.
+        """
+        self.path = path
+        self.checked = 0
+        self.duplicates = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(path):
+            self._sorted = np.unique(np.fromfile(path, dtype='<u8'))
+        else:
+            self._sorted = np.empty(0, dtype='<u8')
+        self._recent = set()
+        # Hash đã giữ chỗ trong phiên nhưng cặp chưa được ghi (không lưu xuống đĩa)
+        self._reserved = set()
+        self._pending = []
+        self._file = open(path, 'ab')
+
+    @classmethod
+    def from_env(cls):
+        """Tạo chỉ mục theo .env; trả về None nếu DEDUP_INDEX=0"""
+        if os.getenv('DEDUP_INDEX', '1').lower() in ('0', 'false', 'off', 'no'):
+            return None
+        return cls(os.getenv('DEDUP_INDEX_PATH', DEFAULT_DEDUP_PATH))
+
+    def __len__(self):
+        return len(self._sorted) + len(self._recent) + len(self._reserved)
+
+    def __contains__(self, hash_value):
+        return hash_value in self._reserved or self._known(hash_value)
+
+    def _known(self, hash_value):
+        if hash_value in self._recent:
+            return True
+        index = np.searchsorted(self._sorted, np.uint64(hash_value))
+        return index < len(self._sorted) and int(self._sorted[index]) == hash_value
+
+    def reserve(self, hash_value):
+        """Giữ chỗ hash trong phiên, trả về False nếu đã tồn tại (trùng lặp)
+
+        Hash giữ chỗ chặn cặp trùng trong phiên nhưng chưa được lưu: gọi
+        commit() sau khi cặp đã được ghi vào dataset.
+        """
+        self.checked += 1
+        if hash_value in self:
+            self.duplicates += 1
+            return False
+        self._reserved.add(hash_value)
+        return True
+
+    def commit(self, hash_value):
+        """Xác nhận hash của một cặp đã ghi; lần flush() sau sẽ lưu nó xuống đĩa"""
+        self._reserved.discard(hash_value)
+        if self._known(hash_value):
+            return
+        self._recent.add(hash_value)
+        self._pending.append(hash_value)
+        if len(self._recent) >= MERGE_THRESHOLD:
+            self._merge()
+
+    def add(self, hash_value):
+        """Thêm hash (giữ chỗ và xác nhận luôn), trả về False nếu đã tồn tại"""
+        if not self.reserve(hash_value):
+            return False
+        self.commit(hash_value)
+        return True
+
+    def add_pair(self, qa):
+        """Thêm một cặp Q&A, trả về False nếu cặp này đã từng được sinh"""
+        return self.add(pair_hash(qa['input'], qa['output']))
+
+    def reserve_pair(self, qa):
+        """Giữ chỗ một cặp Q&A vừa parse, trả về False nếu cặp này đã từng được sinh"""
+        return self.reserve(pair_hash(qa['input'], qa['output']))
+
+    def commit_pairs(self, qa_pairs):
+        """Xác nhận các cặp đã được ghi vào dataset"""
+        for qa in qa_pairs:
+            self.commit(pair_hash(qa['input'], qa['output']))
+
+    def _merge(self):
+        recent = np.fromiter(self._recent, dtype='<u8', count=len(self._recent))
+        self._sorted = np.union1d(self._sorted, recent)
+        self._recent.clear()
+
+    def flush(self):
+        """Ghi các hash mới xuống đĩa"""
+        if self._pending:
+            self._file.write(np.array(self._pending, dtype='<u8').tobytes())
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._pending = []
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def duplicate_rate(self):
+        return self.duplicates / self.checked if self.checked else 0.0
+
+    def describe(self):
+        """Mô tả ngắn để in ra màn hình"""
+        return (f"{len(self)} cặp đã biết | kiểm tra {self.checked} | "
+                f"trùng {self.duplicates} ({self.duplicate_rate():.1%})")
+
+
+def seed_from_csv(index, filenames):
+    """Nạp các cặp Q&A từ file CSV có sẵn vào chỉ mục, trả về số cặp mới"""
+    added = 0
+    for filename in filenames:
+        with open(filename, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                if row.get('input') and row.get('output') and index.add_pair(row):
+                    added += 1
+    index.flush()
+    return added
+
+
+def main():
+    """Xem thống kê hoặc nạp dữ liệu cũ vào chỉ mục chống trùng lặp"""
+    parser = argparse.ArgumentParser(description="Quản lý chỉ mục chống trùng lặp")
+    parser.add_argument('--seed', nargs='+', metavar='CSV', help='Nạp các file CSV có sẵn vào chỉ mục')
+    args = parser.parse_args()
+
+    index = DedupIndex.from_env()
+    if index is None:
+        print("📭 Chỉ mục chống trùng lặp đang tắt (DEDUP_INDEX=0)")
+        sys.exit(0)
+    if args.seed:
+        added = seed_from_csv(index, args.seed)
+        print(f"✅ Đã nạp {added} cặp mới từ {len(args.seed)} file")
+    print(f"🧬 Chỉ mục: {index.path}")
+    print(f"📊 {index.describe()}")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,47 +3,166 @@ Tool tự động sinh câu hỏi và câu trả lời cho chăm sóc người c
 Sử dụng Google Gemini API
 """
 import os
+import re
 import csv
 import time
-import random
+import asyncio
 from datetime import datetime
 from dotenv import load_dotenv
-import google.generativeai as genai
+from llm_backends import GeminiBackend, create_backend
+from rate_limiter import AdaptiveRateLimiter, estimate_tokens, is_quota_error
+from response_cache import CachedResponse, ResponseCache
+from retry_policy import RetryPolicy
+from dedup_index import DedupIndex
+from dataset_io import DatasetWriter, append_parquet
+from metrics import MetricsRecorder, RequestMeasurement
 
 # Tải cấu hình từ file .env
 load_dotenv()
 
+# Số token đầu ra ước lượng cho mỗi cặp Q&A (dùng cho ngân sách token/phút)
+OUTPUT_TOKENS_PER_PAIR = 120
+
+# Danh sách chủ đề
+TOPICS = {
+    "1": "Nhắc nhở hằng ngày (uống thuốc, lịch tái khám, giờ ăn, uống nước, tập thể dục)",
+    "2": "Chăm sóc sức khỏe (dinh dưỡng, triệu chứng bệnh, lời khuyên y tế, thuốc, vật lý trị liệu)",
+    "3": "Sức khỏe tinh thần (cải thiện giấc ngủ, giải trí, tâm sự, hoạt động phấn chấn)",
+    "4": "Giao tiếp & hỗ trợ cảm xúc (trò chuyện, kể chuyện, lắng nghe, tương tác thân thiện)",
+    "5": "Đi chợ, nấu ăn, bếp núc (thực đơn, mẹo nấu ăn, bảo quản thực phẩm, mua hàng)",
+    "6": "Việc nhà (dọn dẹp, sắp xếp đồ đạc, mẹo vặt gia đình)",
+    "7": "Giải trí (phim, cải lương, sách, trò chơi, truyện cười)",
+    "8": "Tâm linh – truyền thống (lễ nghi, cúng giỗ, Tết, chuyện dân gian, ca dao)",
+    "9": "Quan hệ gia đình (gọi điện con cháu, lời yêu thương, dạy con cháu)",
+    "10": "Công nghệ (điện thoại, Zalo, video call, tin lừa đảo, chatbot)",
+    "11": "Thông báo tự động (nhắc lịch, chào buổi sáng/tối, thời tiết)",
+    "12": "Câu hỏi thường gặp (ăn uống, sức khỏe, đau nhức)"
+}
+
+# Cột của file CSV đầu ra ('topic' là khóa chủ đề trong TOPICS)
+CSV_FIELDNAMES = ['input', 'output', 'topic']
+
+# Dòng tiêu đề mở đầu mỗi phần trong response nhiều chủ đề, vd. "[CHỦ ĐỀ 3]"
+SECTION_PATTERN = r'^[ \t*#]*\[?CHỦ ĐỀ\s*(\d+)\]?[ \t*#:]*$'
+# Tách response tại dấu '---' hoặc dòng tiêu đề chủ đề (nhóm bắt được là khóa chủ đề)
+BLOCK_SPLITTER = re.compile(r'---|' + SECTION_PATTERN, re.MULTILINE)
+
+def parse_qa_block(block):
+    """Trích xuất một cặp Q&A từ một khối INPUT:/OUTPUT:, trả về None nếu thiếu"""
+    lines = block.strip().split('\n')
+    input_text = ""
+    output_text = ""
+    
+    for line in lines:
+        line = line.strip()
+        if line.startswith('INPUT:'):
+            input_text = line[6:].strip()
+        elif line.startswith('OUTPUT:'):
+            output_text = line[7:].strip()
+        elif output_text and line:  # Tiếp tục output nếu có nhiều dòng
+            output_text += " " + line
+    
+    if input_text and output_text:
+        return {
+            'input': input_text,
+            'output': output_text
+        }
+    return None
+
+
+class StreamingQAParser:
+    """Phân tích response dạng stream: trả về từng cặp Q&A ngay khi gặp '---'
+
+    Chỉ giữ trong bộ đệm khối đang dang dở, nên bộ nhớ không phụ thuộc
+    vào độ dài response. Mỗi cặp được gắn 'topic': chủ đề mặc định, hoặc
+    chủ đề của dòng tiêu đề "[CHỦ ĐỀ n]" gần nhất (response nhiều chủ đề).
+    """
+
+    def __init__(self, topic_key=None):
+        self.buffer = ""
+        self.topic = topic_key
+        # Số khối có nội dung nhưng không parse được thành cặp INPUT/OUTPUT
+        self.failures = 0
+
+    def _tag(self, qa):
+        qa['topic'] = self.topic
+        return qa
+
+    def feed(self, chunk):
+        """Nhận thêm một đoạn văn bản, trả về các cặp Q&A vừa hoàn chỉnh"""
+        self.buffer += chunk
+        # Chỉ tách phần đã trọn dòng để tiêu đề đang dở ("[CHỦ ĐỀ 1" của "[CHỦ ĐỀ 12]") không bị khớp sớm
+        complete = self.buffer.rfind('\n') + 1
+        # parts = [khối, chủ đề|None, khối, chủ đề|None, ..., phần dang dở]
+        parts = BLOCK_SPLITTER.split(self.buffer[:complete])
+        self.buffer = parts[-1] + self.buffer[complete:]
+        qa_pairs = []
+        for i in range(0, len(parts) - 1, 2):
+            qa = parse_qa_block(parts[i])
+            if qa:
+                qa_pairs.append(self._tag(qa))
+            elif parts[i].strip():
+                self.failures += 1
+            if parts[i + 1] is not None:
+                self.topic = parts[i + 1]
+        return qa_pairs
+
+    def close(self):
+        """Kết thúc stream bình thường, phân tích phần còn lại trong bộ đệm"""
+        qa_pairs = self.feed('\n')
+        qa = parse_qa_block(self.buffer)
+        if not qa and self.buffer.strip():
+            self.failures += 1
+        self.buffer = ""
+        return qa_pairs + [self._tag(qa)] if qa else qa_pairs
+
+
 class QAGenerator:
-    def __init__(self):
-        """Khởi tạo QA Generator với Google Gemini API"""
-        self.api_key = os.getenv('GOOGLE_API_KEY')
-        if not self.api_key:
-            raise ValueError("❌ Không tìm thấy GOOGLE_API_KEY trong file .env")
-        
-        # Cấu hình Google Gemini
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
+    def __init__(self, backend=None, rate_limiter=None, cache=None, fresh=True, retry_policy=None,
+                 dedup=None, metrics=None):
+        """Khởi tạo QA Generator với Google Gemini API
+
+        backend: LLMBackend tùy chọn (mặc định theo LLM_BACKEND trong .env,
+        tức Gemini); truyền StubBackend để chạy thử / load test offline.
+        rate_limiter: AdaptiveRateLimiter dùng chung cho mọi lần gọi model
+        (mặc định tạo mới theo REQUESTS_PER_MINUTE / TOKENS_PER_MINUTE).
+        cache: ResponseCache (mặc định theo RESPONSE_CACHE trong .env, False để tắt).
+        fresh: True (mặc định) để luôn gọi model lấy kết quả mới (vẫn ghi vào
+        cache); False chỉ dùng khi cố ý phát lại một lần chạy trước từ cache.
+        retry_policy: RetryPolicy (mặc định theo MAX_RETRIES / MAX_TOP_UPS trong .env).
+        dedup: DedupIndex loại cặp đã từng sinh trước khi ghi (mặc định theo
+        DEDUP_INDEX trong .env, False để tắt).
+        metrics: MetricsRecorder ghi số đo từng request (mặc định theo METRICS
+        trong .env, False để tắt).
+        """
+        self.backend = backend or create_backend()
+        self.cache = ResponseCache.from_env() if cache is None else (cache or None)
+        self.fresh = fresh
+        self.retry_policy = retry_policy or RetryPolicy()
+        if dedup is None:
+            dedup = DedupIndex.from_env()
+        self.dedup = dedup if dedup is not False else None
+        if metrics is None:
+            metrics = MetricsRecorder.from_env(labels={'backend': self.backend.name, 'model': self.backend.model_name})
+        self.metrics = metrics or None
+        # Chi phí theo chủ đề: request, retry, top-up, số cặp yêu cầu / nhận được
+        self.topic_stats = {}
+        # Tổng số request, token đầu vào (ước lượng) và số cặp nhận được
+        self.usage = {'requests': 0, 'input_tokens': 0, 'pairs': 0}
+        if rate_limiter is None:
+            rate_limiter = AdaptiveRateLimiter() if self.backend.rate_limited else AdaptiveRateLimiter.unlimited()
+        self.rate_limiter = rate_limiter
         
-        print("✅ Đã kết nối thành công với Google Gemini API")
+        if isinstance(self.backend, GeminiBackend):
+            print("✅ Đã kết nối thành công với Google Gemini API")
+        else:
+            print(f"✅ Đang dùng backend: {self.backend.name} ({self.backend.model_name})")
         
         # Danh sách chủ đề
-        self.topics = {
-            "1": "Nhắc nhở hằng ngày (uống thuốc, lịch tái khám, giờ ăn, uống nước, tập thể dục)",
-            "2": "Chăm sóc sức khỏe (dinh dưỡng, triệu chứng bệnh, lời khuyên y tế, thuốc, vật lý trị liệu)",
-            "3": "Sức khỏe tinh thần (cải thiện giấc ngủ, giải trí, tâm sự, hoạt động phấn chấn)",
-            "4": "Giao tiếp & hỗ trợ cảm xúc (trò chuyện, kể chuyện, lắng nghe, tương tác thân thiện)",
-            "5": "Đi chợ, nấu ăn, bếp núc (thực đơn, mẹo nấu ăn, bảo quản thực phẩm, mua hàng)",
-            "6": "Việc nhà (dọn dẹp, sắp xếp đồ đạc, mẹo vặt gia đình)",
-            "7": "Giải trí (phim, cải lương, sách, trò chơi, truyện cười)",
-            "8": "Tâm linh – truyền thống (lễ nghi, cúng giỗ, Tết, chuyện dân gian, ca dao)",
-            "9": "Quan hệ gia đình (gọi điện con cháu, lời yêu thương, dạy con cháu)",
-            "10": "Công nghệ (điện thoại, Zalo, video call, tin lừa đảo, chatbot)",
-            "11": "Thông báo tự động (nhắc lịch, chào buổi sáng/tối, thời tiết)",
-            "12": "Câu hỏi thường gặp (ăn uống, sức khỏe, đau nhức)"
-        }
+        self.topics = dict(TOPICS)
 
-    def generate_qa_pairs(self, topic_key, num_pairs=10):
-        """Sinh câu hỏi và câu trả lời cho một chủ đề"""
+    def build_prompt(self, topic_key, num_pairs=10):
+        """Tạo prompt sinh Q&A cho một chủ đề, trả về (tên chủ đề, prompt)"""
         topic = self.topics.get(topic_key, "Chăm sóc người cao tuổi tổng quát")
         
         prompt = f"""
@@ -69,53 +188,490 @@ OUTPUT: [câu trả lời của chatbot]
 ---
 (tiếp tục...)
 """
+        return topic, prompt
+
+    def build_batch_prompt(self, topic_counts):
+        """Tạo prompt sinh Q&A cho nhiều chủ đề trong một request
 
+        topic_counts: dict {khóa chủ đề: số cặp}. Response được chia thành
+        các phần, mỗi phần mở đầu bằng dòng "[CHỦ ĐỀ n]".
+        """
+        sections = "\n".join(
+            f"[CHỦ ĐỀ {topic_key}] tạo {num_pairs} cặp: {self.topics.get(topic_key, 'Chăm sóc người cao tuổi tổng quát')}"
+            for topic_key, num_pairs in topic_counts.items())
+        first_key = next(iter(topic_counts))
+        
+        prompt = f"""
+Bạn là một trợ lý AI tạo dataset để huấn luyện chatbot chăm sóc người cao tuổi. Hãy tạo dữ liệu cho {len(topic_counts)} chủ đề sau:
+{sections}
+
+Yêu cầu:
+- INPUT: Là những câu nói, câu hỏi, thắc mắc, phàn nàn của NGƯỜI CAO TUỔI VIỆT NAM
+- OUTPUT: Là câu trả lời của CHATBOT - thân thiện, hữu ích, chi tiết
+- Người cao tuổi sẽ nói về các vấn đề của họ, chatbot cần trả lời phù hợp
+- Sử dụng ngôn ngữ Việt Nam, thân thiện, gần gụi
+- INPUT phải thật tự nhiên như người già thực sự nói
+- Mỗi cặp phải đúng với chủ đề của phần chứa nó, đủ số cặp yêu cầu cho từng chủ đề
+
+Định dạng output (mỗi chủ đề mở đầu bằng một dòng tiêu đề riêng, giữ nguyên số chủ đề):
+[CHỦ ĐỀ {first_key}]
+INPUT: [câu nói/hỏi của người cao tuổi]
+OUTPUT: [câu trả lời của chatbot]
+---
+INPUT: [câu nói/hỏi tiếp theo của người cao tuổi]
+OUTPUT: [câu trả lời của chatbot]
+---
+[CHỦ ĐỀ ...]
+INPUT: ...
+OUTPUT: ...
+---
+(tiếp tục...)
+"""
+        return prompt
+
+    def _prompt_for(self, topic_counts):
+        """Prompt của một request và chủ đề mặc định để gắn cho các cặp parse được
+
+        Một chủ đề dùng build_prompt như cũ, nhiều chủ đề dùng build_batch_prompt.
+        """
+        if len(topic_counts) == 1:
+            (topic_key, num_pairs), = topic_counts.items()
+            prompt = self.build_prompt(topic_key, num_pairs)[1]
+        else:
+            topic_key, prompt = None, self.build_batch_prompt(topic_counts)
+        tokens = estimate_tokens(prompt)
+        self.usage['requests'] += 1
+        self.usage['input_tokens'] += tokens
+        # Request nhiều chủ đề: chia đều token đầu vào cho các chủ đề trong request
+        for key in topic_counts:
+            self._topic_stats(key)['input_tokens'] += tokens / len(topic_counts)
+        return prompt, topic_key
+
+    def _cache_key(self, prompt, use_cache=True):
+        """Khóa cache cho lần gọi này (None nếu không dùng cache)"""
+        if not self.cache or not use_cache:
+            return None
+        return self.cache.make_key(self.backend.model_name, prompt,
+                                   getattr(self.backend, 'generation_config', None))
+
+    def _cached_text(self, key):
+        """Lấy response từ cache nếu được phép đọc (không ở chế độ fresh)"""
+        if key is None or self.fresh:
+            return None
+        return self.cache.get(key)
+
+    def _generate_content(self, prompt, expected_output_tokens=0, use_cache=True, measurement=None):
+        """Gọi model qua cache và rate limiter, cập nhật tốc độ theo kết quả
+
+        measurement: RequestMeasurement nhận cờ cache và usage_metadata của response.
+        """
+        measurement = measurement or RequestMeasurement(None, {}, prompt, 'plain')
+        key = self._cache_key(prompt, use_cache)
+        cached = self._cached_text(key)
+        if cached is not None:
+            measurement.cached = True
+            return CachedResponse(cached)
+
+        estimated = estimate_tokens(prompt) + expected_output_tokens
+        self.rate_limiter.acquire(estimated)
         try:
-            print(f"🔄 Đang sinh {num_pairs} cặp Q&A cho chủ đề: {topic}")
-            response = self.model.generate_content(prompt)
-            return self.parse_qa_response(response.text)
+            response = self.backend.generate(prompt)
         except Exception as e:
-            print(f"❌ Lỗi khi sinh Q&A: {e}")
-            return []
+            if is_quota_error(e):
+                self.rate_limiter.on_quota_error()
+            raise
+        measurement.set_usage(getattr(response, 'usage_metadata', None))
+        self.rate_limiter.on_success(self._token_correction(response, estimated))
+        if key:
+            self.cache.put(key, self.backend.model_name, response.text)
+        return response
 
-    def parse_qa_response(self, response_text):
-        """Phân tích response và trích xuất các cặp Q&A"""
-        qa_pairs = []
-        blocks = response_text.split('---')
-        
-        for block in blocks:
-            lines = block.strip().split('\n')
-            input_text = ""
-            output_text = ""
-            
-            for line in lines:
-                line = line.strip()
-                if line.startswith('INPUT:'):
-                    input_text = line[6:].strip()
-                elif line.startswith('OUTPUT:'):
-                    output_text = line[7:].strip()
-                elif output_text and line:  # Tiếp tục output nếu có nhiều dòng
-                    output_text += " " + line
-            
-            if input_text and output_text:
-                qa_pairs.append({
-                    'input': input_text,
-                    'output': output_text
-                })
-        
+    async def _generate_content_async(self, prompt, expected_output_tokens=0, use_cache=True, measurement=None):
+        """Phiên bản async của _generate_content"""
+        measurement = measurement or RequestMeasurement(None, {}, prompt, 'plain')
+        key = self._cache_key(prompt, use_cache)
+        cached = self._cached_text(key)
+        if cached is not None:
+            measurement.cached = True
+            return CachedResponse(cached)
+
+        estimated = estimate_tokens(prompt) + expected_output_tokens
+        await self.rate_limiter.acquire_async(estimated)
+        try:
+            response = await self.backend.generate_async(prompt)
+        except Exception as e:
+            if is_quota_error(e):
+                self.rate_limiter.on_quota_error()
+            raise
+        measurement.set_usage(getattr(response, 'usage_metadata', None))
+        self.rate_limiter.on_success(self._token_correction(response, estimated))
+        if key:
+            self.cache.put(key, self.backend.model_name, response.text)
+        return response
+
+    def _generate_stream(self, prompt, expected_output_tokens=0, use_cache=True, measurement=None):
+        """Gọi model dạng stream qua cache và rate limiter, trả về lần lượt từng đoạn văn bản"""
+        measurement = measurement or RequestMeasurement(None, {}, prompt, 'stream')
+        key = self._cache_key(prompt, use_cache)
+        cached = self._cached_text(key)
+        if cached is not None:
+            measurement.cached = True
+            yield cached
+            return
+
+        self.rate_limiter.acquire(estimate_tokens(prompt) + expected_output_tokens)
+        chunks = []
+        try:
+            for chunk in self.backend.generate_stream(prompt, on_usage=measurement.set_usage):
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            if is_quota_error(e):
+                self.rate_limiter.on_quota_error()
+            raise
+        self.rate_limiter.on_success()
+        if key:
+            self.cache.put(key, self.backend.model_name, "".join(chunks))
+
+    async def _generate_stream_async(self, prompt, expected_output_tokens=0, use_cache=True, measurement=None):
+        """Phiên bản async của _generate_stream"""
+        measurement = measurement or RequestMeasurement(None, {}, prompt, 'stream')
+        key = self._cache_key(prompt, use_cache)
+        cached = self._cached_text(key)
+        if cached is not None:
+            measurement.cached = True
+            yield cached
+            return
+
+        await self.rate_limiter.acquire_async(estimate_tokens(prompt) + expected_output_tokens)
+        chunks = []
+        try:
+            async for chunk in self.backend.generate_stream_async(prompt, on_usage=measurement.set_usage):
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            if is_quota_error(e):
+                self.rate_limiter.on_quota_error()
+            raise
+        self.rate_limiter.on_success()
+        if key:
+            self.cache.put(key, self.backend.model_name, "".join(chunks))
+
+    @staticmethod
+    def _token_correction(response, estimated):
+        """Chênh lệch giữa số token thực tế (usage_metadata) và số đã ước lượng"""
+        usage = getattr(response, 'usage_metadata', None)
+        total = getattr(usage, 'total_token_count', None)
+        return total - estimated if total else 0
+
+    def _measure(self, topic_counts, prompt, mode):
+        """Số đo của một request (ghi vào metrics nếu đang bật)"""
+        return RequestMeasurement(self.metrics, topic_counts, prompt, mode)
+
+    @staticmethod
+    def _emit(measurement, parser, qa_pairs, sink):
+        """Chuyển các cặp parse được vào sink, cập nhật số đo của request"""
+        for qa in qa_pairs:
+            measurement.parsed += 1
+            measurement.accepted += sink(qa)
+        measurement.parse_failures = parser.failures
+
+    def _request_pairs(self, topic_counts, sink):
+        """Gửi một request sinh các cặp theo topic_counts, chuyển từng cặp parse được vào sink"""
+        prompt, topic_key = self._prompt_for(topic_counts)
+        with self._measure(topic_counts, prompt, 'plain') as measurement:
+            response = self._generate_content(prompt, sum(topic_counts.values()) * OUTPUT_TOKENS_PER_PAIR,
+                                              measurement=measurement)
+            measurement.on_chunk(response.text)
+            parser = StreamingQAParser(topic_key)
+            self._emit(measurement, parser, parser.feed(response.text) + parser.close(), sink)
+
+    async def _request_pairs_async(self, topic_counts, sink):
+        """Phiên bản async của _request_pairs"""
+        prompt, topic_key = self._prompt_for(topic_counts)
+        with self._measure(topic_counts, prompt, 'plain') as measurement:
+            response = await self._generate_content_async(prompt, sum(topic_counts.values()) * OUTPUT_TOKENS_PER_PAIR,
+                                                          measurement=measurement)
+            measurement.on_chunk(response.text)
+            parser = StreamingQAParser(topic_key)
+            self._emit(measurement, parser, parser.feed(response.text) + parser.close(), sink)
+
+    def _request_pairs_stream(self, topic_counts, sink):
+        """Như _request_pairs nhưng stream: mỗi cặp vào sink ngay khi hoàn chỉnh"""
+        prompt, topic_key = self._prompt_for(topic_counts)
+        parser = StreamingQAParser(topic_key)
+        with self._measure(topic_counts, prompt, 'stream') as measurement:
+            for chunk in self._generate_stream(prompt, sum(topic_counts.values()) * OUTPUT_TOKENS_PER_PAIR,
+                                               measurement=measurement):
+                measurement.on_chunk(chunk)
+                self._emit(measurement, parser, parser.feed(chunk), sink)
+            self._emit(measurement, parser, parser.close(), sink)
+
+    async def _request_pairs_stream_async(self, topic_counts, sink):
+        """Phiên bản async của _request_pairs_stream"""
+        prompt, topic_key = self._prompt_for(topic_counts)
+        parser = StreamingQAParser(topic_key)
+        with self._measure(topic_counts, prompt, 'stream') as measurement:
+            async for chunk in self._generate_stream_async(prompt, sum(topic_counts.values()) * OUTPUT_TOKENS_PER_PAIR,
+                                                           measurement=measurement):
+                measurement.on_chunk(chunk)
+                self._emit(measurement, parser, parser.feed(chunk), sink)
+            self._emit(measurement, parser, parser.close(), sink)
+
+    def _topic_stats(self, topic_key):
+        """Bộ đếm chi phí của một chủ đề (request, retry, top-up, số cặp)"""
+        return self.topic_stats.setdefault(topic_key, {
+            'requests': 0, 'retries': 0, 'top_ups': 0, 'failures': 0,
+            'pairs_requested': 0, 'pairs_delivered': 0, 'duplicates': 0, 'input_tokens': 0,
+        })
+
+    def duplicate_rate(self, topic_key):
+        """Tỉ lệ cặp bị loại do trùng lặp của một chủ đề"""
+        stats = self._topic_stats(topic_key)
+        seen = stats['pairs_delivered'] + stats['duplicates']
+        return stats['duplicates'] / seen if seen else 0.0
+
+    def _remaining(self, topic_counts, results):
+        """Số cặp còn thiếu của từng chủ đề (chỉ các chủ đề chưa đủ)"""
+        return {topic_key: num_pairs - len(results[topic_key])
+                for topic_key, num_pairs in topic_counts.items()
+                if len(results[topic_key]) < num_pairs}
+
+    def _make_sink(self, results, on_pair=None):
+        """Hàm nhận từng cặp parse được: loại trùng lặp, xếp vào đúng chủ đề
+
+        Cặp thuộc chủ đề không được yêu cầu (hoặc không có tiêu đề chủ đề)
+        bị bỏ qua. Cặp trùng với chỉ mục dedup bị loại ngay (không tính vào
+        số đã nhận) nên top-up sẽ bù lại. Cặp mới chỉ được giữ chỗ trong chỉ
+        mục; người ghi dữ liệu gọi commit_pairs() sau khi đã ghi.
+        Trả về True nếu cặp được giữ lại.
+        """
+        def sink(qa):
+            qa_pairs = results.get(qa.get('topic'))
+            if qa_pairs is None:
+                return False
+            if self.dedup is not None and not self.dedup.reserve_pair(qa):
+                self._topic_stats(qa['topic'])['duplicates'] += 1
+                return False
+            qa_pairs.append(qa)
+            self.usage['pairs'] += 1
+            if on_pair:
+                on_pair(qa)
+            return True
+        return sink
+
+    def _count(self, topic_keys, field):
+        for topic_key in topic_keys:
+            self._topic_stats(topic_key)[field] += 1
+
+    def _finish(self, results):
+        for topic_key, qa_pairs in results.items():
+            self._topic_stats(topic_key)['pairs_delivered'] += len(qa_pairs)
+        return results
+
+    def _run_with_retry(self, topic_counts, request, on_pair=None):
+        """Gọi request với retry (backoff + jitter) và top-up cho đến khi đủ số cặp
+
+        topic_counts: dict {khóa chủ đề: số cặp}, một hoặc nhiều chủ đề trong
+        cùng một request. Các cặp đã nhận trước khi request lỗi được giữ lại;
+        lần thử sau chỉ yêu cầu phần còn thiếu của từng chủ đề.
+        Trả về dict {khóa chủ đề: danh sách cặp Q&A}.
+        """
+        results = {topic_key: [] for topic_key in topic_counts}
+        for topic_key, num_pairs in topic_counts.items():
+            self._topic_stats(topic_key)['pairs_requested'] += num_pairs
+        sink = self._make_sink(results, on_pair)
+
+        retries = top_ups = 0
+        while True:
+            remaining = self._remaining(topic_counts, results)
+            if not remaining:
+                break
+            self._count(remaining, 'requests')
+            try:
+                request(remaining, sink)
+            except Exception as e:
+                if not self.retry_policy.should_retry(e, retries):
+                    self._count(remaining, 'failures')
+                    received = sum(len(qa_pairs) for qa_pairs in results.values())
+                    print(f"❌ Lỗi khi sinh Q&A: {e} (giữ lại {received} cặp đã nhận)")
+                    break
+                retries += 1
+                self._count(remaining, 'retries')
+                delay = self.retry_policy.delay(retries)
+                if self.metrics is not None:
+                    self.metrics.record_retry(remaining, e, delay)
+                print(f"🔁 Lỗi tạm thời ({e}), thử lại lần {retries} sau {delay:.1f}s...")
+                time.sleep(delay)
+                continue
+
+            remaining = self._remaining(topic_counts, results)
+            if not remaining or top_ups >= self.retry_policy.max_top_ups:
+                break
+            top_ups += 1
+            self._count(remaining, 'top_ups')
+            if self.metrics is not None:
+                self.metrics.record_top_up(remaining)
+            print(f"➕ Thiếu {sum(remaining.values())} cặp, gửi request bổ sung...")
+
+        return self._finish(results)
+
+    async def _run_with_retry_async(self, topic_counts, request, on_pair=None):
+        """Phiên bản async của _run_with_retry"""
+        results = {topic_key: [] for topic_key in topic_counts}
+        for topic_key, num_pairs in topic_counts.items():
+            self._topic_stats(topic_key)['pairs_requested'] += num_pairs
+        sink = self._make_sink(results, on_pair)
+
+        retries = top_ups = 0
+        while True:
+            remaining = self._remaining(topic_counts, results)
+            if not remaining:
+                break
+            self._count(remaining, 'requests')
+            try:
+                await request(remaining, sink)
+            except Exception as e:
+                if not self.retry_policy.should_retry(e, retries):
+                    self._count(remaining, 'failures')
+                    received = sum(len(qa_pairs) for qa_pairs in results.values())
+                    print(f"❌ Lỗi khi sinh Q&A: {e} (giữ lại {received} cặp đã nhận)")
+                    break
+                retries += 1
+                self._count(remaining, 'retries')
+                delay = self.retry_policy.delay(retries)
+                if self.metrics is not None:
+                    self.metrics.record_retry(remaining, e, delay)
+                print(f"🔁 Lỗi tạm thời ({e}), thử lại lần {retries} sau {delay:.1f}s...")
+                await asyncio.sleep(delay)
+                continue
+
+            remaining = self._remaining(topic_counts, results)
+            if not remaining or top_ups >= self.retry_policy.max_top_ups:
+                break
+            top_ups += 1
+            self._count(remaining, 'top_ups')
+            if self.metrics is not None:
+                self.metrics.record_top_up(remaining)
+            print(f"➕ Thiếu {sum(remaining.values())} cặp, gửi request bổ sung...")
+
+        return self._finish(results)
+
+    def generate_qa_pairs(self, topic_key, num_pairs=10):
+        """Sinh câu hỏi và câu trả lời cho một chủ đề (có retry và top-up)"""
+        topic = self.topics.get(topic_key, "Chăm sóc người cao tuổi tổng quát")
+        print(f"🔄 Đang sinh {num_pairs} cặp Q&A cho chủ đề: {topic}")
+        return self._run_with_retry({topic_key: num_pairs}, self._request_pairs)[topic_key]
+
+    async def generate_qa_pairs_async(self, topic_key, num_pairs=10):
+        """Phiên bản async của generate_qa_pairs (dùng backend.generate_async)"""
+        topic = self.topics.get(topic_key, "Chăm sóc người cao tuổi tổng quát")
+        print(f"🔄 Đang sinh {num_pairs} cặp Q&A cho chủ đề: {topic}")
+        results = await self._run_with_retry_async({topic_key: num_pairs}, self._request_pairs_async)
+        return results[topic_key]
+
+    def generate_qa_pairs_stream(self, topic_key, num_pairs=10, on_pair=None):
+        """Sinh Q&A dạng stream, gọi on_pair(qa) ngay khi mỗi cặp hoàn chỉnh
+
+        Nếu request lỗi giữa chừng, các cặp đã nhận đủ vẫn được giữ lại.
+        """
+        topic = self.topics.get(topic_key, "Chăm sóc người cao tuổi tổng quát")
+        print(f"🔄 Đang sinh (stream) {num_pairs} cặp Q&A cho chủ đề: {topic}")
+        return self._run_with_retry({topic_key: num_pairs}, self._request_pairs_stream, on_pair)[topic_key]
+
+    async def generate_qa_pairs_stream_async(self, topic_key, num_pairs=10, on_pair=None):
+        """Phiên bản async của generate_qa_pairs_stream"""
+        topic = self.topics.get(topic_key, "Chăm sóc người cao tuổi tổng quát")
+        print(f"🔄 Đang sinh (stream) {num_pairs} cặp Q&A cho chủ đề: {topic}")
+        results = await self._run_with_retry_async({topic_key: num_pairs}, self._request_pairs_stream_async, on_pair)
+        return results[topic_key]
+
+    def generate_qa_batch(self, topic_counts):
+        """Sinh Q&A cho nhiều chủ đề trong cùng một request (prompt chia phần theo chủ đề)
+
+        topic_counts: dict {khóa chủ đề: số cặp}. Trả về dict {khóa chủ đề: cặp Q&A}.
+        """
+        print(f"🔄 Đang sinh {sum(topic_counts.values())} cặp Q&A cho {len(topic_counts)} chủ đề: "
+              f"{', '.join(topic_counts)}")
+        return self._run_with_retry(topic_counts, self._request_pairs)
+
+    async def generate_qa_batch_async(self, topic_counts, on_pair=None):
+        """Phiên bản async của generate_qa_batch; có on_pair thì dùng chế độ stream"""
+        print(f"🔄 Đang sinh {sum(topic_counts.values())} cặp Q&A cho {len(topic_counts)} chủ đề: "
+              f"{', '.join(topic_counts)}")
+        if on_pair:
+            return await self._run_with_retry_async(topic_counts, self._request_pairs_stream_async, on_pair)
+        return await self._run_with_retry_async(topic_counts, self._request_pairs_async)
+
+    def print_topic_stats(self):
+        """In chi phí thực tế theo chủ đề: request, retry, top-up trên mỗi cặp nhận được
+
+        Request nhiều chủ đề được tính cho từng chủ đề có trong request đó.
+        """
+        if not self.topic_stats:
+            return
+        print("\n💰 Chi phí theo chủ đề:")
+        print(f"   {'Chủ đề':>6} | {'Request':>7} | {'Retry':>5} | {'Top-up':>6} | {'Lỗi':>4} | "
+              f"{'Cặp':>11} | {'Trùng':>6} | Request/100 cặp")
+        for topic_key in sorted(self.topic_stats, key=lambda k: int(k) if k.isdigit() else 0):
+            stats = self.topic_stats[topic_key]
+            delivered = stats['pairs_delivered']
+            per_hundred = stats['requests'] * 100 / delivered if delivered else float('inf')
+            print(f"   {topic_key:>6} | {stats['requests']:>7} | {stats['retries']:>5} | {stats['top_ups']:>6} | "
+                  f"{stats['failures']:>4} | {delivered:>5}/{stats['pairs_requested']:<5} | "
+                  f"{self.duplicate_rate(topic_key):>6.1%} | {per_hundred:.1f}")
+        print(f"   {self.describe_usage()}")
+
+    def describe_usage(self):
+        """Hiệu quả request: số cặp trên mỗi request và trên 1000 token đầu vào"""
+        requests = self.usage['requests']
+        tokens = self.usage['input_tokens']
+        pairs = self.usage['pairs']
+        per_request = pairs / requests if requests else 0.0
+        per_kilo_token = pairs * 1000 / tokens if tokens else 0.0
+        return (f"{requests} request | {pairs} cặp | {per_request:.1f} cặp/request | "
+                f"{per_kilo_token:.2f} cặp/1000 token đầu vào")
+
+    def parse_qa_response(self, response_text, topic_key=None):
+        """Phân tích response và trích xuất các cặp Q&A
+
+        topic_key: chủ đề gắn cho các cặp; response nhiều chủ đề lấy chủ đề
+        từ các dòng tiêu đề "[CHỦ ĐỀ n]".
+        """
+        parser = StreamingQAParser(topic_key)
+        qa_pairs = parser.feed(response_text)
+        qa_pairs.extend(parser.close())
         return qa_pairs
 
-    def save_to_csv(self, qa_pairs, filename=None):
-        """Lưu dữ liệu vào file CSV"""
+    def commit_pairs(self, qa_pairs):
+        """Xác nhận các cặp đã được ghi vào dataset
+
+        Hash của chúng được lưu vào chỉ mục dedup ở lần flush chỉ mục kế tiếp,
+        lần flush này phải đến sau khi dữ liệu đã được đẩy xuống đĩa.
+        """
+        if self.dedup is not None:
+            self.dedup.commit_pairs(qa_pairs)
+
+    def save_to_csv(self, qa_pairs, filename=None, verbose=True):
+        """Lưu dữ liệu vào file CSV (verbose=False để không in thông báo)
+
+        Mỗi lần gọi mở lại file; khi ghi nhiều lô trong một phiên nên dùng
+        DatasetWriter (dataset_io.py) để giữ file mở và đệm dòng.
+        """
         if not filename:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"qa_data_{timestamp}.csv"
         
         file_exists = os.path.exists(filename)
         
+        # Giữ đúng header của file đã có (file cũ chỉ có input, output)
+        fieldnames = CSV_FIELDNAMES
+        if file_exists:
+            with open(filename, newline='', encoding='utf-8') as existing:
+                fieldnames = next(csv.reader(existing), None) or CSV_FIELDNAMES
+        
         with open(filename, 'a', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['input', 'output']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
             
             # Chỉ ghi header nếu file mới
             if not file_exists:
@@ -124,56 +680,118 @@ OUTPUT: [câu trả lời của chatbot]
             for qa in qa_pairs:
                 writer.writerow(qa)
         
-        print(f"💾 Đã lưu {len(qa_pairs)} cặp Q&A vào {filename}")
+        # Chỉ mục dedup được lưu sau dữ liệu: cặp không ghi được sẽ không bị coi là trùng
+        self.commit_pairs(qa_pairs)
+        if self.dedup is not None:
+            self.dedup.flush()
+        
+        if verbose:
+            print(f"💾 Đã lưu {len(qa_pairs)} cặp Q&A vào {filename}")
         return filename
 
-    def generate_dataset(self, total_pairs=1000, backup_interval=500):
-        """Sinh dataset lớn với backup định kỳ"""
+    def save_to_parquet(self, qa_pairs, filename=None, verbose=True):
+        """Lưu dữ liệu vào file Parquet (nén, cột topic mã hóa từ điển; cần pyarrow)
+
+        Nếu file đã tồn tại, cặp mới được ghi thành một segment nối thêm
+        (append_parquet), không ghi lại dữ liệu cũ.
+        """
+        if not filename:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"qa_data_{timestamp}.parquet"
+        
+        total_rows = append_parquet(filename, qa_pairs)
+        self.commit_pairs(qa_pairs)
+        if self.dedup is not None:
+            self.dedup.flush()
+        
+        if verbose:
+            print(f"💾 Đã lưu {len(qa_pairs)} cặp Q&A vào {filename} (tổng {total_rows} dòng)")
+        return filename
+
+    def generate_dataset(self, total_pairs=1000, backup_interval=500, max_in_flight=None, fresh=True):
+        """Sinh dataset lớn với backup định kỳ
+
+        Mọi cặp được ghi đúng một lần vào một file qua DatasetWriter mở suốt
+        phiên; mỗi backup_interval cặp file được flush + fsync xuống đĩa.
+        max_in_flight: số request chạy song song (mặc định lấy từ MAX_IN_FLIGHT
+        trong .env). Đặt 1 để chạy tuần tự như cũ.
+        fresh: True (mặc định) để luôn lấy response mới thay vì phát lại từ cache.
+        """
+        from async_generator import AsyncQAEngine
+        from topic_scheduler import TopicScheduler
+
+        scheduler = TopicScheduler(self)
+        engine = AsyncQAEngine(self, max_in_flight, scheduler=scheduler)
         print(f"🚀 Bắt đầu sinh dataset {total_pairs} cặp Q&A")
         print(f"📁 Sao lưu sau mỗi {backup_interval} cặp")
+        print(f"⚡ Số request song song: {engine.max_in_flight}")
+        print(f"⚙️ Giới hạn tốc độ: {self.rate_limiter.describe()}")
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         main_filename = f"elderly_care_qa_{timestamp}.csv"
         
         total_generated = 0
-        all_qa_pairs = []
-        
-        while total_generated < total_pairs:
-            # Chọn chủ đề ngẫu nhiên
-            topic_key = random.choice(list(self.topics.keys()))
-            batch_size = min(10, total_pairs - total_generated)
+        last_backup = 0
+        writer = DatasetWriter(main_filename,
+                               on_flush=self.metrics.record_write if self.metrics is not None else None)
+
+        def collect(qa_pairs):
+            nonlocal total_generated, last_backup
+            writer.write_many(qa_pairs)
+            self.commit_pairs(qa_pairs)
+            total_generated += len(qa_pairs)
             
-            # Sinh Q&A cho chủ đề này
-            qa_pairs = self.generate_qa_pairs(topic_key, batch_size)
+            print(f"✅ Đã sinh {total_generated}/{total_pairs} cặp Q&A")
             
-            if qa_pairs:
-                all_qa_pairs.extend(qa_pairs)
-                total_generated += len(qa_pairs)
-                
-                print(f"✅ Đã sinh {total_generated}/{total_pairs} cặp Q&A")
-                
-                # Backup định kỳ
-                if len(all_qa_pairs) >= backup_interval:
-                    backup_filename = f"backup_{len(all_qa_pairs)}_{timestamp}.csv"
-                    self.save_to_csv(all_qa_pairs, backup_filename)
-                    all_qa_pairs = []  # Reset để tiết kiệm memory
-                
-                # Nghỉ ngắn để tránh rate limit
-                time.sleep(1)
-            else:
-                print("⚠️ Không sinh được Q&A, thử lại...")
-                time.sleep(2)
+            # Backup định kỳ: đẩy file chính xuống đĩa (không ghi lại vào file backup riêng)
+            if total_generated - last_backup >= backup_interval:
+                writer.flush()
+                if self.dedup is not None:
+                    self.dedup.flush()
+                last_backup = total_generated
+                print(f"💾 Đã sao lưu {total_generated} cặp Q&A vào {main_filename}")
         
-        # Lưu phần còn lại
-        if all_qa_pairs:
-            self.save_to_csv(all_qa_pairs, main_filename)
+        previous_fresh, self.fresh = self.fresh, fresh
+        try:
+            if engine.max_in_flight > 1:
+                engine.run_dataset(total_pairs, collect)
+            else:
+                while total_generated < total_pairs:
+                    # Chọn chủ đề theo chỉ tiêu và hiệu suất (bỏ qua chủ đề đã bão hòa)
+                    topic_key = scheduler.pick()
+                    if topic_key is None:
+                        print(f"🏁 Dừng sớm: {scheduler.describe()}")
+                        break
+                    batch_size = min(10, total_pairs - total_generated)
+                    
+                    # Sinh Q&A cho chủ đề này
+                    qa_pairs = self.generate_qa_pairs(topic_key, batch_size)
+                    scheduler.observe(topic_key)
+                    
+                    if qa_pairs:
+                        # Tốc độ gọi API do rate_limiter điều tiết, không cần nghỉ cố định
+                        collect(qa_pairs)
+                    else:
+                        print("⚠️ Không sinh được Q&A, thử lại...")
+                        time.sleep(2)
+        finally:
+            self.fresh = previous_fresh
+            # Lưu phần còn lại
+            writer.close()
+            if self.dedup is not None:
+                self.dedup.flush()
+            if self.metrics is not None:
+                self.metrics.flush()
         
+        print(f"💾 Đã lưu {total_generated} cặp Q&A vào {main_filename}")
+        if self.metrics is not None:
+            print(f"📈 Metrics: {self.metrics.describe()}")
         print(f"🎉 Hoàn thành! Đã sinh tổng cộng {total_generated} cặp Q&A")
 
     def test_connection(self):
         """Test kết nối API"""
         try:
-            response = self.model.generate_content("Chào bạn!")
+            response = self._generate_content("Chào bạn!", use_cache=False)
             print(f"✅ Test thành công: {response.text[:50]}...")
             return True
         except Exception as e:
@@ -0,0 +1,275 @@
+"""
+LLM Backends - Lớp trừu tượng cho mô hình sinh văn bản
+GeminiBackend gọi Google Gemini thật, StubBackend giả lập offline để load test
+"""
+import os
+import re
+import time
+import random
+import asyncio
+from dotenv import load_dotenv
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+DEFAULT_GEMINI_MODEL = 'gemini-1.5-flash'
+
+# Số ký tự mỗi đoạn khi StubBackend giả lập stream
+STUB_CHUNK_SIZE = 80
+# Mã thoát khi StubBackend giả lập tiến trình bị chết
+STUB_CRASH_EXIT_CODE = 70
+
+
+class LLMBackend:
+    """Giao diện chung cho mọi backend
+
+    generate / generate_async nhận prompt và trả về response có thuộc tính
+    .text (và .usage_metadata nếu backend cung cấp).
+    generate_stream / generate_stream_async trả về lần lượt từng đoạn văn bản
+    ngay khi model sinh ra; on_usage (nếu có) được gọi với usage_metadata của
+    response khi stream kết thúc.
+    """
+    name = "base"
+    model_name = None
+    # False nếu backend không có quota thật (bỏ qua rate limiter mặc định)
+    rate_limited = True
+
+    def generate(self, prompt):
+        raise NotImplementedError
+
+    async def generate_async(self, prompt):
+        raise NotImplementedError
+
+    def generate_stream(self, prompt, on_usage=None):
+        raise NotImplementedError
+
+    async def generate_stream_async(self, prompt, on_usage=None):
+        raise NotImplementedError
+        yield
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, api_key=None, model_name=None):
+        """Khởi tạo backend Google Gemini (mặc định đọc GOOGLE_API_KEY trong .env)"""
+        import google.generativeai as genai
+
+        self.api_key = api_key or os.getenv('GOOGLE_API_KEY')
+        if not self.api_key:
+            raise ValueError("❌ Không tìm thấy GOOGLE_API_KEY trong file .env")
+
+        self.model_name = model_name or os.getenv('GEMINI_MODEL', DEFAULT_GEMINI_MODEL)
+        genai.configure(api_key=self.api_key)
+        self.model = genai.GenerativeModel(self.model_name)
+
+    def generate(self, prompt):
+        return self.model.generate_content(prompt)
+
+    async def generate_async(self, prompt):
+        return await self.model.generate_content_async(prompt)
+
+    def generate_stream(self, prompt, on_usage=None):
+        usage = None
+        for chunk in self.model.generate_content(prompt, stream=True):
+            # Đoạn cuối mang số token của cả response
+            usage = getattr(chunk, 'usage_metadata', None) or usage
+            yield chunk.text
+        if on_usage and usage:
+            on_usage(usage)
+
+    async def generate_stream_async(self, prompt, on_usage=None):
+        usage = None
+        response = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            usage = getattr(chunk, 'usage_metadata', None) or usage
+            yield chunk.text
+        if on_usage and usage:
+            on_usage(usage)
+
+
+class StubBackendError(Exception):
+    """Lỗi giả lập do StubBackend ném ra"""
+
+
+class StubUsage:
+    def __init__(self, prompt_tokens, completion_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = completion_tokens
+        self.total_token_count = prompt_tokens + completion_tokens
+
+
+class StubResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class StubBackend(LLMBackend):
+    """Backend giả lập không cần mạng, sinh văn bản INPUT:/OUTPUT:/--- như Gemini
+
+    latency: độ trễ trung bình mỗi request (giây)
+    jitter: biên độ dao động ngẫu nhiên quanh latency (giây)
+    error_rate: tỉ lệ request ném lỗi (một nửa là lỗi quota 429)
+    truncation_rate: tỉ lệ response bị cắt cụt giữa chừng
+    crash_rate: tỉ lệ request làm tiến trình chết đột ngột (thử cơ chế giao lại việc của worker_pool)
+    """
+    name = "stub"
+    rate_limited = False
+
+    QUESTIONS = [
+        "Tôi quên uống thuốc huyết áp rồi, giờ có nên uống không?",
+        "Dạo này tôi hay mất ngủ quá, nằm mãi không ngủ được",
+        "Con cháu đi làm hết, ở nhà một mình buồn lắm",
+        "Hôm nay nên nấu món gì cho dễ tiêu hả cháu?",
+        "Cái điện thoại này gọi video cho con kiểu gì vậy?",
+        "Sáng nay tôi thấy đau đầu với chóng mặt",
+        "Sắp đến ngày giỗ ông nhà tôi rồi, cần chuẩn bị gì?",
+        "Có người gọi bảo tôi trúng thưởng, bắt chuyển tiền, có thật không?",
+        "Trời lạnh quá, đầu gối tôi nhức mỏi",
+        "Tôi muốn nghe một bài cải lương cho vui",
+        "Nhà cửa bừa bộn quá mà tôi không dọn nổi",
+        "Mai có phải đi tái khám không nhỉ?",
+    ]
+    PREFIXES = ["", "Ôi, ", "Cháu ơi, ", "Này, ", "Tôi hỏi chút, "]
+    ANSWERS = [
+        "Dạ bác đừng lo lắng quá nhé. Bác cứ bình tĩnh, cháu sẽ hướng dẫn bác từng bước.",
+        "Cháu hiểu cảm giác của bác ạ. Bác thử nghỉ ngơi một chút và uống một cốc nước ấm nhé.",
+        "Bác nên hỏi ý kiến bác sĩ nếu tình trạng kéo dài hơn hai ngày ạ.",
+        "Cháu gợi ý bác một món canh rau ngót nấu thịt băm, vừa mát vừa dễ tiêu.",
+        "Bác nhớ không chuyển tiền cho người lạ, hãy gọi cho con cháu để hỏi lại trước nhé.",
+        "Cháu sẽ nhắc bác vào đúng giờ, bác yên tâm ạ.",
+    ]
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, truncation_rate=0.0,
+                 seed=None, model_name="stub-model", crash_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.truncation_rate = truncation_rate
+        self.crash_rate = crash_rate
+        self.model_name = model_name
+        self.random = random.Random(seed)
+
+    @classmethod
+    def from_env(cls):
+        """Tạo StubBackend theo các biến STUB_* trong .env"""
+        seed = os.getenv('STUB_SEED')
+        return cls(latency=float(os.getenv('STUB_LATENCY', '0.5')),
+                   jitter=float(os.getenv('STUB_JITTER', '0.2')),
+                   error_rate=float(os.getenv('STUB_ERROR_RATE', '0')),
+                   truncation_rate=float(os.getenv('STUB_TRUNCATION_RATE', '0')),
+                   seed=int(seed) if seed else None,
+                   crash_rate=float(os.getenv('STUB_CRASH_RATE', '0')))
+
+    def _delay(self):
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def _maybe_crash(self):
+        if self.crash_rate and self.random.random() < self.crash_rate:
+            os._exit(STUB_CRASH_EXIT_CODE)
+
+    def _maybe_fail(self):
+        if self.random.random() < self.error_rate:
+            self._fail()
+
+    def _fail(self):
+        if self.random.random() < 0.5:
+            raise StubBackendError("429 ResourceExhausted: quota exceeded (stub)")
+        raise StubBackendError("503 ServiceUnavailable: backend overloaded (stub)")
+
+    def _stream_plan(self, prompt):
+        """Chia văn bản thành các đoạn stream; nếu request lỗi thì chỉ gửi một phần rồi ném lỗi"""
+        self._maybe_crash()
+        text = self.make_text(prompt)
+        fails = self.random.random() < self.error_rate
+        if fails:
+            text = text[:self.random.randint(0, len(text))]
+        chunks = [text[i:i + STUB_CHUNK_SIZE] for i in range(0, len(text), STUB_CHUNK_SIZE)]
+        return chunks, fails
+
+    def make_text(self, prompt):
+        """Sinh văn bản theo định dạng INPUT:/OUTPUT:/--- cho số cặp yêu cầu trong prompt
+
+        Prompt nhiều chủ đề ("[CHỦ ĐỀ n] tạo k cặp") được trả lời theo từng
+        phần, mỗi phần mở đầu bằng dòng "[CHỦ ĐỀ n]".
+        """
+        sections = re.findall(r'\[CHỦ ĐỀ (\d+)\] tạo (\d+) cặp', prompt)
+        if not sections:
+            match = re.search(r'tạo (\d+) cặp', prompt)
+            sections = [(None, match.group(1) if match else 1)]
+        blocks = []
+        for topic_key, num_pairs in sections:
+            blocks.extend(self._make_blocks(int(num_pairs), topic_key))
+        text = "\n---\n".join(blocks) + "\n---"
+
+        if self.random.random() < self.truncation_rate:
+            text = text[:self.random.randint(0, len(text))]
+        return text
+
+    def _make_blocks(self, num_pairs, topic_key=None):
+        """Các khối INPUT:/OUTPUT: của một chủ đề (có dòng tiêu đề nếu có topic_key)"""
+        blocks = []
+        for i in range(num_pairs):
+            question = self.random.choice(self.PREFIXES) + self.random.choice(self.QUESTIONS)
+            answer = " ".join(self.random.sample(self.ANSWERS, self.random.randint(1, 3)))
+            if self.random.random() < 0.2:
+                # Đôi khi câu trả lời xuống dòng như Gemini thật
+                answer += "\nBác cần gì thêm cứ gọi cháu nhé."
+            blocks.append(f"INPUT: {question}\nOUTPUT: {answer}")
+        if topic_key and blocks:
+            blocks[0] = f"[CHỦ ĐỀ {topic_key}]\n" + blocks[0]
+        return blocks
+
+    def _respond(self, prompt):
+        text = self.make_text(prompt)
+        usage = StubUsage(len(prompt) // 3 + 1, len(text) // 3 + 1)
+        return StubResponse(text, usage)
+
+    def generate(self, prompt):
+        time.sleep(self._delay())
+        self._maybe_crash()
+        self._maybe_fail()
+        return self._respond(prompt)
+
+    async def generate_async(self, prompt):
+        await asyncio.sleep(self._delay())
+        self._maybe_crash()
+        self._maybe_fail()
+        return self._respond(prompt)
+
+    def generate_stream(self, prompt, on_usage=None):
+        chunks, fails = self._stream_plan(prompt)
+        chunk_delay = self._delay() / max(1, len(chunks))
+        for chunk in chunks:
+            time.sleep(chunk_delay)
+            yield chunk
+        if fails:
+            self._fail()
+        if on_usage:
+            on_usage(StubUsage(len(prompt) // 3 + 1, len("".join(chunks)) // 3 + 1))
+
+    async def generate_stream_async(self, prompt, on_usage=None):
+        chunks, fails = self._stream_plan(prompt)
+        chunk_delay = self._delay() / max(1, len(chunks))
+        for chunk in chunks:
+            await asyncio.sleep(chunk_delay)
+            yield chunk
+        if fails:
+            self._fail()
+        if on_usage:
+            on_usage(StubUsage(len(prompt) // 3 + 1, len("".join(chunks)) // 3 + 1))
+
+
+BACKENDS = {
+    'gemini': GeminiBackend,
+    'stub': StubBackend.from_env,
+}
+
+
+def create_backend(name=None):
+    """Tạo backend theo tên (mặc định biến LLM_BACKEND trong .env, hoặc 'gemini')"""
+    name = (name or os.getenv('LLM_BACKEND', 'gemini')).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"❌ Backend không hợp lệ: {name} (hỗ trợ: {', '.join(BACKENDS)})")
+    return BACKENDS[name]()
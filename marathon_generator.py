@@ -6,33 +6,183 @@ import signal
 import sys
 import time
 import os
+import argparse
 from datetime import datetime
+from dotenv import load_dotenv
 from generator_google import QAGenerator
+from async_generator import AsyncQAEngine
+from topic_scheduler import TopicScheduler
+from marathon_journal import (MarathonJournal, find_round_segments, load_checkpoint, repair_segment,
+                              resolve_session, save_checkpoint)
+from dataset_io import dataset_extension, iter_dataset
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+# Số cặp mỗi chủ đề mỗi lượt (trung bình; TopicScheduler chia lại theo chỉ tiêu và hiệu suất)
+PAIRS_PER_TOPIC = 30
+# Ngoài các mốc xong chủ đề/xong lượt, lưu checkpoint ít nhất mỗi N giây
+CHECKPOINT_SECONDS = float(os.getenv('CHECKPOINT_SECONDS', '30'))
 
 class MarathonGenerator:
-    def __init__(self):
-        """Khởi tạo Marathon Generator"""
-        self.generator = QAGenerator()
+    def __init__(self, max_in_flight=None, backend=None, fresh=True, resume=None):
+        """Khởi tạo Marathon Generator
+
+        max_in_flight: số chủ đề sinh song song trong một lượt
+        (mặc định lấy từ MAX_IN_FLIGHT trong .env)
+        backend: LLMBackend tùy chọn (vd. StubBackend để load test offline)
+        fresh: True (mặc định) để luôn sinh dữ liệu mới; False để phát lại
+        các response đã có trong cache (chạy lại pipeline không tốn quota)
+        resume: mã phiên, thư mục rounds hoặc 'latest' để tiếp tục một phiên
+        từ checkpoint (đúng lượt, đúng các chủ đề còn thiếu)
+        """
+        self.generator = QAGenerator(backend=backend, fresh=fresh)
+        self.engine = AsyncQAEngine(self.generator, max_in_flight,
+                                    should_continue=lambda: self.running)
         self.running = True
         self.current_round = 1
         self.total_generated = 0
-        self.all_qa_pairs = []
+        # Con trỏ của lượt hiện tại: file round, số cặp dự kiến, các chủ đề đã xong, số cặp đã ghi theo chủ đề
+        self.round_file = None
+        self.round_plan = {}
+        self.round_done = set()
+        self.round_counts = {}
+        # Số cặp của lượt hiện tại đã được tính vào topic_stats['pairs_delivered'] (theo chủ đề)
+        self.round_delivered = {}
+        self._resume_round = False
+        self._last_checkpoint = time.monotonic()
         
-        # Tạo thư mục chứa kết quả
-        self.session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.rounds_dir = f"marathon_rounds_{self.session_id}"
+        # Tạo thư mục chứa kết quả (hoặc dùng lại thư mục của phiên được tiếp tục)
+        if resume:
+            self.rounds_dir = resolve_session(resume)
+            self.session_id = os.path.basename(os.path.normpath(self.rounds_dir)).replace('marathon_rounds_', '')
+        else:
+            self.session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+            self.rounds_dir = f"marathon_rounds_{self.session_id}"
         self.final_dir = "marathon_finals"
         
         # Tạo thư mục nếu chưa có
         os.makedirs(self.rounds_dir, exist_ok=True)
         os.makedirs(self.final_dir, exist_ok=True)
         
+        # Journal append-only: mỗi cặp chỉ ghi một lần vào file round,
+        # file final được ghép từ các file round nên bộ nhớ không tăng theo thời gian
+        metrics = self.generator.metrics
+        self.journal = MarathonJournal(self.rounds_dir, on_flush=metrics.record_write if metrics is not None else None)
+        state = load_checkpoint(self.rounds_dir) if resume else None
+        if state:
+            self._restore(state)
+        # Lập lịch chủ đề theo chỉ tiêu và số cặp mới trên mỗi request / token
+        # (tạo sau _restore để đọc topic_stats đã đối chiếu với file round)
+        self.scheduler = TopicScheduler(self.generator, state=(state or {}).get('scheduler'))
+        
         print(f"📁 Thư mục rounds: {self.rounds_dir}")
         print(f"📁 Thư mục finals: {self.final_dir}")
         
         # Thiết lập signal handler cho Ctrl+C
         signal.signal(signal.SIGINT, self.signal_handler)
         
+    def _restore(self, state):
+        """Khôi phục bộ đếm và con trỏ lượt từ checkpoint
+
+        File round của lượt dở dang được kiểm tra và cắt về dòng hoàn chỉnh
+        cuối cùng; các cặp đã ghi sau checkpoint cuối vẫn được giữ và tính lại.
+        Số cặp đã nhận của từng chủ đề (topic_stats, scheduler dùng để lập
+        lịch) và chỉ mục dedup được đối chiếu lại theo nội dung file round.
+        """
+        self.current_round = state['current_round']
+        self.total_generated = state['total_generated']
+        self.journal.total_rows = state['journal_rows']
+        self.journal.segments = find_round_segments(self.rounds_dir)
+        self.generator.topic_stats = state.get('topic_stats', {})
+        self.generator.usage.update(state.get('usage', {}))
+
+        round_file = state.get('round_file')
+        if not round_file or not os.path.exists(round_file):
+            print(f"♻️ Tiếp tục phiên {self.session_id} từ lượt {self.current_round}")
+            return
+        if os.path.getsize(round_file) < state.get('round_offset', 0):
+            print(f"⚠️ File round ngắn hơn lúc lưu checkpoint, một phần dữ liệu đã mất: {round_file}")
+        removed, counts = repair_segment(round_file)
+        if removed:
+            print(f"✂️ Đã cắt {removed} byte ghi dở ở cuối {round_file}")
+        # Cặp ghi sau checkpoint cuối (hoặc bị mất) làm lệch bộ đếm: tính lại từ file
+        saved_counts = state.get('round_counts', {})
+        delta = sum(counts.values()) - sum(saved_counts.values())
+        self.total_generated += delta
+        self.journal.total_rows += delta
+        self.generator.usage['pairs'] = max(0, self.generator.usage.get('pairs', 0) + delta)
+        self.round_file = round_file
+        # Checkpoint cũ chưa có round_plan: mỗi chủ đề PAIRS_PER_TOPIC cặp như trước
+        self.round_plan = state.get('round_plan') or dict.fromkeys(self.generator.topics, PAIRS_PER_TOPIC)
+        # Chủ đề mất cặp do file bị cắt không còn được coi là xong
+        self.round_done = {topic_key for topic_key in state.get('round_done', [])
+                           if counts.get(topic_key, 0) >= saved_counts.get(topic_key, 0)}
+        self.round_counts = counts
+
+        # pairs_delivered chỉ tăng khi một chủ đề sinh xong: cặp của chủ đề đang
+        # sinh dở (hoặc ghi sau checkpoint) chưa được tính, cặp bị cắt thì đã tính thừa.
+        # Checkpoint cũ chưa có round_delivered: chủ đề đã xong được tính đủ.
+        delivered = state.get('round_delivered')
+        if delivered is None:
+            delivered = {topic_key: saved_counts.get(topic_key, 0) for topic_key in state.get('round_done', [])}
+        for topic_key in set(counts) | set(delivered):
+            stats = self.generator._topic_stats(topic_key)
+            stats['pairs_delivered'] = max(0, stats['pairs_delivered'] + counts.get(topic_key, 0)
+                                           - delivered.get(topic_key, 0))
+        self.round_delivered = dict(counts)
+
+        # Hash của cặp ghi sau lần flush chỉ mục cuối chỉ nằm trong bộ nhớ: nạp lại từ file round
+        if self.generator.dedup is not None:
+            for chunk in iter_dataset(round_file, columns=['input', 'output'], as_text=True):
+                self.generator.commit_pairs(chunk.to_dict('records'))
+            self.generator.dedup.flush()
+        self._resume_round = True
+        print(f"♻️ Tiếp tục phiên {self.session_id} ở lượt {self.current_round}: "
+              f"{len(self.round_done)} chủ đề đã xong, {sum(counts.values())} cặp đã ghi")
+
+    def save_checkpoint(self, finished=False):
+        """Lưu trạng thái phiên sau khi đẩy dữ liệu và chỉ mục dedup xuống đĩa"""
+        self.journal.sync()
+        if self.generator.dedup is not None:
+            self.generator.dedup.flush()
+        save_checkpoint(self.rounds_dir, {
+            'session_id': self.session_id,
+            'current_round': self.current_round,
+            'round_file': self.round_file,
+            'round_offset': os.path.getsize(self.round_file) if self.round_file and os.path.exists(self.round_file) else 0,
+            'round_plan': self.round_plan,
+            'round_done': sorted(self.round_done, key=int),
+            'round_counts': self.round_counts,
+            'round_delivered': self.round_delivered,
+            'total_generated': self.total_generated,
+            'journal_rows': self.journal.total_rows,
+            'topic_stats': self.generator.topic_stats,
+            'usage': self.generator.usage,
+            'scheduler': self.scheduler.to_dict(),
+            'finished': finished,
+            'updated_at': datetime.now().isoformat(timespec='seconds'),
+        })
+        self._last_checkpoint = time.monotonic()
+
+    def _on_pair(self, qa):
+        """Ghi một cặp vào journal, cập nhật con trỏ lượt và lưu checkpoint định kỳ"""
+        self.journal.append(qa)
+        self.generator.commit_pairs([qa])
+        self.total_generated += 1
+        self.round_counts[qa['topic']] = self.round_counts.get(qa['topic'], 0) + 1
+        if time.monotonic() - self._last_checkpoint >= CHECKPOINT_SECONDS:
+            self.save_checkpoint()
+
+    def _on_topic_done(self, topic_key, qa_pairs, elapsed):
+        # Generator đã cộng các cặp của chủ đề vào pairs_delivered khi sinh xong
+        self.round_delivered[topic_key] = self.round_counts.get(topic_key, 0)
+        self.scheduler.observe(topic_key)
+        # Chủ đề bị bỏ dở do Ctrl+C không được tính là xong (lần tiếp tục sẽ sinh nốt)
+        if self.running:
+            self.round_done.add(topic_key)
+            self.save_checkpoint()
+
     def signal_handler(self, signum, frame):
         """Xử lý khi nhận tín hiệu dừng (Ctrl+C)"""
         print("\n\n🛑 Nhận tín hiệu dừng...")
@@ -44,7 +194,9 @@ class MarathonGenerator:
         """Chạy marathon sinh dữ liệu liên tục"""
         print("🏃‍♂️ MARATHON GENERATOR - SINH DỮ LIỆU LIÊN TỤC")
         print("=" * 60)
-        print("📋 Cấu hình: Mỗi chủ đề 30 câu | 12 chủ đề = 360 câu/lượt")
+        print(f"📋 Cấu hình: {PAIRS_PER_TOPIC * len(self.generator.topics)} câu/lượt, "
+              f"chia theo chỉ tiêu và hiệu suất từng chủ đề")
+        print(f"⚡ Số chủ đề sinh song song: {self.engine.max_in_flight}")
         print("⏹️  Nhấn Ctrl+C để dừng an toàn")
         print("🚀 Bắt đầu sinh dữ liệu...\n")
         
@@ -52,61 +204,69 @@ class MarathonGenerator:
             while self.running:
                 print(f"🔄 === LƯỢT {self.current_round} === ")
                 round_start_time = time.time()
-                round_qa_pairs = []
                 
-                # Sinh từng chủ đề theo thứ tự (1-12)
-                for topic_key in sorted(self.generator.topics.keys(), key=int):
-                    if not self.running:
-                        print("🔄 Dừng ở giữa lượt...")
+                # File round của lượt này: mỗi cặp được ghi vào journal ngay khi stream về
+                if self._resume_round:
+                    # Lượt dở dang: ghi tiếp vào file cũ, chỉ sinh phần còn thiếu của từng chủ đề
+                    filepath = self.journal.resume_round(self.round_file)
+                    self._resume_round = False
+                else:
+                    # Chủ đề thiếu chỉ tiêu / hiệu suất cao nhận nhiều cặp hơn và được gửi trước
+                    plan = self.scheduler.plan_round(PAIRS_PER_TOPIC * len(self.generator.topics), PAIRS_PER_TOPIC)
+                    if not plan:
+                        print(f"🏁 Không còn chủ đề nào cần sinh ({self.scheduler.describe()})")
+                        self.running = False
                         break
-                        
+                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                    filepath = self.journal.start_round(self.current_round, timestamp)
+                    self.round_file, self.round_plan, self.round_done, self.round_counts = filepath, plan, set(), {}
+                    self.round_delivered = {}
+                remaining = {topic_key: num_pairs - self.round_counts.get(topic_key, 0)
+                             for topic_key, num_pairs in self.round_plan.items()
+                             if topic_key not in self.round_done
+                             and self.round_counts.get(topic_key, 0) < num_pairs}
+                self.save_checkpoint()
+                
+                # Sinh đồng thời các chủ đề theo thứ tự ưu tiên của lịch
+                results = self.engine.run_round(list(remaining), remaining, on_pair=self._on_pair,
+                                                on_result=self._on_topic_done)
+                self.journal.end_round()
+                
+                round_count = 0
+                for topic_key, qa_pairs, elapsed in results:
                     topic_name = self.generator.topics[topic_key]
                     print(f"📝 Chủ đề {topic_key}: {topic_name[:50]}...")
                     
-                    # Sinh 30 câu cho chủ đề này
-                    start_time = time.time()
-                    qa_pairs = self.generator.generate_qa_pairs(topic_key, 30)
-                    elapsed = time.time() - start_time
-                    
                     if qa_pairs:
-                        round_qa_pairs.extend(qa_pairs)
-                        self.total_generated += len(qa_pairs)
-                        print(f"   ✅ Sinh được {len(qa_pairs)} câu trong {elapsed:.1f}s | Tổng: {self.total_generated}")
-                    else:
+                        round_count += len(qa_pairs)
+                        print(f"   ✅ Sinh được {len(qa_pairs)} câu trong {elapsed:.1f}s | Tổng: {self.total_generated}"
+                              f" | Trùng lặp: {self.generator.duplicate_rate(topic_key):.0%}")
+                    elif self.running:
                         print(f"   ❌ Lỗi sinh chủ đề {topic_key}")
-                    
-                    # Nghỉ 2 giây giữa các chủ đề (nếu vẫn đang chạy)
-                    if self.running and topic_key != "12":  # Không nghỉ sau chủ đề cuối
-                        time.sleep(2)
                 
-                # Lưu dữ liệu sau mỗi lượt hoàn thành
-                if round_qa_pairs:
-                    self.all_qa_pairs.extend(round_qa_pairs)
-                    
-                    # Lưu file backup cho lượt này vào thư mục rounds
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename = f"marathon_round_{self.current_round}_{timestamp}.csv"
-                    filepath = os.path.join(self.rounds_dir, filename)
-                    self.generator.save_to_csv(round_qa_pairs, filepath)
-                    
+                if not self.running:
+                    print("🔄 Dừng ở giữa lượt...")
+                
+                # Tổng kết lượt (file round đã được ghi dần trong lúc stream)
+                if round_count:
                     round_time = time.time() - round_start_time
                     print(f"\n🎉 Hoàn thành lượt {self.current_round}!")
-                    print(f"📊 Sinh được {len(round_qa_pairs)} câu trong {round_time/60:.1f} phút")
+                    print(f"📊 Sinh được {round_count} câu trong {round_time/60:.1f} phút")
                     print(f"💾 Đã lưu: {filepath}")
                     print(f"📈 Tổng cộng: {self.total_generated} câu")
-                    print(f"🏆 Tốc độ trung bình: {len(round_qa_pairs)/(round_time/60):.1f} câu/phút\n")
+                    print(f"🏆 Tốc độ trung bình: {round_count/(round_time/60):.1f} câu/phút\n")
                 
-                self.current_round += 1
+                if self.running:
+                    # Lượt đã xong trọn vẹn: checkpoint trỏ sang lượt kế tiếp
+                    self.current_round += 1
+                    self.round_file, self.round_plan, self.round_done, self.round_counts = None, {}, set(), {}
+                    self.round_delivered = {}
+                    self.save_checkpoint()
                 
-                # Nghỉ 5 giây trước lượt tiếp theo (nếu vẫn đang chạy)
+                # Không nghỉ cố định giữa các lượt: rate_limiter điều tiết tốc độ
                 if self.running:
-                    print("⏰ Nghỉ 5 giây trước lượt tiếp theo...")
-                    for i in range(5, 0, -1):
-                        if not self.running:
-                            break
-                        print(f"   {i}...", end=" ", flush=True)
-                        time.sleep(1)
-                    print("\n")
+                    print(f"🎯 Lịch chủ đề: {self.scheduler.describe()}")
+                    print(f"⚙️ Giới hạn tốc độ: {self.generator.rate_limiter.describe()}\n")
                     
         except Exception as e:
             print(f"\n❌ Lỗi không mong muốn: {e}")
@@ -117,20 +277,34 @@ class MarathonGenerator:
         """Lưu kết quả tổng hợp cuối cùng"""
         print("\n📊 === TỔNG KẾT ===")
         
-        if self.all_qa_pairs:
+        self.save_checkpoint(finished=True)
+        self.journal.close()
+        if self.generator.metrics is not None:
+            self.generator.metrics.close()
+        print(f"♻️ Tiếp tục phiên này: python marathon_generator.py --resume {self.session_id}")
+        if self.journal.total_rows:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            final_filename = f"marathon_final_{timestamp}.csv"
+            # Định dạng file final theo OUTPUT_FORMAT (csv hoặc parquet)
+            final_filename = f"marathon_final_{timestamp}{dataset_extension()}"
             final_filepath = os.path.join(self.final_dir, final_filename)
             
-            # Lưu file final
-            self.generator.save_to_csv(self.all_qa_pairs, final_filepath)
+            # Ghép các file round thành file final (không giữ dữ liệu trong bộ nhớ)
+            final_rows = self.journal.build_final(final_filepath)
             
             # Lấy đường dẫn tuyệt đối để hiển thị
             absolute_path = os.path.abspath(final_filepath)
             
             print(f"🎯 Hoàn thành: {self.current_round - 1} lượt")
+            if self.generator.cache:
+                print(f"🗄️ Response cache: {self.generator.cache.describe()}")
+            if self.generator.dedup is not None:
+                print(f"🧬 Chống trùng lặp: {self.generator.dedup.describe()}")
+            if self.generator.metrics is not None:
+                print(f"📈 Metrics: {self.generator.metrics.describe()}")
             print(f"📝 Tổng số câu: {self.total_generated}")
-            print(f"� Kích thước dataset: {len(self.all_qa_pairs)} dòng")
+            self.generator.print_topic_stats()
+            self.scheduler.print_table()
+            print(f"� Kích thước dataset: {final_rows} dòng")
             print(f"� Thư mục rounds: {os.path.abspath(self.rounds_dir)}")
             print(f"🎯 FILE FINAL: {absolute_path}")
             print(f"⭐ Dataset đã sẵn sàng để training chatbot!")
@@ -147,6 +321,12 @@ class MarathonGenerator:
 
 def main():
     """Hàm main chạy Marathon Generator"""
+    parser = argparse.ArgumentParser(description="Sinh dữ liệu liên tục cho tất cả chủ đề")
+    parser.add_argument('--resume', nargs='?', const='latest', metavar='SESSION',
+                        help="Tiếp tục phiên từ checkpoint (mã phiên hoặc thư mục rounds; bỏ trống = phiên gần nhất)")
+    parser.add_argument('--replay', action='store_true',
+                        help="Phát lại response đã có trong cache thay vì gọi model (chạy lại pipeline không tốn quota)")
+    args = parser.parse_args()
     try:
         print("🔥 KHỞI ĐỘNG MARATHON GENERATOR")
         print("📖 Đây là chế độ sinh dữ liệu liên tục")
@@ -154,7 +334,7 @@ def main():
         print("⚠️  Lưu ý: Nhấn Ctrl+C để dừng an toàn\n")
         
         # Khởi tạo và chạy
-        marathon = MarathonGenerator()
+        marathon = MarathonGenerator(resume=args.resume, fresh=not args.replay)
         marathon.run_marathon()
         
     except KeyboardInterrupt:
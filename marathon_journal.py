@@ -0,0 +1,275 @@
+"""
+Marathon Journal - Ghi nhật ký append-only cho Marathon Generator
+Mỗi cặp Q&A chỉ được ghi một lần vào file round; file final được ghép từ các file round
+"""
+import io
+import os
+import re
+import csv
+import sys
+import glob
+import json
+from dotenv import load_dotenv
+from dataset_io import DatasetWriter, convert_dataset, is_parquet
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+FIELDNAMES = ['input', 'output', 'topic']
+
+# Gọi fsync sau mỗi N dòng hoặc mỗi T giây (cái nào đến trước)
+DEFAULT_FSYNC_ROWS = int(os.getenv('JOURNAL_FSYNC_ROWS', '200'))
+DEFAULT_FSYNC_SECONDS = float(os.getenv('JOURNAL_FSYNC_SECONDS', '2.0'))
+
+ROUND_FILE_PATTERN = re.compile(r'marathon_round_(\d+)_')
+
+# Checkpoint trạng thái phiên marathon (ghi đè nguyên tử trong thư mục rounds)
+CHECKPOINT_NAME = 'checkpoint.json'
+CHECKPOINT_VERSION = 1
+
+
+class MarathonJournal:
+    def __init__(self, rounds_dir, fsync_rows=None, fsync_seconds=None, on_flush=None):
+        """Khởi tạo journal ghi vào thư mục rounds_dir
+
+        fsync_rows / fsync_seconds: ngưỡng gom nhóm fsync (mặc định theo
+        JOURNAL_FSYNC_ROWS / JOURNAL_FSYNC_SECONDS trong .env)
+        on_flush: chuyển cho DatasetWriter của từng segment (đo độ trễ ghi)
+        """
+        self.rounds_dir = rounds_dir
+        self.on_flush = on_flush
+        self.fsync_rows = fsync_rows or DEFAULT_FSYNC_ROWS
+        self.fsync_seconds = fsync_seconds or DEFAULT_FSYNC_SECONDS
+        self.segments = []
+        self.total_rows = 0
+        self._writer = None
+
+        os.makedirs(rounds_dir, exist_ok=True)
+
+    def start_round(self, round_number, timestamp):
+        """Mở file round mới (một segment của journal) bằng một DatasetWriter"""
+        self.end_round()
+        filename = f"marathon_round_{round_number}_{timestamp}.csv"
+        filepath = os.path.join(self.rounds_dir, filename)
+        self._writer = DatasetWriter(filepath, flush_rows=self.fsync_rows, flush_seconds=self.fsync_seconds,
+                                     fsync='batch', fieldnames=FIELDNAMES, on_flush=self.on_flush)
+        self.segments.append(filepath)
+        return filepath
+
+    def resume_round(self, filepath):
+        """Mở lại file round dở dang (sau repair_segment) để ghi tiếp vào cuối"""
+        self.end_round()
+        self._writer = DatasetWriter(filepath, flush_rows=self.fsync_rows, flush_seconds=self.fsync_seconds,
+                                     fsync='batch', fieldnames=FIELDNAMES, on_flush=self.on_flush)
+        if filepath not in self.segments:
+            self.segments.append(filepath)
+        return filepath
+
+    def append(self, qa):
+        """Ghi một cặp Q&A vào segment hiện tại, fsync theo lô"""
+        self._writer.write(qa)
+        self.total_rows += 1
+
+    def sync(self):
+        """Đẩy dữ liệu của segment hiện tại xuống đĩa"""
+        if self._writer:
+            self._writer.flush()
+
+    def end_round(self):
+        """Đóng segment hiện tại sau khi fsync"""
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+    def close(self):
+        self.end_round()
+
+    def build_final(self, final_path):
+        """Ghép các segment thành file final (stream, bộ nhớ không đổi)
+
+        final_path đuôi .parquet: ghép thành CSV tạm rồi chuyển sang Parquet.
+        """
+        self.end_round()
+        if not is_parquet(final_path):
+            return concatenate_segments(self.segments, final_path)
+        temp_csv = final_path + '.csv.tmp'
+        try:
+            concatenate_segments(self.segments, temp_csv)
+            return convert_dataset(temp_csv, final_path)
+        finally:
+            if os.path.exists(temp_csv):
+                os.remove(temp_csv)
+
+
+def concatenate_segments(segments, final_path):
+    """Ghép các file CSV cùng header thành final_path theo kiểu stream
+
+    Chỉ chép đến bản ghi hoàn chỉnh cuối cùng của mỗi file (bỏ dòng bị ghi
+    dở khi tiến trình bị kill), bản ghi được tách như repair_segment nên ô
+    nhiều dòng trong dấu nháy chỉ tính là một dòng. Header của mỗi file phải
+    đúng FIELDNAMES. Ghi ra file tạm rồi đổi tên nguyên tử.
+    Trả về số dòng dữ liệu đã ghép.
+    """
+    directory = os.path.dirname(final_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    temp_path = final_path + '.tmp'
+    total_rows = 0
+    try:
+        with open(temp_path, 'wb') as out:
+            out.write((','.join(FIELDNAMES) + '\r\n').encode('utf-8'))
+            for segment in segments:
+                if not os.path.exists(segment):
+                    continue
+                with open(segment, 'rb') as src:
+                    records = _iter_records(src)
+                    header = next(records, None)
+                    if header is None:
+                        continue
+                    if _parse_record(header[0]) != FIELDNAMES:
+                        raise ValueError(f"❌ Header của {segment} khác {','.join(FIELDNAMES)}, không thể ghép")
+                    for record, _ in records:
+                        out.write(record)
+                        total_rows += 1
+            out.flush()
+            os.fsync(out.fileno())
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, final_path)
+    return total_rows
+
+
+def _iter_records(f):
+    """Duyệt các bản ghi CSV hoàn chỉnh của file nhị phân: (bytes, vị trí kết thúc)
+
+    Một bản ghi có thể gồm nhiều dòng vật lý nếu xuống dòng nằm trong dấu
+    nháy; dừng ở dòng cuối không có ký tự xuống dòng (bị ghi dở).
+    """
+    record = b''
+    offset = f.tell()
+    for line in f:
+        offset += len(line)
+        if not line.endswith(b'\n'):
+            return
+        record += line
+        if record.count(b'"') % 2:
+            continue  # Xuống dòng nằm trong dấu nháy, bản ghi chưa kết thúc
+        yield record, offset
+        record = b''
+
+
+def _parse_record(record):
+    """Tách một bản ghi CSV thành các ô (ValueError nếu không đọc được)"""
+    try:
+        return next(csv.reader(io.StringIO(record.decode('utf-8'), newline='')), [])
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ValueError(str(e))
+
+
+def repair_segment(path):
+    """Kiểm tra file round và cắt bỏ phần ghi dở ở cuối (sau khi tiến trình bị kill)
+
+    Giữ đến dòng CSV hoàn chỉnh cuối cùng có đủ số cột như header (một dòng
+    có thể gồm nhiều dòng vật lý nếu nằm trong dấu nháy). Trả về
+    (số byte bị cắt, {chủ đề: số dòng}) của phần được giữ lại.
+    """
+    header = None
+    topic_index = None
+    topics = {}
+    valid_end = 0
+    with open(path, 'rb') as f:
+        for record, offset in _iter_records(f):
+            try:
+                fields = _parse_record(record)
+            except ValueError:
+                break
+            if header is None:
+                header = fields
+                topic_index = header.index('topic') if 'topic' in header else None
+            elif len(fields) != len(header):
+                break
+            elif topic_index is not None:
+                topics[fields[topic_index]] = topics.get(fields[topic_index], 0) + 1
+            valid_end = offset
+
+    removed = os.path.getsize(path) - valid_end
+    if removed:
+        with open(path, 'r+b') as f:
+            f.truncate(valid_end)
+            os.fsync(f.fileno())
+    return removed, topics
+
+
+def save_checkpoint(rounds_dir, state):
+    """Ghi trạng thái phiên ra file tạm, fsync rồi đổi tên (không bao giờ để lại checkpoint dở dang)"""
+    path = os.path.join(rounds_dir, CHECKPOINT_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(dict(state, version=CHECKPOINT_VERSION), f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def load_checkpoint(rounds_dir):
+    """Trạng thái phiên đã lưu trong rounds_dir, hoặc None nếu chưa có"""
+    try:
+        with open(os.path.join(rounds_dir, CHECKPOINT_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def resolve_session(session):
+    """Thư mục rounds của một phiên: 'latest', mã phiên (20240101_120000) hoặc đường dẫn thư mục
+
+    Báo ValueError nếu không tìm thấy phiên có checkpoint.
+    """
+    if session == 'latest':
+        candidates = [path for path in glob.glob('marathon_rounds_*')
+                      if os.path.exists(os.path.join(path, CHECKPOINT_NAME))]
+        if not candidates:
+            raise ValueError("❌ Không có phiên marathon nào có checkpoint để tiếp tục")
+        return max(candidates, key=lambda path: os.path.getmtime(os.path.join(path, CHECKPOINT_NAME)))
+    rounds_dir = session if os.path.isdir(session) else f"marathon_rounds_{session}"
+    if not os.path.exists(os.path.join(rounds_dir, CHECKPOINT_NAME)):
+        raise ValueError(f"❌ Không tìm thấy checkpoint của phiên {session} ({rounds_dir})")
+    return rounds_dir
+
+
+def find_round_segments(rounds_dir):
+    """Liệt kê các file round trong thư mục, sắp xếp theo số lượt"""
+    files = glob.glob(os.path.join(rounds_dir, "marathon_round_*.csv"))
+
+    def round_number(path):
+        match = ROUND_FILE_PATTERN.search(os.path.basename(path))
+        return int(match.group(1)) if match else 0
+
+    return sorted(files, key=lambda path: (round_number(path), path))
+
+
+def main():
+    """Dựng lại file final từ thư mục rounds (vd. sau khi marathon bị kill)"""
+    if len(sys.argv) < 2:
+        print("Cách dùng: python marathon_journal.py <marathon_rounds_dir> [final.csv]")
+        sys.exit(1)
+
+    rounds_dir = sys.argv[1]
+    session = os.path.basename(os.path.normpath(rounds_dir)).replace('marathon_rounds_', '')
+    final_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(
+        "marathon_finals", f"marathon_final_{session}_rebuilt.csv")
+
+    segments = find_round_segments(rounds_dir)
+    if not segments:
+        print(f"❌ Không tìm thấy file round trong {rounds_dir}")
+        sys.exit(1)
+
+    rows = concatenate_segments(segments, final_path)
+    print(f"✅ Đã ghép {len(segments)} file round ({rows} dòng)")
+    print(f"📂 {os.path.abspath(final_path)}")
+
+
+if __name__ == "__main__":
+    main()
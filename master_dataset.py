@@ -0,0 +1,378 @@
+"""
+Master Dataset - Gộp tăng dần các file dataset vào một dataset chính
+Manifest ghi lại các file đã gộp (đường dẫn, kích thước, mtime, hash nội dung, vị trí đã đọc);
+mỗi lần chạy chỉ đọc phần mới của file mới/được ghi thêm và chỉ nối thêm các cặp Q&A chưa có
+"""
+import io
+import os
+import sys
+import csv
+import json
+import hashlib
+import argparse
+from datetime import datetime
+from dotenv import load_dotenv
+from dedup_index import DedupIndex, pair_hash
+import pandas as pd
+from dataset_io import (FIELDNAMES, append_parquet, find_dataset_files, is_parquet, iter_dataset,
+                        parquet_parts, parquet_rows, remove_parquet_segments)
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+DEFAULT_MASTER_PATH = os.getenv('MASTER_DATASET', 'master_dataset.csv')
+MANIFEST_VERSION = 2
+HASH_BLOCK_SIZE = 1024 * 1024
+# Số byte ngay trước vị trí đã đọc được hash lại để nhận ra file chỉ được ghi thêm vào cuối
+TAIL_BYTES = 4096
+
+
+def tail_digest(path, offset):
+    """Hash TAIL_BYTES byte ngay trước offset của file"""
+    with open(path, 'rb') as f:
+        f.seek(max(0, offset - TAIL_BYTES))
+        return hashlib.blake2b(f.read(min(offset, TAIL_BYTES)), digest_size=16).hexdigest()
+
+
+def complete_rows_end(path, start):
+    """Vị trí ngay sau dòng CSV hoàn chỉnh cuối cùng kể từ start
+
+    Chỉ đọc phần từ start đến cuối file. Xuống dòng nằm trong dấu nháy
+    (trường nhiều dòng) không được tính là hết dòng; dòng đang ghi dở ở
+    cuối file bị bỏ qua cho đến lần gộp sau.
+    """
+    end = position = start
+    in_quotes = False
+    with open(path, 'rb') as f:
+        f.seek(start)
+        for line in f:
+            position += len(line)
+            if line.count(b'"') % 2:
+                in_quotes = not in_quotes
+            if line.endswith(b'\n') and not in_quotes:
+                end = position
+    return end
+
+
+class _ByteRange(io.RawIOBase):
+    """Đọc đoạn [start, end) của một file nhị phân như một file riêng"""
+
+    def __init__(self, f, start, end):
+        f.seek(start)
+        self._file = f
+        self._remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._file.read(min(len(buffer), self._remaining))
+        buffer[:len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
+
+
+def file_digest(path):
+    """Hash nội dung file (blake2b 128-bit), đọc theo khối để không tốn bộ nhớ
+
+    Dataset Parquet được hash cùng các segment ghi nối của nó.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (parquet_parts(path) if is_parquet(path) else [path]):
+        with open(part, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class MasterDataset:
+    def __init__(self, path=None, chunksize=50_000):
+        """Mở dataset chính tại path (mặc định MASTER_DATASET trong .env)
+
+        Trạng thái nằm cạnh file chính:
+        - <tên>.manifest.json: các file đầu vào đã gộp
+        - <tên>.dedup.bin: chỉ mục hash các cặp đã có (DedupIndex), nên lần
+          gộp sau không phải đọc lại dataset chính để khử trùng lặp.
+        Nếu file chính bị xóa, trạng thái cũ được bỏ và gộp lại từ đầu; nếu
+        lần gộp trước bị ngắt sau khi đã nối dữ liệu, phần nối thêm đó được
+        đưa vào chỉ mục (_recover) để không bị nối lại lần nữa.
+        """
+        self.path = path or DEFAULT_MASTER_PATH
+        self.chunksize = chunksize
+        base = os.path.splitext(self.path)[0]
+        self.manifest_path = base + '.manifest.json'
+        self.index_path = base + '.dedup.bin'
+
+        if not os.path.exists(self.path):
+            for stale in (self.manifest_path, self.index_path):
+                if os.path.exists(stale):
+                    os.remove(stale)
+            if is_parquet(self.path):
+                remove_parquet_segments(self.path)
+        self.manifest = self._load_manifest()
+        self.index = DedupIndex(self.index_path)
+        self._recover()
+
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            # Manifest cũ không có vị trí đã đọc: các file thay đổi sẽ được đọc lại toàn bộ một lần
+            manifest['version'] = MANIFEST_VERSION
+            return manifest
+        return {'version': MANIFEST_VERSION, 'master': self.path, 'rows': 0, 'inputs': {}}
+
+    def _save_manifest(self):
+        """Ghi manifest ra file tạm rồi đổi tên (không bao giờ để lại manifest dở dang)"""
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.manifest_path)
+
+    def _master_extent(self):
+        """Kích thước hiện tại của dataset chính: số byte (CSV) hoặc số dòng (Parquet)"""
+        if not os.path.exists(self.path):
+            return 0
+        return parquet_rows(self.path) if is_parquet(self.path) else os.path.getsize(self.path)
+
+    def _recover(self):
+        """Đưa phần dataset chính ghi sau lần lưu manifest cuối vào chỉ mục
+
+        Manifest lưu kích thước dataset chính lúc được ghi (master_size). Lớn
+        hơn nghĩa là lần gộp trước bị ngắt sau khi đã nối dữ liệu nhưng trước
+        khi lưu manifest: dòng ghi dở ở cuối CSV bị cắt bỏ, các dòng hoàn chỉnh
+        được giữ và hash của chúng được thêm vào chỉ mục. File đầu vào tương ứng
+        chưa được đánh dấu đã đọc nên sẽ được đọc lại, và chỉ mục bỏ các cặp
+        đã nối (không mất dòng, không nối trùng).
+        """
+        recorded = self.manifest.get('master_size')
+        if recorded is None or self._master_extent() <= recorded:
+            return
+        if is_parquet(self.path):
+            chunks = iter_dataset(self.path, FIELDNAMES, self.chunksize, skip_rows=recorded)
+        else:
+            end = complete_rows_end(self.path, recorded)
+            if end < os.path.getsize(self.path):
+                with open(self.path, 'r+b') as f:
+                    f.truncate(end)
+                    os.fsync(f.fileno())
+            chunks = self._csv_chunks(self.path, recorded, end)
+        rows = 0
+        for chunk in chunks:
+            rows += len(chunk)
+            for q, a in zip(chunk['input'], chunk['output']):
+                self.index.commit(pair_hash(q, a))
+        self.index.flush()
+        self.manifest['rows'] += rows
+        self.manifest['master_size'] = self._master_extent()
+        self._save_manifest()
+        if rows:
+            print(f"♻️ Lần gộp trước bị ngắt: giữ {rows} dòng đã nối vào {self.path} và cập nhật chỉ mục")
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path))
+
+    def is_state_file(self, path):
+        """True nếu path là chính dataset chính hoặc file trạng thái của nó"""
+        key = self._key(path)
+        return key in {self._key(p) for p in (self.path, self.path + '.tmp', self.manifest_path, self.index_path)}
+
+    def classify(self, path):
+        """Trạng thái của một file đầu vào: 'new', 'appended', 'changed', 'unchanged' hoặc 'copy'
+
+        Kích thước và mtime khớp manifest thì bỏ qua ngay mà không cần hash.
+        File chỉ được ghi thêm vào cuối ('appended': phần đã đọc không đổi)
+        chỉ tốn việc kiểm tra đoạn cuối phần đã đọc, không hash cả file.
+        Các file khác mới bị đọc để tính hash nội dung.
+        Trả về (trạng thái, bản ghi manifest mới).
+        """
+        stat = os.stat(path)
+        entry = self.manifest['inputs'].get(self._key(path))
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return 'unchanged', entry
+        record = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        if entry and self._is_append(path, entry, stat.st_size):
+            # Hash cả file không còn đúng và không được tính lại (chỉ dùng để nhận ra bản sao)
+            return 'appended', dict(entry, hash=None, **record)
+        digest = file_digest(path)
+        record['hash'] = digest
+        if entry and entry.get('hash') == digest:
+            return 'unchanged', dict(entry, **record)
+        if any(other.get('hash') == digest for other in self.manifest['inputs'].values()):
+            return 'copy', dict(record, rows=0, added=0)
+        return ('changed' if entry else 'new'), record
+
+    def _is_append(self, path, entry, size):
+        """True nếu phần đã đọc của file vẫn y nguyên (file chỉ được ghi thêm vào cuối)"""
+        try:
+            if is_parquet(path):
+                rows_read = entry.get('rows_read')
+                if not rows_read:
+                    return False
+                chunk = next(iter_dataset(path, FIELDNAMES, chunksize=1, skip_rows=rows_read - 1), None)
+                return (chunk is not None and len(chunk) > 0
+                        and pair_hash(chunk['input'].iloc[0], chunk['output'].iloc[0]) == entry.get('last_pair'))
+            offset = entry.get('offset')
+            return bool(offset) and size >= offset and tail_digest(path, offset) == entry.get('tail')
+        except (OSError, ValueError, KeyError, IndexError):
+            return False
+
+    def _read_new_rows(self, path, entry):
+        """Các DataFrame chứa phần chưa đọc của file (cả file nếu entry là None), kèm vị trí mới
+
+        Trả về (iterator các DataFrame, hàm trả về vị trí đọc mới để lưu vào manifest).
+        """
+        if is_parquet(path):
+            rows_read = entry.get('rows_read', 0) if entry else 0
+            state = {'rows_read': rows_read, 'last_pair': entry.get('last_pair') if entry else None}
+
+            def parquet_chunks():
+                for chunk in iter_dataset(path, FIELDNAMES, self.chunksize, skip_rows=rows_read):
+                    state['rows_read'] += len(chunk)
+                    if len(chunk):
+                        state['last_pair'] = pair_hash(chunk['input'].iloc[-1], chunk['output'].iloc[-1])
+                    yield chunk
+            return parquet_chunks(), lambda: dict(state)
+
+        with open(path, 'rb') as f:
+            header_line = f.readline()
+        start = entry['offset'] if entry else len(header_line)
+        end = complete_rows_end(path, start)
+        return self._csv_chunks(path, start, end), lambda: {'offset': end, 'tail': tail_digest(path, end)}
+
+    def _csv_chunks(self, path, start, end):
+        """Các DataFrame (cột dạng chuỗi) của đoạn byte [start, end) trong file CSV, theo header của file"""
+        with open(path, 'rb') as f:
+            header = next(csv.reader([f.readline().decode('utf-8-sig')]))
+        if end <= start:
+            return
+        with open(path, 'rb') as f:
+            reader = io.BufferedReader(_ByteRange(f, start, end))
+            yield from pd.read_csv(reader, header=None, names=header, dtype=str, keep_default_na=False,
+                                   usecols=lambda column: column in FIELDNAMES, chunksize=self.chunksize)
+
+    def _append(self, path, entry=None):
+        """Đọc phần mới của một file, nối các cặp chưa có vào dataset chính
+
+        Trả về (số dòng đã đọc, số dòng mới, vị trí đọc mới).
+        """
+        rows = added = 0
+        pending = []
+        chunks, position = self._read_new_rows(path, entry)
+        for chunk in chunks:
+            chunk = chunk.reindex(columns=FIELDNAMES)
+            chunk['topic'] = chunk['topic'].astype(object).fillna('')
+            chunk = chunk[chunk['input'].notna() & chunk['output'].notna()
+                          & (chunk['input'] != '') & (chunk['output'] != '')]
+            mask = [self.index.add(pair_hash(q, a)) for q, a in zip(chunk['input'], chunk['output'])]
+            new_rows = chunk[mask]
+            rows += len(chunk)
+            added += len(new_rows)
+            if new_rows.empty:
+                continue
+            if is_parquet(self.path):
+                # Gom đủ một row group rồi mới ghi thành segment
+                pending.append(new_rows)
+                if sum(len(frame) for frame in pending) >= self.chunksize:
+                    append_parquet(self.path, pd.concat(pending, ignore_index=True))
+                    pending = []
+            else:
+                new_rows.to_csv(self.path, mode='a', index=False, header=not os.path.exists(self.path))
+        if pending:
+            append_parquet(self.path, pd.concat(pending, ignore_index=True))
+        return rows, added, position()
+
+    def update(self, files, on_file=None):
+        """Gộp các file mới/được ghi thêm/đã thay đổi vào dataset chính
+
+        Chi phí tỉ lệ với dữ liệu mới: file không đổi chỉ tốn một lần stat,
+        file chỉ được ghi thêm (vd. file round đang chạy) chỉ được đọc từ vị
+        trí đã đọc lần trước; file bị ghi lại được đọc lại toàn bộ nhưng chỉ
+        các cặp chưa có trong chỉ mục mới được nối thêm. Dataset chính dạng
+        Parquet được nối thêm bằng segment (append_parquet), không chép lại.
+        on_file(path, status, rows, added, error): callback cho từng file.
+        Trả về dict thống kê.
+        """
+        stats = {'new': 0, 'appended': 0, 'changed': 0, 'unchanged': 0, 'copy': 0, 'failed': 0,
+                 'rows': 0, 'added': 0}
+        for path in files:
+            if self.is_state_file(path):
+                continue
+            try:
+                status, record = self.classify(path)
+                rows = added = 0
+                if status in ('new', 'appended', 'changed'):
+                    previous = self.manifest['inputs'].get(self._key(path)) if status == 'appended' else None
+                    rows, added, position = self._append(path, previous)
+                    record.update(position, rows=rows + (previous or {}).get('rows', 0),
+                                  added=added + (previous or {}).get('added', 0),
+                                  merged_at=datetime.now().isoformat(timespec='seconds'))
+                    # Thứ tự ghi: dữ liệu → chỉ mục → manifest (kèm kích thước dataset
+                    # chính). Bị ngắt trước khi lưu manifest thì _recover ở lần mở sau
+                    # đưa phần đã nối vào chỉ mục, file này được đọc lại và bỏ cặp trùng
+                    if not is_parquet(self.path):
+                        self._sync_master()
+                    self.index.flush()
+            except Exception as e:
+                stats['failed'] += 1
+                if on_file:
+                    on_file(path, 'failed', 0, 0, e)
+                continue
+            stats[status] += 1
+            stats['rows'] += rows
+            stats['added'] += added
+            self.manifest['inputs'][self._key(path)] = record
+            self.manifest['rows'] += added
+            self.manifest['master_size'] = self._master_extent()
+            self._save_manifest()
+            if on_file:
+                on_file(path, status, rows, added, None)
+        return stats
+
+    def _sync_master(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'rb+') as f:
+                os.fsync(f.fileno())
+
+    def close(self):
+        self.index.close()
+
+    def describe(self):
+        """Mô tả ngắn để in ra màn hình"""
+        return (f"{self.manifest['rows']} dòng | {len(self.manifest['inputs'])} file đã gộp | "
+                f"{len(self.index)} cặp trong chỉ mục")
+
+
+def main():
+    """Cập nhật dataset chính từ các file dataset trong thư mục"""
+    parser = argparse.ArgumentParser(description="Gộp tăng dần các file dataset vào dataset chính")
+    parser.add_argument('files', nargs='*', help='File cần gộp (mặc định: mọi CSV/Parquet trong thư mục)')
+    parser.add_argument('-o', '--master', default=None, help='Dataset chính (mặc định MASTER_DATASET)')
+    args = parser.parse_args()
+
+    try:
+        master = MasterDataset(args.master)
+    except (ImportError, OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    files = args.files or find_dataset_files(exclude_outputs=True)
+
+    def report(path, status, rows, added, error):
+        if error:
+            print(f"   ❌ {path}: {error}")
+        elif status in ('new', 'appended', 'changed'):
+            print(f"   ✅ {path}: {rows} dòng, thêm {added} dòng mới")
+
+    stats = master.update(files, on_file=report)
+    master.close()
+    print(f"📊 Mới: {stats['new']} | Ghi thêm: {stats['appended']} | Thay đổi: {stats['changed']} | "
+          f"Không đổi: {stats['unchanged']} | "
+          f"Bản sao: {stats['copy']} | Lỗi: {stats['failed']}")
+    print(f"➕ Thêm {stats['added']} / {stats['rows']} dòng đã đọc")
+    print(f"📁 {master.path}: {master.describe()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""
+Metrics - Đo từng request sinh Q&A và xuất số liệu
+Mỗi request (và mỗi lần ghi dữ liệu xuống đĩa) là một sự kiện JSON-lines;
+bộ đếm và histogram được ghi định kỳ ra file văn bản định dạng Prometheus
+(dùng được với textfile collector của node_exporter)
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+from dotenv import load_dotenv
+from rate_limiter import estimate_tokens
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+DEFAULT_METRICS_DIR = 'metrics'
+# Ghi lại file .prom và đẩy file sự kiện xuống đĩa ít nhất mỗi N giây
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '10'))
+
+# Ranh giới bucket của các histogram (giây / token)
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+TOKEN_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384)
+WRITE_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+
+class Histogram:
+    """Histogram tích lũy kiểu Prometheus (bucket le, _sum, _count)"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Ước lượng phân vị q bằng cận trên của bucket chứa nó"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield f"{name}_bucket{_labels(labels, le=bound)} {cumulative}"
+        yield f"{name}_sum{_labels(labels)} {self.sum:.6f}"
+        yield f"{name}_count{_labels(labels)} {self.count}"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    """Chuỗi nhãn Prometheus {a="1",b="2"} (rỗng nếu không có nhãn)"""
+    items = {**labels, **extra}
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in sorted(items.items())) + '}'
+
+
+# (tên, mô tả) theo thứ tự xuất ra file .prom
+COUNTERS = (
+    ('qa_requests_total', 'Request gửi tới model (status=ok|error, cached=true|false)'),
+    ('qa_prompt_tokens_total', 'Token đầu vào (usage_metadata, hoặc ước lượng nếu backend không trả về)'),
+    ('qa_completion_tokens_total', 'Token đầu ra (usage_metadata, hoặc ước lượng nếu backend không trả về)'),
+    ('qa_pairs_requested_total', 'Số cặp Q&A yêu cầu trong các request'),
+    ('qa_pairs_parsed_total', 'Số cặp Q&A parse được từ response'),
+    ('qa_pairs_accepted_total', 'Số cặp Q&A được giữ lại (sau chống trùng, đúng chủ đề)'),
+    ('qa_parse_failures_total', 'Khối response không parse được thành cặp INPUT/OUTPUT'),
+    ('qa_retries_total', 'Lần thử lại sau lỗi tạm thời'),
+    ('qa_top_ups_total', 'Request bổ sung khi model trả thiếu cặp'),
+    ('qa_rows_written_total', 'Số dòng ghi xuống file dataset'),
+)
+HISTOGRAMS = (
+    ('qa_request_latency_seconds', LATENCY_BUCKETS, 'Thời gian một request, từ lúc gửi đến hết response'),
+    ('qa_first_chunk_seconds', LATENCY_BUCKETS, 'Thời gian chờ đoạn đầu tiên của response stream'),
+    ('qa_completion_tokens', TOKEN_BUCKETS, 'Token đầu ra của mỗi request'),
+    ('qa_write_latency_seconds', WRITE_BUCKETS, 'Thời gian một lần flush (và fsync) dữ liệu xuống file'),
+)
+
+
+class RequestMeasurement:
+    """Số đo của một request: dùng trong khối with, sự kiện được ghi khi thoát khối
+
+    Lỗi trong khối được ghi vào sự kiện (status=error) rồi ném tiếp.
+    recorder=None: chỉ đo, không ghi gì (khi metrics bị tắt).
+    """
+
+    def __init__(self, recorder, topic_counts, prompt, mode):
+        self.recorder = recorder
+        self.topic_counts = topic_counts
+        self.prompt = prompt
+        self.mode = mode
+        self.cached = False
+        self.usage = None
+        self.text_length = 0
+        self.first_chunk = None
+        self.parsed = 0
+        self.accepted = 0
+        self.parse_failures = 0
+        self.start = time.perf_counter()
+
+    def set_usage(self, usage_metadata):
+        """Nhận usage_metadata của response (prompt_token_count, candidates_token_count)"""
+        self.usage = usage_metadata
+
+    def on_chunk(self, text):
+        if self.first_chunk is None:
+            self.first_chunk = time.perf_counter() - self.start
+        self.text_length += len(text)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.recorder is not None:
+            self.recorder.record_request(self, exc)
+        return False
+
+    def tokens(self):
+        """(token đầu vào, token đầu ra, nguồn): 'usage', 'estimate' hoặc 'cache'"""
+        if self.cached:
+            return 0, 0, 'cache'
+        prompt_tokens = getattr(self.usage, 'prompt_token_count', None)
+        completion_tokens = getattr(self.usage, 'candidates_token_count', None)
+        if prompt_tokens is not None and completion_tokens is not None:
+            return prompt_tokens, completion_tokens, 'usage'
+        return estimate_tokens(self.prompt), self.text_length // 3, 'estimate'
+
+
+class MetricsRecorder:
+    """Ghi sự kiện JSON-lines và xuất bộ đếm / histogram định dạng Prometheus
+
+    Sự kiện được nối vào <dir>/<name>_events.jsonl; file <dir>/<name>.prom
+    được ghi đè nguyên tử mỗi METRICS_FLUSH_SECONDS giây và khi close().
+    labels: nhãn gắn cho mọi series (vd. backend, model, worker).
+    """
+
+    def __init__(self, directory=DEFAULT_METRICS_DIR, name='qa_generator', labels=None,
+                 flush_seconds=None):
+        self.directory = directory
+        self.name = name
+        self.labels = {key: str(value) for key, value in (labels or {}).items()}
+        self.flush_seconds = flush_seconds or METRICS_FLUSH_SECONDS
+        self.events_path = os.path.join(directory, f"{name}_events.jsonl")
+        self.prom_path = os.path.join(directory, f"{name}.prom")
+        self.session = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.counters = {}  # (tên, nhãn dạng tuple) -> giá trị
+        self.histograms = {name: Histogram(buckets) for name, buckets, _ in HISTOGRAMS}
+        self._last_flush = time.monotonic()
+
+        os.makedirs(directory, exist_ok=True)
+        self._events = open(self.events_path, 'a', encoding='utf-8')
+
+    @classmethod
+    def from_env(cls, name='qa_generator', labels=None):
+        """Tạo recorder theo .env; trả về None nếu METRICS=0"""
+        if os.getenv('METRICS', '1').lower() in ('0', 'false', 'off', 'no'):
+            return None
+        return cls(os.getenv('METRICS_DIR', DEFAULT_METRICS_DIR), name, labels)
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def event(self, event_type, **fields):
+        """Ghi một sự kiện JSON-lines (kèm thời điểm, phiên và nhãn chung)"""
+        record = {'ts': round(time.time(), 3), 'event': event_type, 'session': self.session, **self.labels, **fields}
+        self._events.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._maybe_flush()
+
+    def measure(self, topic_counts, prompt, mode):
+        """Bắt đầu đo một request (dùng với with)"""
+        return RequestMeasurement(self, topic_counts, prompt, mode)
+
+    def record_request(self, m, error=None):
+        latency = time.perf_counter() - m.start
+        prompt_tokens, completion_tokens, token_source = m.tokens()
+        requested = sum(m.topic_counts.values())
+        status = 'error' if error else 'ok'
+
+        self.increment('qa_requests_total', status=status, cached=str(m.cached).lower())
+        self.increment('qa_prompt_tokens_total', prompt_tokens)
+        self.increment('qa_completion_tokens_total', completion_tokens)
+        self.increment('qa_pairs_requested_total', requested)
+        self.increment('qa_pairs_parsed_total', m.parsed)
+        self.increment('qa_pairs_accepted_total', m.accepted)
+        self.increment('qa_parse_failures_total', m.parse_failures)
+        if not m.cached:
+            self.histograms['qa_request_latency_seconds'].observe(latency)
+            self.histograms['qa_completion_tokens'].observe(completion_tokens)
+            if m.first_chunk is not None:
+                self.histograms['qa_first_chunk_seconds'].observe(m.first_chunk)
+
+        self.event('request', mode=m.mode, topics=list(m.topic_counts), status=status,
+                   error=str(error)[:200] if error else None, cached=m.cached,
+                   latency_s=round(latency, 4),
+                   first_chunk_s=round(m.first_chunk, 4) if m.first_chunk is not None else None,
+                   prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, token_source=token_source,
+                   pairs_requested=requested, pairs_parsed=m.parsed, pairs_accepted=m.accepted,
+                   parse_failures=m.parse_failures)
+
+    def record_retry(self, topic_counts, error, delay):
+        self.increment('qa_retries_total')
+        self.event('retry', topics=list(topic_counts), error=str(error)[:200], delay_s=round(delay, 3))
+
+    def record_top_up(self, topic_counts):
+        self.increment('qa_top_ups_total')
+        self.event('top_up', topics=list(topic_counts), pairs_missing=sum(topic_counts.values()))
+
+    def record_write(self, rows, seconds, path=None):
+        """Một lần flush của DatasetWriter: số dòng và thời gian (gồm cả fsync)"""
+        self.increment('qa_rows_written_total', rows)
+        self.histograms['qa_write_latency_seconds'].observe(seconds)
+        self.event('write', rows=rows, latency_s=round(seconds, 5), path=path)
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """Đẩy file sự kiện xuống đĩa và ghi lại file .prom (ghi file tạm rồi đổi tên)"""
+        self._last_flush = time.monotonic()
+        if self._events.closed:
+            return
+        self._events.flush()
+        with open(self.prom_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(self.prometheus_lines()) + '\n')
+        os.replace(self.prom_path + '.tmp', self.prom_path)
+
+    def prometheus_lines(self):
+        for name, help_text in COUNTERS:
+            yield f"# HELP {name} {help_text}"
+            yield f"# TYPE {name} counter"
+            series = [(labels, value) for (key, labels), value in self.counters.items() if key == name]
+            for labels, value in series or [((), 0)]:
+                yield f"{name}{_labels(self.labels, **dict(labels))} {value:g}"
+        for name, _, help_text in HISTOGRAMS:
+            yield f"# HELP {name} {help_text}"
+            yield f"# TYPE {name} histogram"
+            yield from self.histograms[name].lines(name, self.labels)
+
+    def describe(self):
+        """Tóm tắt một dòng: số request, độ trễ p50/p95, token, tỉ lệ parse"""
+        requests = sum(value for (name, _), value in self.counters.items() if name == 'qa_requests_total')
+        latency = self.histograms['qa_request_latency_seconds']
+        parsed = self.counters.get(('qa_pairs_parsed_total', ()), 0)
+        requested = self.counters.get(('qa_pairs_requested_total', ()), 0)
+        write = self.histograms['qa_write_latency_seconds']
+        return (f"{requests} request | độ trễ p50 ≤{latency.quantile(0.5):g}s, p95 ≤{latency.quantile(0.95):g}s | "
+                f"{self.counters.get(('qa_completion_tokens_total', ()), 0):.0f} token đầu ra | "
+                f"parse {parsed}/{requested} cặp | ghi đĩa {write.sum:.2f}s / {write.count} lần | {self.prom_path}")
+
+    def close(self):
+        if self._events.closed:
+            return
+        self.flush()
+        self._events.close()
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize_events(path):
+    """Tổng hợp file sự kiện: độ trễ, token/giây, tỉ lệ parse, thời gian ghi đĩa theo phiên"""
+    sessions = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Dòng cuối có thể bị ghi dở khi tiến trình bị kill
+            summary = sessions.setdefault(record.get('session'), {
+                'first': record['ts'], 'last': record['ts'], 'latencies': [], 'first_chunks': [],
+                'requests': 0, 'errors': 0, 'cached': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                'pairs_requested': 0, 'pairs_parsed': 0, 'pairs_accepted': 0, 'parse_failures': 0,
+                'retries': 0, 'top_ups': 0, 'rows_written': 0, 'write_seconds': 0.0, 'writes': 0})
+            summary['last'] = record['ts']
+            event = record.get('event')
+            if event == 'request':
+                summary['requests'] += 1
+                summary['errors'] += record['status'] == 'error'
+                summary['cached'] += bool(record.get('cached'))
+                if not record.get('cached'):
+                    summary['latencies'].append(record['latency_s'])
+                    if record.get('first_chunk_s') is not None:
+                        summary['first_chunks'].append(record['first_chunk_s'])
+                for field in ('prompt_tokens', 'completion_tokens', 'pairs_requested', 'pairs_parsed',
+                              'pairs_accepted', 'parse_failures'):
+                    summary[field] += record.get(field) or 0
+            elif event == 'retry':
+                summary['retries'] += 1
+            elif event == 'top_up':
+                summary['top_ups'] += 1
+            elif event == 'write':
+                summary['writes'] += 1
+                summary['rows_written'] += record['rows']
+                summary['write_seconds'] += record['latency_s']
+    return sessions
+
+
+def main():
+    """In tóm tắt file sự kiện metrics"""
+    parser = argparse.ArgumentParser(description="Tóm tắt file sự kiện metrics (JSON-lines)")
+    parser.add_argument('events', nargs='?', default=os.path.join(
+        os.getenv('METRICS_DIR', DEFAULT_METRICS_DIR), 'qa_generator_events.jsonl'), help='File *_events.jsonl')
+    parser.add_argument('--session', help='Chỉ in phiên này (mặc định: tất cả)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.events):
+        print(f"❌ Không tìm thấy file sự kiện: {args.events}")
+        sys.exit(1)
+    for session, s in summarize_events(args.events).items():
+        if args.session and session != args.session:
+            continue
+        wall = max(s['last'] - s['first'], 1e-9)
+        request_seconds = sum(s['latencies'])
+        print(f"\n📊 Phiên {session}: {s['requests']} request trong {wall / 60:.1f} phút "
+              f"({s['errors']} lỗi, {s['cached']} từ cache, {s['retries']} retry, {s['top_ups']} top-up)")
+        print(f"   ⏱️ Độ trễ request: p50 {_percentile(s['latencies'], 0.5):.2f}s | "
+              f"p95 {_percentile(s['latencies'], 0.95):.2f}s | max {max(s['latencies'], default=0):.2f}s")
+        if s['first_chunks']:
+            print(f"   📡 Đoạn stream đầu tiên: p50 {_percentile(s['first_chunks'], 0.5):.2f}s | "
+                  f"p95 {_percentile(s['first_chunks'], 0.95):.2f}s")
+        print(f"   🔤 Token: {s['prompt_tokens']} vào | {s['completion_tokens']} ra | "
+              f"{s['completion_tokens'] / wall:.0f} token ra/giây")
+        parsed_rate = s['pairs_parsed'] / s['pairs_requested'] if s['pairs_requested'] else 0
+        print(f"   🧩 Cặp: yêu cầu {s['pairs_requested']} | parse {s['pairs_parsed']} ({parsed_rate:.0%}) | "
+              f"giữ lại {s['pairs_accepted']} | {s['parse_failures']} khối lỗi định dạng")
+        print(f"   💾 Ghi đĩa: {s['rows_written']} dòng, {s['writes']} lần flush, {s['write_seconds']:.2f}s")
+        # Tổng thời gian chờ model / thời gian thực ≈ số request chạy song song trung bình
+        print(f"   🔍 Chờ model {request_seconds:.0f}s (≈{request_seconds / wall:.1f} request song song) | "
+              f"ghi đĩa chiếm {s['write_seconds'] / wall:.1%} thời gian thực")
+
+
+if __name__ == "__main__":
+    main()
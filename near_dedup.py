@@ -0,0 +1,234 @@
+"""
+Near Dedup - Phát hiện câu gần trùng lặp bằng MinHash + LSH (vector hóa với NumPy)
+Gom các câu gần giống nhau ("Tôi quên uống thuốc rồi" / "Tôi lại quên uống thuốc rồi")
+thành cụm và chỉ giữ lại một đại diện
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from dedup_index import normalize_text
+from dataset_io import ParquetDatasetWriter, is_parquet, iter_dataset, replace_dataset
+
+# Hằng số cho rolling hash của shingle ký tự
+_SHINGLE_BASE = np.uint64(1_000_003)
+_SHINGLE_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+# Số shingle xử lý cùng lúc khi tính MinHash (giới hạn bộ nhớ tạm)
+SHINGLE_BLOCK = 20_000
+
+
+class NearDuplicateDetector:
+    def __init__(self, num_perm=128, bands=32, shingle_size=3, threshold=0.7, field='input', seed=1):
+        """Khởi tạo bộ phát hiện gần trùng lặp
+
+        num_perm: số hàm băm MinHash (độ dài chữ ký)
+        bands: số band LSH (num_perm phải chia hết cho bands)
+        shingle_size: độ dài shingle ký tự
+        threshold: ngưỡng Jaccard ước lượng để coi là gần trùng lặp
+        field: 'input' (so câu hỏi) hoặc 'pair' (so cả câu hỏi và câu trả lời)
+        """
+        if num_perm % bands:
+            raise ValueError("❌ num_perm phải chia hết cho bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        self.field = field
+
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hashing: (a * x + b) >> 32 với a lẻ
+        self._perm_a = rng.integers(1, 2 ** 63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self._perm_b = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+        self._band_coeffs = rng.integers(1, 2 ** 63, self.rows_per_band, dtype=np.uint64) | np.uint64(1)
+
+    def _texts(self, frame):
+        """Lấy văn bản dùng để so sánh từ một DataFrame"""
+        if self.field == 'pair':
+            return (frame['input'].fillna('').astype(str) + ' ' + frame['output'].fillna('').astype(str)).tolist()
+        return frame[self.field].fillna('').astype(str).tolist()
+
+    def _shingle_hashes(self, texts):
+        """Tính hash 32-bit của mọi shingle, trả về (hashes, offsets đầu mỗi văn bản)"""
+        k = self.shingle_size
+        normalized = [normalize_text(text).ljust(k) for text in texts]
+        lengths = np.fromiter((len(text) for text in normalized), dtype=np.int64, count=len(normalized))
+        codes = np.frombuffer(''.join(normalized).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+
+        # Rolling hash cho mọi vị trí, rồi bỏ các shingle vượt qua ranh giới văn bản
+        span = len(codes) - k + 1
+        rolling = np.zeros(span, dtype=np.uint64)
+        for j in range(k):
+            rolling = rolling * _SHINGLE_BASE + codes[j:j + span]
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        counts = lengths - k + 1
+        positions = np.repeat(starts, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+        hashes = (rolling[positions] * _SHINGLE_MIX) >> np.uint64(32)
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        return hashes, offsets
+
+    def signatures(self, texts):
+        """Chữ ký MinHash (len(texts), num_perm) kiểu uint32"""
+        if not texts:
+            return np.empty((0, self.num_perm), dtype=np.uint32)
+        hashes, offsets = self._shingle_hashes(texts)
+        result = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+
+        # Xử lý theo khối văn bản để ma trận (shingle x num_perm) không quá lớn
+        doc = 0
+        while doc < len(texts):
+            end_doc = doc + 1
+            while end_doc < len(texts) and offsets[end_doc] - offsets[doc] < SHINGLE_BLOCK:
+                end_doc += 1
+            lo = offsets[doc]
+            hi = offsets[end_doc] if end_doc < len(texts) else len(hashes)
+            block = hashes[lo:hi, None] * self._perm_a[None, :] + self._perm_b[None, :]
+            block >>= np.uint64(32)
+            result[doc:end_doc] = np.minimum.reduceat(block, offsets[doc:end_doc] - lo, axis=0)
+            doc = end_doc
+        return result
+
+    def band_keys(self, signatures):
+        """Khóa LSH 64-bit cho từng band: mảng (số dòng, bands)"""
+        banded = signatures.astype(np.uint64).reshape(len(signatures), self.bands, self.rows_per_band)
+        return (banded * self._band_coeffs).sum(axis=2, dtype=np.uint64)
+
+    def _cluster(self, band_files, signatures, total_rows):
+        """Gom cụm bằng union-find vector hóa, trả về nhãn (= dòng đại diện) cho mỗi dòng"""
+        parent = np.arange(total_rows, dtype=np.int64)
+
+        def find(nodes):
+            roots = parent[nodes]
+            while True:
+                next_roots = parent[roots]
+                if np.array_equal(next_roots, roots):
+                    return roots
+                roots = next_roots
+
+        for band_file in band_files:
+            keys = np.fromfile(band_file, dtype=np.uint64)
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            del keys
+            boundaries = np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))
+            run_first = order[np.flatnonzero(boundaries)][np.cumsum(boundaries) - 1]
+            members = ~boundaries
+            first, other = run_first[members], order[members]
+            del order, sorted_keys, boundaries, run_first
+            if not len(first):
+                continue
+
+            # Kiểm tra lại ứng viên bằng Jaccard ước lượng từ chữ ký
+            keep = np.empty(len(first), dtype=bool)
+            for lo in range(0, len(first), 50_000):
+                hi = lo + 50_000
+                keep[lo:hi] = (signatures[first[lo:hi]] == signatures[other[lo:hi]]).mean(axis=1) >= self.threshold
+            first, other = first[keep], other[keep]
+
+            # Nối các cây cho đến khi mọi cạnh nằm trong cùng một cụm
+            while len(first):
+                root_a, root_b = find(first), find(other)
+                crossing = root_a != root_b
+                if not crossing.any():
+                    break
+                root_a, root_b = root_a[crossing], root_b[crossing]
+                np.minimum.at(parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+                first, other = first[crossing], other[crossing]
+
+        return find(np.arange(total_rows, dtype=np.int64))
+
+    def dedupe_csv(self, input_path, output_path=None, chunksize=50_000):
+        """Loại gần trùng lặp trong một file CSV (hoặc Parquet), stream theo chunk
+
+        Chữ ký MinHash và khóa LSH được ghi ra file tạm (memmap) nên bộ nhớ
+        chỉ phụ thuộc kích thước chunk và một mảng nhãn 8 byte/dòng.
+        Ô được đọc dạng chuỗi nên dòng được giữ ghi ra y nguyên (vd. "1.50").
+        Giữ dòng xuất hiện đầu tiên của mỗi cụm. Trả về dict thống kê.
+        """
+        output_path = output_path or input_path
+        workdir = tempfile.mkdtemp(prefix='near_dedup_')
+        try:
+            signature_path = os.path.join(workdir, 'signatures.u32')
+            band_files = [os.path.join(workdir, f'band_{band}.u64') for band in range(self.bands)]
+            total_rows = 0
+
+            # Lượt 1: tính chữ ký và khóa LSH cho từng chunk
+            with open(signature_path, 'wb') as signature_file:
+                band_handles = [open(path, 'wb') for path in band_files]
+                try:
+                    for chunk in iter_dataset(input_path, chunksize=chunksize, as_text=True):
+                        chunk_signatures = self.signatures(self._texts(chunk))
+                        signature_file.write(chunk_signatures.tobytes())
+                        keys = self.band_keys(chunk_signatures)
+                        for band, handle in enumerate(band_handles):
+                            handle.write(np.ascontiguousarray(keys[:, band]).tobytes())
+                        total_rows += len(chunk)
+                finally:
+                    for handle in band_handles:
+                        handle.close()
+
+            if total_rows == 0:
+                return {'rows': 0, 'kept': 0, 'removed': 0, 'clusters': 0}
+
+            signatures = np.memmap(signature_path, dtype=np.uint32, mode='r', shape=(total_rows, self.num_perm))
+            labels = self._cluster(band_files, signatures, total_rows)
+            del signatures
+            keep = labels == np.arange(total_rows)
+            cluster_sizes = np.bincount(labels, minlength=total_rows)
+
+            # Lượt 2: ghi lại các dòng đại diện (cùng định dạng với output_path)
+            temp_output = os.path.join(workdir, 'output' + os.path.splitext(output_path)[1])
+            parquet_writer = ParquetDatasetWriter(temp_output) if is_parquet(output_path) else None
+            row_offset = 0
+            header = True
+            for chunk in iter_dataset(input_path, chunksize=chunksize, as_text=True):
+                mask = keep[row_offset:row_offset + len(chunk)]
+                if parquet_writer:
+                    parquet_writer.write_frame(chunk[mask])
+                else:
+                    chunk[mask].to_csv(temp_output, mode='a', header=header, index=False)
+                header = False
+                row_offset += len(chunk)
+            if parquet_writer:
+                parquet_writer.close()
+            replace_dataset(temp_output, output_path)
+
+            kept = int(keep.sum())
+            return {
+                'rows': total_rows,
+                'kept': kept,
+                'removed': total_rows - kept,
+                'clusters': int((cluster_sizes > 1).sum()),
+            }
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    """Chạy loại gần trùng lặp độc lập trên một file CSV"""
+    parser = argparse.ArgumentParser(description="Loại câu gần trùng lặp bằng MinHash/LSH")
+    parser.add_argument('input', help='File CSV/Parquet đầu vào (cột input, output)')
+    parser.add_argument('-o', '--output', help='File đầu ra (mặc định ghi đè file đầu vào)')
+    parser.add_argument('--threshold', type=float, default=0.7, help='Ngưỡng Jaccard (mặc định 0.7)')
+    parser.add_argument('--field', choices=['input', 'pair'], default='input',
+                        help="So sánh theo câu hỏi ('input') hay cả cặp ('pair')")
+    parser.add_argument('--chunksize', type=int, default=50_000, help='Số dòng mỗi chunk')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"❌ Không tìm thấy file: {args.input}")
+        sys.exit(1)
+
+    detector = NearDuplicateDetector(threshold=args.threshold, field=args.field)
+    print(f"🔍 Đang tìm câu gần trùng lặp trong {args.input}...")
+    stats = detector.dedupe_csv(args.input, args.output, args.chunksize)
+    print(f"📊 Tổng: {stats['rows']} dòng | Cụm gần trùng: {stats['clusters']}")
+    print(f"✅ Giữ lại {stats['kept']} dòng, loại {stats['removed']} dòng")
+    print(f"📁 Đã lưu: {os.path.abspath(args.output or args.input)}")
+
+
+if __name__ == "__main__":
+    main()
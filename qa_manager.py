@@ -8,20 +8,34 @@ import os
 import sys
 import argparse
 import glob
+import fnmatch
 import pandas as pd
 from datetime import datetime
 from pathlib import Path
 
 # Import local modules
-from generator_google import QAGenerator
+from generator_google import QAGenerator, TOPICS
 from marathon_generator import MarathonGenerator
+from marathon_journal import resolve_session
+from worker_pool import WorkerPool, api_keys, backend_specs
 from check_google_api import check_google_api
+from near_dedup import NearDuplicateDetector
+from dataset_io import FIELDNAMES, dataset_extension, find_dataset_files, iter_dataset, remove_dataset
+from dataset_catalog import DatasetCatalog, describe_entry
+from dataset_export import EXPORT_COMPRESSION, export_dataset
+from dataset_split import SPLIT_NAMES, SPLIT_OUTPUT_DIR, split_dataset
+from dataset_stats import format_comparison
+from master_dataset import DEFAULT_MASTER_PATH, MasterDataset
+from search_index import SearchIndex
+from stream_merge import merge_datasets
 
 class QAManager:
     def __init__(self):
         """Initialize QA Dataset Manager"""
         self.generator = None
         self.version = "1.0.0"
+        # Row counts and stats come from cached sidecars; new files are counted in the background
+        self.catalog = DatasetCatalog()
         
     def show_banner(self):
         """Display cool banner"""
@@ -130,14 +144,32 @@ class QAManager:
         except Exception as e:
             print(f"❌ Error: {e}")
 
-    def marathon_mode(self):
-        """Start marathon generation"""
+    def marathon_mode(self, resume=None):
+        """Start marathon generation, or resume a checkpointed session"""
         print("\n🏃‍♂️ MARATHON MODE")
         print("-" * 30)
         print("This will generate data continuously until you stop it.")
         print("Press Ctrl+C to stop safely.")
         
-        if input("\nStart marathon? (y/n): ").lower() != 'y':
+        if resume is None:
+            try:
+                latest = resolve_session('latest')
+            except ValueError:
+                latest = None
+            if latest and input(f"\nResume the last session ({latest})? (y/n): ").lower() == 'y':
+                resume = latest
+            elif input("\nStart marathon? (y/n): ").lower() != 'y':
+                return
+        if resume:
+            try:
+                MarathonGenerator(resume=resume).run_marathon()
+            except Exception as e:
+                print(f"❌ Error: {e}")
+            return
+        
+        keys = api_keys()
+        if len(keys) > 1 and input(f"Use a worker pool with {len(keys)} API keys (one process per key)? (y/n): ").lower() == 'y':
+            self.pool_mode()
             return
         
         try:
@@ -146,79 +178,117 @@ class QAManager:
         except Exception as e:
             print(f"❌ Error: {e}")
 
+    def pool_mode(self, stub=False, workers=None, rounds=0):
+        """Run the coordinator/worker pool: one worker process per API key"""
+        print("\n🏭 WORKER POOL MODE")
+        print("-" * 30)
+        try:
+            pool = WorkerPool(backend_specs(stub, workers))
+            pool.run(rounds)
+            pool.save_final_results()
+        except Exception as e:
+            print(f"❌ Error: {e}")
+
     def merge_csv_files(self):
         """Merge multiple CSV files"""
         print("\n📊 MERGE CSV FILES")
         print("-" * 30)
         
-        # Find CSV files
-        csv_files = glob.glob("*.csv") + glob.glob("**/*.csv", recursive=True)
+        # Find CSV and Parquet files (each once), skipping earlier merge outputs
+        entries = self.catalog.entries(exclude_outputs=True, exclude=(DEFAULT_MASTER_PATH,))
+        csv_files = [entry['path'] for entry in entries]
         if not csv_files:
             print("❌ No CSV files found in current directory")
             return
         
-        print("📁 Found CSV files:")
-        for i, file in enumerate(csv_files, 1):
-            size = os.path.getsize(file) / 1024  # KB
-            print(f"{i:2}. {file} ({size:.1f} KB)")
+        print("📁 Found dataset files:")
+        for i, entry in enumerate(entries, 1):
+            print(f"{i:2}. {entry['path']} ({describe_entry(entry)})")
         
         print("\nOptions:")
         print("1. Merge ALL files")
         print("2. Select specific files")
         print("3. Merge files by pattern")
+        print(f"4. Update master dataset ({DEFAULT_MASTER_PATH}) with new files only")
         
-        choice = input("Choose option (1-3): ")
+        choice = input("Choose option (1-4): ")
+        if choice == "4":
+            self.update_master_dataset(csv_files)
+            return
+        near_dedup = input("Also remove near-duplicate questions (MinHash/LSH)? (y/n): ").lower() == 'y'
         
         try:
             if choice == "1":
-                self._merge_files(csv_files)
+                self._merge_files(csv_files, near_dedup)
             elif choice == "2":
                 indices = input("Enter file numbers (comma-separated): ").split(',')
                 selected_files = [csv_files[int(i.strip())-1] for i in indices if i.strip().isdigit()]
-                self._merge_files(selected_files)
+                self._merge_files(selected_files, near_dedup)
             elif choice == "3":
                 pattern = input("Enter pattern (e.g., marathon_*, topic_*): ")
                 pattern_files = glob.glob(pattern)
                 if pattern_files:
-                    self._merge_files(pattern_files)
+                    self._merge_files(pattern_files, near_dedup)
                 else:
                     print("❌ No files match the pattern")
         except Exception as e:
             print(f"❌ Error merging files: {e}")
 
-    def _merge_files(self, files):
-        """Helper method to merge CSV files"""
+    def update_master_dataset(self, files=None):
+        """Incrementally append new rows from new or changed files to the master dataset"""
+        print(f"\n🔄 Updating master dataset: {DEFAULT_MASTER_PATH}")
+        if files is None:
+            files = find_dataset_files(exclude_outputs=True, exclude=(DEFAULT_MASTER_PATH,))
+
+        def report(file, status, rows, added, error):
+            if error:
+                print(f"   ❌ {file}: Error reading file")
+            elif status in ('new', 'appended', 'changed'):
+                print(f"   ✅ {file} ({status}): {rows} rows, {added} new")
+
+        try:
+            master = MasterDataset()
+            stats = master.update(files, on_file=report)
+            master.close()
+        except Exception as e:
+            print(f"❌ Error updating master dataset: {e}")
+            return
+        print(f"\n✅ Update completed!")
+        print(f"📊 Files: {stats['new']} new, {stats['appended']} appended, {stats['changed']} changed, "
+              f"{stats['unchanged']} unchanged, {stats['copy']} copies skipped")
+        print(f"📊 Appended: {stats['added']} of {stats['rows']} rows read")
+        print(f"📁 Master: {os.path.abspath(master.path)} ({master.manifest['rows']} rows)")
+
+    def _merge_files(self, files, near_dedup=False):
+        """Helper method to merge CSV files, optionally removing near-duplicates"""
         if not files:
             print("❌ No files to merge")
             return
         
         print(f"\n🔄 Merging {len(files)} files...")
-        all_data = []
-        
-        for file in files:
-            try:
-                df = pd.read_csv(file)
-                all_data.append(df)
-                print(f"   ✅ {file}: {len(df)} rows")
-            except Exception as e:
+
+        def report(file, rows, error):
+            if error:
                 print(f"   ❌ {file}: Error reading file")
-        
-        if all_data:
-            merged_df = pd.concat(all_data, ignore_index=True)
-            
-            # Remove duplicates
-            original_size = len(merged_df)
-            merged_df = merged_df.drop_duplicates(subset=['input', 'output'])
-            final_size = len(merged_df)
-            
-            # Save merged file
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"merged_dataset_{timestamp}.csv"
-            merged_df.to_csv(filename, index=False)
-            
+            else:
+                print(f"   ✅ {file}: {rows} rows")
+
+        # Stream files in chunks and dedupe via on-disk hash partitions,
+        # so memory stays bounded by MERGE_MEMORY_MB instead of the total size
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"merged_dataset_{timestamp}{dataset_extension()}"
+        stats = merge_datasets(files, filename, on_file=report)
+
+        if stats['files']:
             print(f"\n✅ Merge completed!")
-            print(f"📊 Original: {original_size} rows")
-            print(f"📊 After deduplication: {final_size} rows")
+            print(f"📊 Original: {stats['rows']} rows")
+            print(f"📊 After deduplication: {stats['unique']} rows")
+            
+            if near_dedup:
+                print("🔍 Removing near-duplicate questions...")
+                stats = NearDuplicateDetector().dedupe_csv(filename)
+                print(f"📊 After near-deduplication: {stats['kept']} rows "
+                      f"({stats['clusters']} clusters, {stats['removed']} removed)")
             print(f"📁 Saved: {os.path.abspath(filename)}")
 
     def analyze_dataset(self):
@@ -226,63 +296,99 @@ class QAManager:
         print("\n📈 DATASET ANALYSIS")
         print("-" * 30)
         
-        csv_files = glob.glob("*.csv") + glob.glob("**/*.csv", recursive=True)
+        entries = self.catalog.entries()
+        csv_files = [entry['path'] for entry in entries]
         if not csv_files:
             print("❌ No CSV files found")
             return
         
         print("📁 Available files:")
-        for i, file in enumerate(csv_files, 1):
-            print(f"{i:2}. {file}")
+        for i, entry in enumerate(entries, 1):
+            print(f"{i:2}. {entry['path']} ({describe_entry(entry)})")
         
         try:
-            choice = int(input("Select file to analyze: ")) - 1
-            if 0 <= choice < len(csv_files):
-                self._analyze_file(csv_files[choice])
-            else:
+            choices = [int(i.strip()) - 1 for i in
+                       input("Select file to analyze (comma-separated to compare): ").split(',') if i.strip()]
+            if not choices or not all(0 <= choice < len(csv_files) for choice in choices):
                 print("❌ Invalid selection")
+            elif len(choices) == 1:
+                self._analyze_file(csv_files[choices[0]])
+            else:
+                self._compare_files([csv_files[choice] for choice in choices])
         except ValueError:
             print("❌ Invalid input")
 
     def _analyze_file(self, filename):
         """Analyze a specific CSV file"""
         try:
-            df = pd.read_csv(filename)
+            # Stats come from the catalog sidecar; only new or changed files are parsed
+            stats = self.catalog.stats(filename)
+            if 'error' in stats:
+                raise ValueError(stats['error'])
             
             print(f"\n📊 Analysis of: {filename}")
             print("=" * 50)
-            print(f"📝 Total rows: {len(df)}")
-            print(f"📋 Columns: {list(df.columns)}")
+            print(f"📝 Total rows: {stats['rows']}")
+            print(f"📋 Columns: {list(stats['columns'])}")
             
-            if 'input' in df.columns and 'output' in df.columns:
-                # Calculate statistics
-                input_lengths = df['input'].str.len()
-                output_lengths = df['output'].str.len()
+            if 'input' in stats['columns'] and 'output' in stats['columns']:
+                for field in ('input', 'output'):
+                    field_stats = stats[field]
+                    print(f"\n📏 {field.upper()} Statistics:")
+                    print(f"   Average length: {field_stats['mean']:.1f} characters")
+                    print(f"   Min length: {field_stats['min']} characters")
+                    print(f"   Max length: {field_stats['max']} characters")
+                    print(f"   Percentiles: p50 {field_stats['p50']} | p90 {field_stats['p90']} | "
+                          f"p99 {field_stats['p99']} characters")
+                    print(f"   Words: {field_stats['words']} | Estimated tokens: {field_stats['tokens']}")
                 
-                print(f"\n📏 INPUT Statistics:")
-                print(f"   Average length: {input_lengths.mean():.1f} characters")
-                print(f"   Min length: {input_lengths.min()} characters")
-                print(f"   Max length: {input_lengths.max()} characters")
+                print(f"\n🩺 Quality:")
+                print(f"   Empty rows: {stats['empty_rows']}")
+                print(f"   Truncated answers: {stats['truncated']}")
+                print(f"   Vocabulary (estimated): {stats['vocabulary']} words")
                 
-                print(f"\n📏 OUTPUT Statistics:")
-                print(f"   Average length: {output_lengths.mean():.1f} characters")
-                print(f"   Min length: {output_lengths.min()} characters")
-                print(f"   Max length: {output_lengths.max()} characters")
+                if 'topic' in stats['columns']:
+                    self._print_topic_breakdown(stats['topics'])
                 
-                # Show sample data
+                # Show sample data (only the first rows are read)
                 print(f"\n📝 Sample data:")
-                for i, row in df.head(3).iterrows():
-                    print(f"   {i+1}. INPUT: {row['input'][:50]}...")
-                    print(f"      OUTPUT: {row['output'][:50]}...")
+                sample = next(iter_dataset(filename, FIELDNAMES, 3), None)
+                for i, row in (sample.iterrows() if sample is not None else []):
+                    print(f"   {i+1}. INPUT: {str(row['input'])[:50]}...")
+                    print(f"      OUTPUT: {str(row['output'])[:50]}...")
                     print()
             
             # File size
-            size_mb = os.path.getsize(filename) / (1024 * 1024)
+            size_mb = stats['size'] / (1024 * 1024)
             print(f"💾 File size: {size_mb:.2f} MB")
             
         except Exception as e:
             print(f"❌ Error analyzing file: {e}")
 
+    def _print_topic_breakdown(self, topics):
+        """Print row count and average lengths per topic from catalog stats"""
+        print(f"\n🏷️ Topic Breakdown:")
+        for topic_key, counts in sorted(topics.items(), key=lambda item: int(item[0]) if item[0].isdigit() else 0):
+            name = TOPICS.get(topic_key, "Unknown topic" if topic_key else "No topic")
+            rows = counts['rows']
+            print(f"   {topic_key or '-':>3}. {name.split('(')[0].strip()[:35]:<35} {rows:>7} rows | "
+                  f"input {counts['input_chars'] / rows:.0f} / output {counts['output_chars'] / rows:.0f} chars | "
+                  f"{counts['truncated']} truncated")
+
+    def _compare_files(self, filenames):
+        """Show statistics of several files side by side"""
+        print(f"\n📊 Comparing {len(filenames)} files")
+        print("=" * 50)
+        summaries = {}
+        for filename in filenames:
+            stats = self.catalog.stats(filename)
+            if 'error' in stats:
+                print(f"   ❌ {filename}: Error reading file")
+            else:
+                summaries[filename] = stats
+        if summaries:
+            print("\n".join(format_comparison(summaries)))
+
     def clean_directories(self):
         """Clean output directories"""
         print("\n🧹 CLEAN DIRECTORIES")
@@ -290,25 +396,25 @@ class QAManager:
         
         # Find directories and files to clean
         dirs_to_check = ['marathon_rounds_*', 'marathon_finals']
-        files_to_check = ['*.csv', 'demo_*.csv', 'test_*.csv']
+        files_to_check = ['*.csv', '*.parquet']
         
+        # One scandir pass over the tree; sizes and row counts come from the catalog
+        entries = self.catalog.entries()
         items_found = []
         
         # Check directories
-        for pattern in dirs_to_check:
-            dirs = glob.glob(pattern)
-            for d in dirs:
-                if os.path.isdir(d):
-                    file_count = len(glob.glob(os.path.join(d, "*.csv")))
-                    items_found.append(('dir', d, file_count))
+        for entry in sorted(os.scandir('.'), key=lambda e: e.name):
+            if entry.is_dir() and any(fnmatch.fnmatch(entry.name, pattern) for pattern in dirs_to_check):
+                inside = [e for e in entries if e['path'].startswith(entry.name + os.sep)]
+                rows = sum((e['stats'] or {}).get('rows', 0) for e in inside)
+                items_found.append(('dir', entry.name, f"{len(inside)} files, {rows} rows"))
         
-        # Check files
-        for pattern in files_to_check:
-            files = glob.glob(pattern)
-            for f in files:
-                if os.path.isfile(f):
-                    size_kb = os.path.getsize(f) / 1024
-                    items_found.append(('file', f, size_kb))
+        # Check files (each file once even if several patterns match); Parquet
+        # datasets are listed once, their append segments are removed with them
+        for entry in entries:
+            name = entry['path']
+            if os.sep not in name and any(fnmatch.fnmatch(name.lower(), pattern) for pattern in files_to_check):
+                items_found.append(('file', name, describe_entry(entry)))
         
         if not items_found:
             print("✅ No items to clean")
@@ -316,10 +422,8 @@ class QAManager:
         
         print("🗂️ Items found:")
         for item_type, name, info in items_found:
-            if item_type == 'dir':
-                print(f"   📁 {name} ({info} files)")
-            else:
-                print(f"   📄 {name} ({info:.1f} KB)")
+            icon = "📁" if item_type == 'dir' else "📄"
+            print(f"   {icon} {name} ({info})")
         
         if input("\nDelete these items? (y/n): ").lower() == 'y':
             self._clean_items(items_found)
@@ -332,10 +436,14 @@ class QAManager:
         for item_type, name, _ in items:
             try:
                 if item_type == 'dir':
+                    inside = find_dataset_files(name)
                     shutil.rmtree(name)
+                    for path in inside:
+                        self.catalog.forget(path)
                     print(f"   🗑️ Deleted directory: {name}")
                 else:
-                    os.remove(name)
+                    remove_dataset(name)
+                    self.catalog.forget(name)
                     print(f"   🗑️ Deleted file: {name}")
                 deleted_count += 1
             except Exception as e:
@@ -364,6 +472,19 @@ class QAManager:
         except:
             print("   ❌ API configuration error")
         
+        # Response cache
+        print("\n🗄️ Response Cache:")
+        try:
+            from response_cache import ResponseCache
+            cache = ResponseCache.from_env()
+            if cache:
+                print(f"   ✅ {cache.path}: {cache.describe()}")
+                cache.close()
+            else:
+                print("   ⏸️ Disabled (RESPONSE_CACHE=0)")
+        except Exception as e:
+            print(f"   ❌ Cache error: {e}")
+        
         # Check dependencies
         print("\n📦 Dependencies:")
         dependencies = ['google.generativeai', 'pandas', 'python-dotenv']
@@ -392,6 +513,8 @@ class QAManager:
         print("3. 🔄 Batch Process Multiple Topics")
         print("4. 🧪 Test Custom Prompts")
         print("5. 📋 Generate Topic-Based Reports")
+        print("6. 🔎 Search Generated Pairs")
+        print("7. ✂️  Split Train/Validation/Test")
         print("0. ⬅️  Back to Main Menu")
         
         choice = input("Choose option: ")
@@ -406,6 +529,120 @@ class QAManager:
             self.test_custom_prompts()
         elif choice == "5":
             self.generate_reports()
+        elif choice == "6":
+            self.search_pairs()
+        elif choice == "7":
+            self.split_dataset()
+
+    def _open_search_index(self):
+        """Open the full-text index and ingest new or changed dataset files"""
+        index = SearchIndex()
+
+        def report(file, rows, error):
+            if error:
+                print(f"   ❌ {file}: Error reading file")
+            else:
+                print(f"   ✅ {file}: {rows} rows indexed")
+
+        stats = index.update(on_file=report)
+        if stats['removed']:
+            print(f"   🗑️ {stats['removed']} deleted files removed from the index")
+        print(f"🔎 Index: {index.path} | {index.describe()}")
+        return index
+
+    def _print_pairs(self, results):
+        for i, result in enumerate(results, 1):
+            topic = result['topic']
+            print(f"   {i}. [{topic or '-'}] INPUT: {result['input'][:80]}")
+            print(f"      OUTPUT: {result['output'][:80]}")
+            print(f"      📁 {result['source']}:{result['row'] + 1}")
+
+    def search_pairs(self, query=None, topic=None, limit=10, sample=0, counts=False):
+        """Search all generated pairs by keyword, count them per topic or sample them
+
+        Without arguments an interactive prompt is shown.
+        """
+        print("\n🔎 SEARCH GENERATED PAIRS")
+        print("-" * 30)
+        try:
+            index = self._open_search_index()
+        except Exception as e:
+            print(f"❌ Error opening search index: {e}")
+            return
+
+        interactive = not (query or sample or counts)
+        while True:
+            if interactive:
+                print("\nEnter keywords, ':topics' for per-topic counts, ':sample [topic]' for samples, "
+                      "or empty to go back")
+                command = input("Search: ").strip()
+                if not command:
+                    break
+                query, topic, sample, counts = command, None, 0, False
+                if command == ':topics':
+                    query, counts = None, True
+                elif command.startswith(':sample'):
+                    query, sample = None, 5
+                    topic = command[len(':sample'):].strip() or None
+
+            start_time = datetime.now()
+            if counts:
+                print("\n📊 Pairs per topic:")
+                for key, count in sorted(index.topic_counts().items(), key=lambda item: -item[1]):
+                    name = TOPICS.get(key, "No topic" if not key else "Unknown topic")
+                    print(f"   {key or '-':>3}. {name[:50]:<50} {count:>8}")
+            if query:
+                results = index.search(query, topic, limit)
+                print(f"\n📊 {index.count(query, topic)} pairs match \"{query}\"")
+                self._print_pairs(results)
+            if sample:
+                print(f"\n🎲 Random sample{f' (topic {topic})' if topic else ''}:")
+                self._print_pairs(index.sample(sample, topic))
+            elapsed = (datetime.now() - start_time).total_seconds() * 1000
+            print(f"⏱️ {elapsed:.0f} ms")
+            if not interactive:
+                break
+        index.close()
+
+    def split_dataset(self, files=None, stratify=None):
+        """Split datasets into stable train/validation/test shards
+
+        Pairs are assigned by a hash of their normalized question, so new rounds
+        only add pairs and never move existing ones to another split.
+        """
+        print("\n✂️ SPLIT TRAIN/VALIDATION/TEST")
+        print("-" * 30)
+        if files is None:
+            if os.path.exists(DEFAULT_MASTER_PATH):
+                files = [DEFAULT_MASTER_PATH]
+            else:
+                files = find_dataset_files(exclude_outputs=True)
+        if not files:
+            print("❌ No CSV files found")
+            return
+        if stratify is None:
+            stratify = input("Write separate shards per topic? (y/n): ").lower() == 'y'
+
+        print(f"🔄 Splitting {len(files)} files into {SPLIT_OUTPUT_DIR}/...")
+
+        def report(file, rows, error):
+            if error:
+                print(f"   ❌ {file}: Error reading file")
+            else:
+                print(f"   ✅ {file}: {rows} pairs")
+
+        try:
+            manifest = split_dataset(files, stratify=stratify, on_file=report)
+        except Exception as e:
+            print(f"❌ Error splitting dataset: {e}")
+            return
+        total = sum(manifest['counts'].values())
+        print(f"\n✅ Split completed! ({manifest['duplicates']} duplicates skipped)")
+        for name in SPLIT_NAMES:
+            count = manifest['counts'][name]
+            print(f"   📦 {name:<10} {count:>8} pairs ({count / max(1, total):.1%}), "
+                  f"{len(manifest['shards'][name])} shards")
+        print(f"📁 Saved: {os.path.abspath(SPLIT_OUTPUT_DIR)}")
 
     def configure_parameters(self):
         """Configure generation parameters"""
@@ -413,9 +650,57 @@ class QAManager:
         print("(This feature will be implemented in future versions)")
 
     def export_formats(self):
-        """Export to different formats"""
+        """Export datasets to sharded JSONL, chat (system/user/assistant) or Alpaca records"""
         print("\n📊 EXPORT FORMATS")
-        print("(JSON, JSONL, XML export will be implemented in future versions)")
+        print("-" * 30)
+
+        entries = self.catalog.entries()
+        files = [entry['path'] for entry in entries]
+        if not files:
+            print("❌ No CSV files found")
+            return
+
+        print("📁 Available files:")
+        for i, entry in enumerate(entries, 1):
+            print(f"{i:2}. {entry['path']} ({describe_entry(entry)})")
+        selection = input("Enter file numbers (comma-separated, empty for all): ").strip()
+        if selection:
+            indices = [int(i.strip()) - 1 for i in selection.split(',') if i.strip().isdigit()]
+            files = [files[i] for i in indices if 0 <= i < len(files)]
+            if not files:
+                print("❌ Invalid selection")
+                return
+
+        print("\nFormats:")
+        print("1. 📄 JSONL (input/output/topic)")
+        print("2. 💬 Chat messages (system/user/assistant)")
+        print("3. 🦙 Alpaca (instruction/input/output)")
+        export_format = {'1': 'jsonl', '2': 'chat', '3': 'alpaca'}.get(input("Choose format (1-3): ").strip())
+        if export_format is None:
+            print("❌ Invalid choice")
+            return
+        compression = input(f"Compression (gzip/zstd/none) [{EXPORT_COMPRESSION}]: ").strip().lower() or EXPORT_COMPRESSION
+
+        prefix = os.path.join('exports', f"{export_format}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        print(f"\n🔄 Exporting {len(files)} files...")
+
+        def report(file, rows, error):
+            if error:
+                print(f"   ❌ {file}: Error reading file")
+            else:
+                print(f"   ✅ {file}: {rows} pairs")
+
+        try:
+            stats = export_dataset(files, prefix, export_format, compression, on_file=report)
+        except Exception as e:
+            print(f"❌ Error exporting: {e}")
+            return
+        print(f"\n✅ Export completed!")
+        for shard in stats['shards']:
+            print(f"   📦 {shard['path']}: {shard['rows']} pairs, "
+                  f"{shard['compressed_bytes'] / 1024 / 1024:.1f} MB")
+        print(f"📊 Exported: {stats['rows']} pairs ({stats['skipped']} incomplete rows skipped)")
+        print(f"📁 Manifest: {os.path.abspath(stats['manifest'])}")
 
     def batch_process(self):
         """Batch process multiple topics"""
@@ -477,8 +762,14 @@ Examples:
   python qa_manager.py --check           # Check API connection
   python qa_manager.py --demo            # Generate demo dataset
   python qa_manager.py --marathon        # Start marathon mode
+  python qa_manager.py --pool            # Marathon with one worker process per API key
+  python qa_manager.py --resume          # Resume the latest marathon session
   python qa_manager.py --merge           # Merge CSV files
+  python qa_manager.py --update-master   # Append new files to the master dataset
   python qa_manager.py --analyze         # Analyze datasets
+  python qa_manager.py --search "mất ngủ" --topic 3   # Full-text search over all pairs
+  python qa_manager.py --topic-counts    # Pairs per topic across all files
+  python qa_manager.py --sample 5        # Random pairs (optionally with --topic)
   python qa_manager.py --clean           # Clean directories
         """
     )
@@ -486,8 +777,23 @@ Examples:
     parser.add_argument('--check', action='store_true', help='Check Google API connection')
     parser.add_argument('--demo', action='store_true', help='Generate demo dataset')
     parser.add_argument('--marathon', action='store_true', help='Start marathon mode')
+    parser.add_argument('--resume', nargs='?', const='latest', metavar='SESSION',
+                        help='Resume a marathon session from its checkpoint (default: the latest)')
+    parser.add_argument('--pool', action='store_true',
+                        help='Start marathon with one worker process per key in GOOGLE_API_KEYS')
+    parser.add_argument('--stub', action='store_true', help='Use the offline stub backend with --pool')
+    parser.add_argument('--workers', type=int, help='Number of --pool workers')
     parser.add_argument('--merge', action='store_true', help='Merge CSV files')
+    parser.add_argument('--update-master', action='store_true',
+                        help='Incrementally merge new or changed files into the master dataset')
     parser.add_argument('--analyze', action='store_true', help='Analyze dataset statistics')
+    parser.add_argument('--search', metavar='QUERY', help='Full-text search over all generated pairs')
+    parser.add_argument('--topic-counts', action='store_true', help='Count indexed pairs per topic')
+    parser.add_argument('--sample', type=int, metavar='N', help='Show N random indexed pairs')
+    parser.add_argument('--topic', help='Restrict --search / --sample to one topic')
+    parser.add_argument('--limit', type=int, help='Maximum search results (default 10)')
+    parser.add_argument('--split', action='store_true',
+                        help='Split the master dataset into stable train/validation/test shards')
     parser.add_argument('--clean', action='store_true', help='Clean output directories')
     parser.add_argument('--info', action='store_true', help='Show system information')
     parser.add_argument('--version', action='version', version='QA Manager 1.0.0')
@@ -498,6 +804,7 @@ Examples:
     # If no arguments provided, run interactive mode
     if not any(vars(args).values()):
         manager.run_interactive()
+        manager.catalog.close()
         return
     
     # Handle command line arguments
@@ -505,16 +812,27 @@ Examples:
         manager.check_api()
     elif args.demo:
         manager.demo_generation()
+    elif args.pool:
+        manager.pool_mode(args.stub, args.workers)
+    elif args.resume:
+        manager.marathon_mode(args.resume)
     elif args.marathon:
         manager.marathon_mode()
     elif args.merge:
         manager.merge_csv_files()
+    elif args.update_master:
+        manager.update_master_dataset()
     elif args.analyze:
         manager.analyze_dataset()
+    elif args.search or args.topic_counts or args.sample:
+        manager.search_pairs(args.search, args.topic, args.limit or 10, args.sample or 0, args.topic_counts)
+    elif args.split:
+        manager.split_dataset(stratify=False)
     elif args.clean:
         manager.clean_directories()
     elif args.info:
         manager.show_system_info()
+    manager.catalog.close()
 
 if __name__ == "__main__":
     main()
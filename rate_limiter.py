@@ -0,0 +1,120 @@
+"""
+Rate Limiter - Điều tiết tốc độ gọi Gemini API
+Token bucket cho request/phút và token/phút, tự tăng tốc (AIMD) cho đến khi gặp lỗi quota
+"""
+import os
+import time
+import asyncio
+import threading
+from dotenv import load_dotenv
+
+try:
+    from google.api_core import exceptions as google_exceptions
+    QUOTA_EXCEPTIONS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+except ImportError:
+    QUOTA_EXCEPTIONS = ()
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+# Ngân sách quota (đặt trong .env theo gói API đang dùng)
+DEFAULT_REQUESTS_PER_MINUTE = float(os.getenv('REQUESTS_PER_MINUTE', '15'))
+DEFAULT_TOKENS_PER_MINUTE = float(os.getenv('TOKENS_PER_MINUTE', '1000000'))
+
+
+def is_quota_error(error):
+    """Kiểm tra lỗi có phải do vượt quota (HTTP 429 / ResourceExhausted) không"""
+    if QUOTA_EXCEPTIONS and isinstance(error, QUOTA_EXCEPTIONS):
+        return True
+    message = f"{type(error).__name__} {error}".lower()
+    return '429' in message or 'resourceexhausted' in message or 'quota' in message
+
+
+def estimate_tokens(text):
+    """Ước lượng số token của một đoạn văn bản tiếng Việt (~3 ký tự/token)"""
+    return len(text) // 3 + 1
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None,
+                 initial_requests_per_minute=None, increase_step=1.0, decrease_factor=0.5,
+                 min_requests_per_minute=1.0):
+        """Khởi tạo bộ điều tiết tốc độ
+
+        requests_per_minute / tokens_per_minute: ngân sách tối đa của quota
+        initial_requests_per_minute: tốc độ khởi đầu (mặc định 1/4 ngân sách)
+        increase_step: số request/phút tăng thêm sau mỗi request thành công
+        decrease_factor: hệ số nhân giảm tốc khi gặp lỗi quota
+        """
+        self.max_rpm = requests_per_minute or DEFAULT_REQUESTS_PER_MINUTE
+        self.max_tpm = tokens_per_minute or DEFAULT_TOKENS_PER_MINUTE
+        self.min_rpm = min(min_requests_per_minute, self.max_rpm)
+        self.current_rpm = initial_requests_per_minute or max(self.min_rpm, self.max_rpm / 4)
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+
+        self.quota_errors = 0
+        self.total_requests = 0
+
+        self._lock = threading.Lock()
+        self._last_refill = time.monotonic()
+        self._request_level = 1.0
+        self._token_level = self.max_tpm
+
+    @classmethod
+    def unlimited(cls):
+        """Bộ điều tiết gần như không giới hạn (cho backend giả lập / benchmark)"""
+        return cls(1e9, 1e12, initial_requests_per_minute=1e9)
+
+    def _refill(self, now):
+        """Nạp lại hai bucket theo thời gian đã trôi qua"""
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._request_level = min(max(1.0, self.current_rpm / 60),
+                                  self._request_level + elapsed * self.current_rpm / 60)
+        self._token_level = min(self.max_tpm, self._token_level + elapsed * self.max_tpm / 60)
+
+    def _reserve(self, tokens):
+        """Giữ chỗ cho một request, trả về số giây cần chờ trước khi gửi"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._request_level -= 1
+            self._token_level -= tokens
+            self.total_requests += 1
+
+            wait = 0.0
+            if self._request_level < 0:
+                wait = max(wait, -self._request_level * 60 / self.current_rpm)
+            if self._token_level < 0:
+                wait = max(wait, -self._token_level * 60 / self.max_tpm)
+            return wait
+
+    def acquire(self, tokens=0):
+        """Chờ (đồng bộ) cho đến khi được phép gửi request tiêu tốn tokens"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0):
+        """Chờ (async) cho đến khi được phép gửi request tiêu tốn tokens"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self, token_correction=0):
+        """Ghi nhận request thành công: tăng tốc cộng dồn, hiệu chỉnh số token thực tế"""
+        with self._lock:
+            self.current_rpm = min(self.max_rpm, self.current_rpm + self.increase_step)
+            self._token_level -= token_correction
+
+    def on_quota_error(self):
+        """Ghi nhận lỗi quota: giảm tốc theo cấp số nhân và xả bucket request"""
+        with self._lock:
+            self.quota_errors += 1
+            self.current_rpm = max(self.min_rpm, self.current_rpm * self.decrease_factor)
+            self._request_level = min(self._request_level, 0.0)
+
+    def describe(self):
+        """Mô tả ngắn trạng thái hiện tại để in ra màn hình"""
+        return (f"{self.current_rpm:.1f}/{self.max_rpm:.0f} request/phút | "
+                f"{self.max_tpm:.0f} token/phút | lỗi quota: {self.quota_errors}")
@@ -0,0 +1,166 @@
+"""
+Response Cache - Lưu response của model vào SQLite để không trả tiền hai lần cho cùng một prompt
+Khóa theo tên model, hash prompt, cấu hình sinh và số thứ tự lần gọi trong phiên
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+from dotenv import load_dotenv
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+DEFAULT_CACHE_PATH = os.path.join('.qa_cache', 'responses.sqlite3')
+DEFAULT_CACHE_MAX_MB = 512
+
+
+class CachedResponse:
+    """Response lấy từ cache, cùng giao diện .text như response của backend"""
+
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+
+class ResponseCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024):
+        """Mở (hoặc tạo) cache tại path, giới hạn tổng dung lượng max_bytes (LRU)"""
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Số lần mỗi prompt đã được gọi trong phiên này: lần gọi thứ n của cùng
+        # một prompt ứng với một mục riêng, nên chạy lại pipeline sẽ phát lại
+        # đúng chuỗi response cũ thay vì lặp đi lặp lại response đầu tiên.
+        self._occurrences = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @classmethod
+    def from_env(cls):
+        """Tạo cache theo .env; trả về None nếu RESPONSE_CACHE=0"""
+        if os.getenv('RESPONSE_CACHE', '1').lower() in ('0', 'false', 'off', 'no'):
+            return None
+        max_mb = float(os.getenv('RESPONSE_CACHE_MAX_MB', str(DEFAULT_CACHE_MAX_MB)))
+        return cls(os.getenv('RESPONSE_CACHE_PATH', DEFAULT_CACHE_PATH), int(max_mb * 1024 * 1024))
+
+    def make_key(self, model_name, prompt, generation_config=None):
+        """Tạo khóa cho lần gọi tiếp theo của prompt này trong phiên"""
+        config = json.dumps(generation_config or {}, sort_keys=True, default=str)
+        base = hashlib.sha256(f"{model_name}\0{config}\0{prompt}".encode('utf-8')).hexdigest()
+        occurrence = self._occurrences.get(base, 0)
+        self._occurrences[base] = occurrence + 1
+        return f"{base}:{occurrence}"
+
+    def get(self, key):
+        """Lấy response đã lưu (None nếu chưa có), cập nhật thời điểm truy cập cho LRU"""
+        row = self.conn.execute("SELECT text FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.conn.commit()
+        return row[0]
+
+    def put(self, key, model_name, text):
+        """Lưu response rồi loại bỏ các mục ít dùng nhất nếu vượt dung lượng"""
+        size = len(text.encode('utf-8'))
+        now = time.time()
+        old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, model, text, size, created, last_access) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model_name, text, size, now, now))
+        self.total_bytes += size - (old[0] if old else 0)
+        if self.total_bytes > self.max_bytes:
+            self._evict()
+        self.conn.commit()
+
+    def _evict(self):
+        """Xóa mục truy cập lâu nhất cho đến khi còn dưới 90% dung lượng tối đa"""
+        target = self.max_bytes * 0.9
+        while self.total_bytes > target:
+            rows = self.conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 100").fetchall()
+            if not rows:
+                self.total_bytes = 0
+                break
+            for key, size in rows:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.total_bytes -= size
+                if self.total_bytes <= target:
+                    break
+
+    def clear(self):
+        """Xóa toàn bộ cache"""
+        self.conn.execute("DELETE FROM responses")
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+        self.total_bytes = 0
+
+    def stats(self):
+        """Thống kê cache: số mục, dung lượng, hit/miss trong phiên"""
+        entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'path': self.path,
+            'entries': entries,
+            'size_mb': self.total_bytes / (1024 * 1024),
+            'max_mb': self.max_bytes / (1024 * 1024),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def describe(self):
+        """Mô tả ngắn để in ra màn hình"""
+        stats = self.stats()
+        return (f"{stats['entries']} mục | {stats['size_mb']:.1f}/{stats['max_mb']:.0f} MB | "
+                f"hit {stats['hits']} / miss {stats['misses']} ({stats['hit_rate']:.0%})")
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    """Xem thống kê hoặc xóa response cache"""
+    parser = argparse.ArgumentParser(description="Quản lý response cache")
+    parser.add_argument('--clear', action='store_true', help='Xóa toàn bộ cache')
+    args = parser.parse_args()
+
+    cache = ResponseCache.from_env()
+    if cache is None:
+        print("📭 Response cache đang tắt (RESPONSE_CACHE=0)")
+        sys.exit(0)
+    if args.clear:
+        cache.clear()
+        print(f"🗑️ Đã xóa cache: {cache.path}")
+    print(f"🗄️ Response cache: {cache.path}")
+    print(f"📊 {cache.describe()}")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Retry Policy - Phân loại lỗi và thử lại với exponential backoff + jitter
+"""
+import os
+import random
+from dotenv import load_dotenv
+from rate_limiter import is_quota_error
+
+try:
+    from google.api_core import exceptions as google_exceptions
+    TRANSIENT_EXCEPTIONS = (
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.GatewayTimeout,
+        google_exceptions.Aborted,
+    )
+    FATAL_EXCEPTIONS = (
+        google_exceptions.InvalidArgument,
+        google_exceptions.PermissionDenied,
+        google_exceptions.Unauthenticated,
+        google_exceptions.NotFound,
+    )
+except ImportError:
+    TRANSIENT_EXCEPTIONS = ()
+    FATAL_EXCEPTIONS = ()
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+DEFAULT_MAX_RETRIES = int(os.getenv('MAX_RETRIES', '3'))
+DEFAULT_MAX_TOP_UPS = int(os.getenv('MAX_TOP_UPS', '2'))
+DEFAULT_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '1.0'))
+DEFAULT_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '30.0'))
+
+TRANSIENT_MARKERS = ('429', '500', '502', '503', '504', 'unavailable', 'timeout', 'timed out',
+                     'deadline', 'connection', 'temporarily', 'overloaded', 'internal')
+
+
+def classify_error(error):
+    """Phân loại lỗi: 'quota', 'transient' (thử lại được) hoặc 'fatal'"""
+    if is_quota_error(error):
+        return 'quota'
+    if FATAL_EXCEPTIONS and isinstance(error, FATAL_EXCEPTIONS):
+        return 'fatal'
+    if TRANSIENT_EXCEPTIONS and isinstance(error, TRANSIENT_EXCEPTIONS):
+        return 'transient'
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return 'transient'
+    message = f"{type(error).__name__} {error}".lower()
+    if any(marker in message for marker in TRANSIENT_MARKERS):
+        return 'transient'
+    return 'fatal'
+
+
+class RetryPolicy:
+    def __init__(self, max_retries=None, max_top_ups=None, base_delay=None, max_delay=None):
+        """Khởi tạo chính sách thử lại
+
+        max_retries: số lần thử lại tối đa khi gặp lỗi tạm thời / quota
+        max_top_ups: số request bổ sung tối đa khi model trả thiếu cặp Q&A
+        base_delay / max_delay: thời gian chờ cơ sở và tối đa (giây)
+        """
+        self.max_retries = DEFAULT_MAX_RETRIES if max_retries is None else max_retries
+        self.max_top_ups = DEFAULT_MAX_TOP_UPS if max_top_ups is None else max_top_ups
+        self.base_delay = DEFAULT_BASE_DELAY if base_delay is None else base_delay
+        self.max_delay = DEFAULT_MAX_DELAY if max_delay is None else max_delay
+
+    def should_retry(self, error, retries):
+        """True nếu lỗi thử lại được và chưa dùng hết số lần thử lại"""
+        return retries < self.max_retries and classify_error(error) != 'fatal'
+
+    def delay(self, retry_number):
+        """Thời gian chờ trước lần thử lại thứ retry_number (1, 2, ...), có jitter"""
+        cap = min(self.max_delay, self.base_delay * (2 ** (retry_number - 1)))
+        return random.uniform(cap / 2, cap)
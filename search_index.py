@@ -0,0 +1,348 @@
+"""
+Search Index - Chỉ mục tìm kiếm toàn văn (SQLite FTS5) cho mọi cặp Q&A đã sinh
+Nạp tăng dần theo file (bỏ qua file không đổi), tìm theo từ khóa, đếm và lấy mẫu theo chủ đề.
+Mỗi cặp chỉ được lưu một lần (theo hash cặp đã chuẩn hóa) dù xuất hiện ở nhiều file
+"""
+import os
+import time
+import random
+import sqlite3
+import argparse
+from datetime import datetime
+from dotenv import load_dotenv
+from dataset_io import FIELDNAMES, find_dataset_files, iter_dataset
+from dedup_index import pair_hash
+from master_dataset import DEFAULT_MASTER_PATH, file_digest
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+DEFAULT_INDEX_PATH = os.path.join('.qa_cache', 'search.sqlite3')
+# unicode61 + remove_diacritics: "thuoc" cũng tìm được "thuốc"
+FTS_TOKENIZER = "unicode61 remove_diacritics 2"
+# Tăng khi đổi schema: chỉ mục cũ được xóa và nạp lại từ đầu
+SCHEMA_VERSION = 2
+# Thư mục chứa file ghép từ file khác (marathon final): nạp sau cùng để file gốc giữ các cặp
+DERIVED_DIRS = ('marathon_finals',)
+# Mật độ id tối thiểu (số cặp / khoảng id) để lấy mẫu bằng cách rút id ngẫu nhiên
+SAMPLE_MIN_DENSITY = 0.05
+
+
+def signed_hash(qa_input, qa_output):
+    """pair_hash dạng số nguyên có dấu 64-bit (kiểu INTEGER của SQLite)"""
+    value = pair_hash(qa_input, qa_output)
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def is_derived(path):
+    """File được ghép từ các file khác (vd. marathon_finals/marathon_final_*.csv)"""
+    parts = os.path.normpath(os.path.relpath(os.path.abspath(path))).split(os.sep)
+    return any(part in DERIVED_DIRS for part in parts[:-1])
+
+
+def fts_query(text):
+    """Chuyển từ khóa người dùng thành truy vấn FTS5 an toàn (mọi từ đều phải có)
+
+    Từ kết thúc bằng * được giữ là tìm theo tiền tố (vd. "thuốc*").
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*') and len(word) > 1
+        word = word.rstrip('*').replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+class SearchIndex:
+    def __init__(self, path=None):
+        """Mở (hoặc tạo) chỉ mục tại path (mặc định SEARCH_INDEX_PATH trong .env)
+
+        Bảng pairs giữ nội dung và metadata (chủ đề, file nguồn, số dòng), mỗi
+        cặp một dòng (khóa duy nhất theo hash) thuộc file đầu tiên nạp nó;
+        bảng ảo pairs_fts (FTS5, external content) chỉ giữ chỉ mục từ của input/output.
+        """
+        self.path = path or os.getenv('SEARCH_INDEX_PATH', DEFAULT_INDEX_PATH)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self.conn.executescript("""
+                DROP TABLE IF EXISTS pairs_fts;
+                DROP TABLE IF EXISTS pairs;
+                DROP TABLE IF EXISTS sources;
+            """)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS sources (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                hash TEXT NOT NULL,
+                rows INTEGER NOT NULL,
+                skipped INTEGER NOT NULL DEFAULT 0,
+                indexed_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pairs (
+                id INTEGER PRIMARY KEY,
+                hash INTEGER NOT NULL UNIQUE,
+                input TEXT NOT NULL,
+                output TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                source_id INTEGER NOT NULL,
+                row INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_pairs_topic ON pairs(topic, id);
+            CREATE INDEX IF NOT EXISTS idx_pairs_source ON pairs(source_id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS pairs_fts USING fts5(
+                input, output, content='pairs', content_rowid='id', tokenize='{FTS_TOKENIZER}'
+            );
+        """)
+        self.conn.commit()
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path))
+
+    def _remove_source(self, source_id):
+        """Xóa các cặp của một file nguồn khỏi cả bảng pairs và chỉ mục FTS, trả về số cặp đã xóa"""
+        self.conn.execute(
+            "INSERT INTO pairs_fts(pairs_fts, rowid, input, output) "
+            "SELECT 'delete', id, input, output FROM pairs WHERE source_id = ?", (source_id,))
+        removed = self.conn.execute("DELETE FROM pairs WHERE source_id = ?", (source_id,)).rowcount
+        self.conn.execute("DELETE FROM sources WHERE id = ?", (source_id,))
+        return removed
+
+    def _ingest(self, path, chunksize, force=False):
+        """Nạp một file vào chỉ mục trong một transaction
+
+        Cặp đã có (thuộc file khác) bị bỏ qua và được đếm vào cột skipped.
+        Trả về (số dòng, số cặp bị mất), trong đó số cặp bị mất là số cặp file
+        này sở hữu trước đó mà không còn: chúng có thể vẫn nằm trong file khác
+        đã bỏ qua chúng. Trả về None nếu nội dung file không đổi (trừ khi force).
+        """
+        stat = os.stat(path)
+        key = self._key(path)
+        digest = file_digest(path)
+        with self.conn:
+            old = self.conn.execute("SELECT id, hash FROM sources WHERE path = ?", (key,)).fetchone()
+            if old and old[1] == digest and not force:
+                # Chỉ mtime thay đổi (vd. file được copy lại): cập nhật metadata
+                self.conn.execute("UPDATE sources SET size = ?, mtime = ? WHERE id = ?",
+                                  (stat.st_size, stat.st_mtime, old[0]))
+                return None
+            removed = self._remove_source(old[0]) if old else 0
+            source_id = self.conn.execute(
+                "INSERT INTO sources (path, size, mtime, hash, rows, indexed_at) VALUES (?, ?, ?, ?, 0, ?)",
+                (key, stat.st_size, stat.st_mtime, digest, datetime.now().isoformat(timespec='seconds'))
+            ).lastrowid
+            first_id = (self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM pairs").fetchone()[0]) + 1
+            rows = added = 0
+            for chunk in iter_dataset(path, FIELDNAMES, chunksize):
+                chunk = chunk.reindex(columns=FIELDNAMES)
+                chunk['topic'] = chunk['topic'].astype(object).fillna('')
+                chunk = chunk[chunk['input'].notna() & chunk['output'].notna()]
+                inputs, outputs = chunk['input'].astype(str), chunk['output'].astype(str)
+                added += self.conn.executemany(
+                    "INSERT OR IGNORE INTO pairs (hash, input, output, topic, source_id, row) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    zip(map(signed_hash, inputs, outputs), inputs, outputs, chunk['topic'].astype(str),
+                        [source_id] * len(chunk), range(rows, rows + len(chunk)))).rowcount
+                rows += len(chunk)
+            # Đưa cả file vào FTS bằng một câu lệnh (nhanh hơn nhiều so với từng dòng)
+            self.conn.execute(
+                "INSERT INTO pairs_fts(rowid, input, output) SELECT id, input, output FROM pairs WHERE id >= ?",
+                (first_id,))
+            self.conn.execute("UPDATE sources SET rows = ?, skipped = ? WHERE id = ?",
+                              (rows, rows - added, source_id))
+        return rows, max(0, removed - added)
+
+    def update(self, files=None, on_file=None, chunksize=50_000):
+        """Nạp các file mới/đã thay đổi, bỏ các file nguồn đã bị xóa
+
+        Mặc định lấy mọi CSV/Parquet trong thư mục trừ file gộp và dataset chính
+        (dữ liệu của chúng đã có trong các file gốc). File không đổi kích thước
+        và mtime chỉ tốn một lần stat. File ghép (marathon final) được nạp sau
+        file round nên mỗi cặp chỉ được đếm một lần; khi file sở hữu cặp bị
+        xóa hoặc ngắn lại, các file đã bỏ qua cặp trùng được nạp lại để nhận
+        các cặp đó.
+        on_file(path, rows, error): callback cho từng file được nạp lại.
+        Trả về dict thống kê.
+        """
+        if files is None:
+            files = find_dataset_files(exclude_outputs=True, exclude=(DEFAULT_MASTER_PATH,))
+        files = sorted(files, key=is_derived)
+        known = {path: (size, mtime) for path, size, mtime in
+                 self.conn.execute("SELECT path, size, mtime FROM sources")}
+        stats = {'indexed': 0, 'unchanged': 0, 'removed': 0, 'failed': 0, 'rows': 0}
+        lost = 0
+
+        def ingest(path, force=False):
+            nonlocal lost
+            try:
+                result = self._ingest(path, chunksize, force)
+            except Exception as e:
+                stats['failed'] += 1
+                if on_file:
+                    on_file(path, 0, e)
+                return
+            if result is None:
+                stats['unchanged'] += 1
+                return
+            rows, lost_pairs = result
+            lost += lost_pairs
+            stats['indexed'] += 1
+            stats['rows'] += rows
+            if on_file:
+                on_file(path, rows, None)
+
+        seen = set()
+        for path in files:
+            key = self._key(path)
+            seen.add(key)
+            stat = os.stat(path)
+            if known.get(key) == (stat.st_size, stat.st_mtime):
+                stats['unchanged'] += 1
+                continue
+            ingest(path)
+
+        # File nguồn không còn tồn tại thì bỏ khỏi chỉ mục
+        for key in known:
+            if key not in seen and not os.path.exists(key):
+                with self.conn:
+                    source_id = self.conn.execute("SELECT id FROM sources WHERE path = ?", (key,)).fetchone()[0]
+                    lost += self._remove_source(source_id)
+                stats['removed'] += 1
+
+        # Cặp mất chủ có thể vẫn nằm trong file đã bỏ qua chúng: nạp lại các file đó
+        if lost:
+            for (key,) in self.conn.execute("SELECT path FROM sources WHERE skipped > 0").fetchall():
+                if os.path.exists(key):
+                    ingest(key, force=True)
+        return stats
+
+    def search(self, text, topic=None, limit=20):
+        """Tìm các cặp chứa mọi từ khóa, xếp theo độ liên quan (bm25)"""
+        query = fts_query(text)
+        if not query:
+            return []
+        # CROSS JOIN giữ FTS ở vòng ngoài: không để SQLite quét cả chủ đề rồi MATCH từng dòng
+        sql = ("SELECT p.input, p.output, p.topic, s.path, p.row FROM pairs_fts "
+               "CROSS JOIN pairs p ON p.id = pairs_fts.rowid CROSS JOIN sources s ON s.id = p.source_id "
+               "WHERE pairs_fts MATCH ?")
+        params = [query]
+        if topic:
+            sql += " AND p.topic = ?"
+            params.append(str(topic))
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+        return [dict(zip(('input', 'output', 'topic', 'source', 'row'), row))
+                for row in self.conn.execute(sql, params)]
+
+    def count(self, text=None, topic=None):
+        """Số cặp khớp từ khóa (và chủ đề), hoặc tổng số cặp nếu không có từ khóa"""
+        if text and fts_query(text):
+            sql = ("SELECT COUNT(*) FROM pairs_fts CROSS JOIN pairs p ON p.id = pairs_fts.rowid "
+                   "WHERE pairs_fts MATCH ?")
+            params = [fts_query(text)]
+            if topic:
+                sql += " AND p.topic = ?"
+                params.append(str(topic))
+            return self.conn.execute(sql, params).fetchone()[0]
+        if topic:
+            return self.conn.execute("SELECT COUNT(*) FROM pairs WHERE topic = ?", (str(topic),)).fetchone()[0]
+        return self.conn.execute("SELECT COUNT(*) FROM pairs").fetchone()[0]
+
+    def topic_counts(self):
+        """Số cặp theo chủ đề: {topic: count} (chỉ quét chỉ mục idx_pairs_topic)"""
+        return dict(self.conn.execute("SELECT topic, COUNT(*) FROM pairs GROUP BY topic"))
+
+    def sample(self, n=5, topic=None):
+        """Lấy ngẫu nhiên n cặp khác nhau (theo chủ đề nếu có), xác suất như nhau
+
+        Rút id ngẫu nhiên trong [id nhỏ nhất, id lớn nhất] và bỏ id không tồn
+        tại (hoặc khác chủ đề): mỗi lần rút chỉ là một lần tra khóa chính, và
+        khoảng trống id do file bị xóa / nạp lại không làm lệch mẫu. Khi id
+        quá thưa (mật độ dưới SAMPLE_MIN_DENSITY) hoặc cần gần hết các cặp
+        thì đọc danh sách id một lần rồi chọn trong đó.
+        """
+        where, params = ("WHERE topic = ?", [str(topic)]) if topic else ("", [])
+        total, low, high = self.conn.execute(
+            f"SELECT COUNT(*), MIN(id), MAX(id) FROM pairs {where}", params).fetchone()
+        if not total:
+            return []
+        n = min(n, total)
+        if total / (high - low + 1) >= SAMPLE_MIN_DENSITY and n <= total // 2:
+            lookup = "SELECT 1 FROM pairs WHERE id = ?" + (" AND topic = ?" if topic else "")
+            chosen = set()
+            while len(chosen) < n:
+                pair_id = random.randint(low, high)
+                if pair_id not in chosen and self.conn.execute(lookup, [pair_id] + params).fetchone():
+                    chosen.add(pair_id)
+            pair_ids = list(chosen)
+        else:
+            ids = [row[0] for row in self.conn.execute(f"SELECT id FROM pairs {where}", params)]
+            pair_ids = random.sample(ids, n)
+        results = []
+        for pair_id in pair_ids:
+            row = self.conn.execute(
+                "SELECT p.input, p.output, p.topic, s.path, p.row FROM pairs p "
+                "JOIN sources s ON s.id = p.source_id WHERE p.id = ?", (pair_id,)).fetchone()
+            results.append(dict(zip(('input', 'output', 'topic', 'source', 'row'), row)))
+        return results
+
+    def describe(self):
+        """Mô tả ngắn để in ra màn hình"""
+        sources, rows, skipped = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(rows), 0), COALESCE(SUM(skipped), 0) FROM sources").fetchone()
+        size_mb = os.path.getsize(self.path) / (1024 * 1024) if os.path.exists(self.path) else 0.0
+        return f"{rows - skipped} cặp | {skipped} dòng trùng bỏ qua | {sources} file | {size_mb:.1f} MB"
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    """Cập nhật chỉ mục và tìm kiếm từ dòng lệnh"""
+    parser = argparse.ArgumentParser(description="Chỉ mục tìm kiếm toàn văn cho các cặp Q&A")
+    parser.add_argument('query', nargs='*', help='Từ khóa cần tìm (bỏ trống để chỉ cập nhật chỉ mục)')
+    parser.add_argument('--topic', default=None, help='Chỉ tìm trong một chủ đề')
+    parser.add_argument('--limit', type=int, default=10, help='Số kết quả tối đa')
+    parser.add_argument('--counts', action='store_true', help='Đếm số cặp theo chủ đề')
+    parser.add_argument('--sample', type=int, default=0, metavar='N', help='Lấy ngẫu nhiên N cặp')
+    parser.add_argument('--no-update', action='store_true', help='Không quét file mới trước khi tìm')
+    args = parser.parse_args()
+
+    index = SearchIndex()
+    if not args.no_update:
+        stats = index.update(on_file=lambda path, rows, error: print(
+            f"   ❌ {path}: {error}" if error else f"   ✅ {path}: {rows} dòng"))
+        if stats['indexed'] or stats['removed']:
+            print(f"📥 Nạp {stats['indexed']} file ({stats['rows']} dòng), bỏ {stats['removed']} file đã xóa")
+    print(f"🔎 Chỉ mục: {index.path} | {index.describe()}")
+
+    start_time = time.time()
+    if args.counts:
+        for topic, count in sorted(index.topic_counts().items(), key=lambda item: -item[1]):
+            print(f"   {topic or '-':>3}: {count}")
+    if args.query:
+        text = ' '.join(args.query)
+        results = index.search(text, args.topic, args.limit)
+        print(f"📊 {index.count(text, args.topic)} cặp khớp \"{text}\"")
+        for result in results:
+            print(f"   [{result['topic'] or '-'}] {result['input'][:80]}")
+            print(f"        → {result['output'][:80]}  ({result['source']}:{result['row'] + 1})")
+    if args.sample:
+        for result in index.sample(args.sample, args.topic):
+            print(f"   [{result['topic'] or '-'}] {result['input'][:80]}")
+            print(f"        → {result['output'][:80]}")
+    if args.counts or args.query or args.sample:
+        print(f"⏱️ {(time.time() - start_time) * 1000:.0f} ms")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
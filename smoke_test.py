@@ -0,0 +1,209 @@
+"""
+Smoke Test - Kiểm tra nhanh các đường phục hồi dữ liệu bằng StubBackend (không cần mạng)
+Mỗi kịch bản chạy trong một thư mục tạm riêng: tiếp tục marathon sau khi file
+round bị cắt giữa chừng, thứ tự ghi dữ liệu trước chỉ mục dedup, và phát lại
+response từ cache so với sinh mới. Thoát với mã 1 nếu có kịch bản thất bại.
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+import pandas as pd
+from dotenv import load_dotenv
+import marathon_generator
+from dedup_index import DedupIndex, pair_hash
+from generator_google import QAGenerator
+from llm_backends import StubBackend
+from marathon_journal import find_round_segments
+from response_cache import ResponseCache
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+# Số cặp marathon ghi được trước khi tiến trình con bị kill giữa lượt
+CRASH_AFTER_PAIRS = 75
+# Phần dòng ghi dở nối vào cuối file round để giả lập bị kill giữa lúc ghi
+PARTIAL_ROW = b'Ch\xc3\xa1u \xc6\xa1i,"c\xc3\xa2u tr\xe1\xba\xa3 l\xe1\xbb\x9di d\xe1\xbb\x9f'
+
+SCENARIOS = ('resume', 'dedup', 'replay')
+
+
+class SmokeFailure(Exception):
+    """Một điều kiện của kịch bản không thỏa"""
+
+
+def check(condition, message):
+    if not condition:
+        raise SmokeFailure(message)
+
+
+def _isolate(workdir):
+    """Chuyển vào thư mục tạm, mọi file (cache, dedup, metrics, output) nằm trong đó"""
+    os.chdir(workdir)
+    os.environ.update({
+        'DEDUP_INDEX': '1',
+        'DEDUP_INDEX_PATH': os.path.join(workdir, '.qa_cache', 'dedup_index.bin'),
+        'RESPONSE_CACHE': '0',
+        'METRICS': '0',
+    })
+
+
+def _stub_backend(seed=None):
+    return StubBackend(latency=0.0, jitter=0.0, seed=seed)
+
+
+def _round_pairs(rounds_dir):
+    """Các cặp trong những file round của phiên"""
+    frames = [pd.read_csv(path, dtype=str, keep_default_na=False) for path in find_round_segments(rounds_dir)]
+    return pd.concat(frames, ignore_index=True)
+
+
+def _crashing_marathon(workdir, crash_after):
+    """Tiến trình con: chạy marathon rồi chết đột ngột (os._exit) sau crash_after cặp"""
+    _isolate(workdir)
+    marathon_generator.CHECKPOINT_SECONDS = 3600  # chỉ checkpoint khi mỗi chủ đề xong
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        marathon = marathon_generator.MarathonGenerator(max_in_flight=2, backend=_stub_backend(seed=1))
+        on_pair = marathon._on_pair
+        written = 0
+
+        def crash_on_pair(qa):
+            nonlocal written
+            on_pair(qa)
+            written += 1
+            if written >= crash_after:
+                marathon.journal.sync()
+                os._exit(1)
+
+        marathon._on_pair = crash_on_pair
+        marathon.run_marathon()
+
+
+def scenario_resume(workdir):
+    """Marathon bị kill giữa lượt, file round có dòng ghi dở: tiếp tục đúng chỗ"""
+    process = multiprocessing.Process(target=_crashing_marathon, args=(workdir, CRASH_AFTER_PAIRS))
+    process.start()
+    process.join(120)
+    check(process.exitcode == 1, f"tiến trình marathon không bị kill như dự kiến (mã {process.exitcode})")
+
+    _isolate(workdir)
+    rounds_dir = next(name for name in os.listdir('.') if name.startswith('marathon_rounds_'))
+    round_files = [name for name in os.listdir(rounds_dir) if name.endswith('.csv')]
+    check(len(round_files) == 1, f"cần đúng một file round, có {round_files}")
+    with open(os.path.join(rounds_dir, round_files[0]), 'ab') as f:
+        f.write(PARTIAL_ROW)
+
+    with contextlib.redirect_stdout(None):
+        marathon = marathon_generator.MarathonGenerator(max_in_flight=2, backend=_stub_backend(seed=2),
+                                                        resume=rounds_dir)
+    written = _round_pairs(rounds_dir)
+    counts = written['topic'].value_counts().to_dict()
+    check(len(written) == CRASH_AFTER_PAIRS, f"file round còn {len(written)} cặp, cần {CRASH_AFTER_PAIRS}")
+    check(marathon.round_counts == counts, f"round_counts {marathon.round_counts} khác file round {counts}")
+    delivered = {key: stats['pairs_delivered'] for key, stats in marathon.generator.topic_stats.items()
+                 if stats['pairs_delivered']}
+    check(delivered == counts, f"pairs_delivered {delivered} khác số cặp trong file round {counts}")
+    plan = dict(marathon.round_plan)
+    saved = DedupIndex(os.environ['DEDUP_INDEX_PATH'])
+    missing = sum(pair_hash(row['input'], row['output']) not in saved for row in written.to_dict('records'))
+    check(not missing, f"{missing} cặp trong file round thiếu trong chỉ mục dedup đã lưu")
+
+    # Sinh nốt lượt dở dang rồi dừng: lịch của lượt kế tiếp không còn chủ đề nào
+    marathon.scheduler.plan_round = lambda *args: {}
+    with contextlib.redirect_stdout(None):
+        marathon.run_marathon()
+    written = _round_pairs(rounds_dir)
+    check(not written.duplicated(['input', 'output']).any(), "lượt được tiếp tục ghi lại cặp trùng")
+    check(marathon.total_generated == len(written),
+          f"total_generated {marathon.total_generated} khác {len(written)} dòng đã ghi")
+    counts = written['topic'].value_counts().to_dict()
+    check(marathon.current_round == 2, "lượt dở dang không được sinh nốt")
+    check(all(counts.get(topic_key, 0) <= num_pairs for topic_key, num_pairs in plan.items()),
+          f"có chủ đề sinh quá kế hoạch lượt: {counts}")
+    delivered = {key: stats['pairs_delivered'] for key, stats in marathon.generator.topic_stats.items()
+                 if stats['pairs_delivered']}
+    check(delivered == counts, f"pairs_delivered {delivered} khác số cặp đã ghi {counts}")
+    return f"{CRASH_AFTER_PAIRS} cặp giữ nguyên sau khi cắt dòng ghi dở, lượt hoàn tất với {len(written)} cặp"
+
+
+def scenario_dedup(workdir):
+    """Hash của cặp chỉ được lưu xuống đĩa sau khi cặp đã được ghi vào dataset"""
+    _isolate(workdir)
+    path = os.environ['DEDUP_INDEX_PATH']
+    with contextlib.redirect_stdout(None):
+        generator = QAGenerator(backend=_stub_backend(seed=3), cache=False, dedup=DedupIndex(path), metrics=False)
+        qa_pairs = generator.generate_qa_pairs('1', 20)
+    check(qa_pairs, "StubBackend không sinh được cặp nào")
+    check(len(DedupIndex(path)) == 0, "chỉ mục dedup đã lưu hash trước khi dữ liệu được ghi")
+    generator.dedup.flush()
+    check(len(DedupIndex(path)) == 0, "flush() lưu cả hash của cặp chưa được xác nhận đã ghi")
+
+    generator.save_to_csv(qa_pairs, 'dedup_smoke.csv', verbose=False)
+    saved = DedupIndex(path)
+    check(len(saved) == len(qa_pairs), f"chỉ mục dedup có {len(saved)} hash sau khi ghi {len(qa_pairs)} cặp")
+    check(len(pd.read_csv('dedup_smoke.csv')) == len(qa_pairs), "file CSV thiếu cặp")
+    return f"{len(qa_pairs)} hash chỉ xuất hiện trong chỉ mục sau save_to_csv"
+
+
+def scenario_replay(workdir):
+    """fresh=False phát lại đúng response đã cache; fresh=True (mặc định) luôn sinh mới"""
+    _isolate(workdir)
+    cache_path = os.path.join(workdir, '.qa_cache', 'responses.sqlite3')
+
+    def run(seed, **kwargs):
+        with contextlib.redirect_stdout(None):
+            generator = QAGenerator(backend=_stub_backend(seed), cache=ResponseCache(cache_path),
+                                    dedup=False, metrics=False, **kwargs)
+            return [(qa['input'], qa['output']) for qa in generator.generate_qa_pairs('2', 30)]
+
+    original = run(seed=4)
+    check(run(seed=5, fresh=False) == original, "fresh=False không phát lại response đã cache")
+    check(run(seed=6) != original, "mặc định (fresh=True) lại đọc response từ cache")
+    return f"phát lại đúng {len(original)} cặp từ cache, lần chạy mặc định sinh dữ liệu mới"
+
+
+def run_scenarios(names, keep=False):
+    """Chạy các kịch bản, in kết quả từng cái; trả về số kịch bản thất bại"""
+    failures = 0
+    cwd = os.getcwd()
+    for name in names:
+        workdir = tempfile.mkdtemp(prefix=f'smoke_{name}_')
+        try:
+            detail = globals()[f'scenario_{name}'](workdir)
+            print(f"✅ {name}: {detail}")
+        except Exception as e:
+            failures += 1
+            print(f"❌ {name}: {e}")
+        finally:
+            os.chdir(cwd)
+            if keep:
+                print(f"   📂 {workdir}")
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Smoke test các đường phục hồi dữ liệu bằng StubBackend")
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help=f"kịch bản cần chạy: {', '.join(SCENARIOS)} (mặc định: tất cả)")
+    parser.add_argument('--keep', action='store_true', help='giữ lại thư mục tạm để xem dữ liệu')
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"kịch bản không tồn tại: {', '.join(unknown)} (chọn trong {', '.join(SCENARIOS)})")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    print("🧪 SMOKE TEST (StubBackend, không gọi API)")
+    failures = run_scenarios(args.scenarios, args.keep)
+    if failures:
+        print(f"\n❌ {failures}/{len(args.scenarios)} kịch bản thất bại")
+        sys.exit(1)
+    print(f"\n🎉 {len(args.scenarios)} kịch bản đều đạt")
+
+
+if __name__ == "__main__":
+    main()
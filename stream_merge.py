@@ -0,0 +1,270 @@
+"""
+Stream Merge - Gộp nhiều dataset lớn hơn RAM theo kiểu stream
+Đọc theo chunk, chia dòng vào các file tạm theo hash để khử trùng lặp, ghi kết quả dần dần
+"""
+import os
+import sys
+import math
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from dataset_io import FIELDNAMES, ParquetDatasetWriter, is_parquet, iter_dataset, parquet_parts, replace_dataset
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+# Trần bộ nhớ (MB) của mỗi process khử trùng lặp và số dòng mỗi chunk khi đọc file
+MERGE_MEMORY_MB = float(os.getenv('MERGE_MEMORY_MB', '1024'))
+MERGE_CHUNK_ROWS = int(os.getenv('MERGE_CHUNK_ROWS', '50000'))
+# Số process đọc/khử trùng lặp song song (0 = bằng số core của máy)
+MERGE_WORKERS = int(os.getenv('MERGE_WORKERS', '0'))
+
+# DataFrame trong bộ nhớ lớn hơn dữ liệu CSV khoảng chừng này lần
+MEMORY_EXPANSION = 4
+# Parquet nén nên dữ liệu thật lớn hơn dung lượng file khoảng chừng này lần
+PARQUET_EXPANSION = 4
+
+DEDUP_COLUMNS = ['input', 'output']
+
+
+def default_workers():
+    """Số process đọc file song song (MERGE_WORKERS=0 nghĩa là bằng số core)"""
+    return MERGE_WORKERS or os.cpu_count() or 1
+
+
+def plan_partitions(files, memory_mb=None):
+    """Số phân vùng để mỗi phân vùng vừa trong trần bộ nhớ của một process
+
+    Không phụ thuộc số worker: máy nhiều core không sinh thêm phân vùng
+    (và file tạm); bộ nhớ đỉnh của lượt khử trùng lặp là trần này nhân số
+    worker chạy cùng lúc.
+    """
+    memory_bytes = (memory_mb or MERGE_MEMORY_MB) * 1024 * 1024
+    data_bytes = sum(os.path.getsize(part) * PARQUET_EXPANSION for path in files if is_parquet(path)
+                     for part in parquet_parts(path))
+    data_bytes += sum(os.path.getsize(path) for path in files if not is_parquet(path) and os.path.exists(path))
+    return max(1, math.ceil(data_bytes * MEMORY_EXPANSION / memory_bytes))
+
+
+def _normalize_chunk(chunk):
+    """Đưa chunk về đúng các cột FIELDNAMES dạng chuỗi (file cũ không có topic thì để rỗng)
+
+    Cùng một nội dung phải luôn có cùng kiểu dữ liệu trước khi hash, nếu
+    không "123" ở file này và 123 ở file khác rơi vào hai phân vùng khác nhau.
+    """
+    chunk = chunk.reindex(columns=FIELDNAMES)
+    for column in FIELDNAMES:
+        chunk[column] = chunk[column].astype(object).where(chunk[column].notna(), '').astype(str)
+    return chunk
+
+
+def _map_in_order(func, tasks, workers):
+    """Chạy func(*task) cho từng task, trả kết quả dần theo đúng thứ tự tasks
+
+    Với workers > 1 các task chạy trong process pool (mỗi file một core),
+    kết quả vẫn được trả về theo thứ tự file để giữ quy tắc "giữ dòng đầu tiên".
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield func(*task)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+        yield from pool.map(func, *zip(*tasks))
+
+
+def _spill_path(workdir, partition, index):
+    return os.path.join(workdir, f'part_{partition}_{index}.csv')
+
+
+def _spill_file(index, path, partitions, workdir, chunksize):
+    """Worker lượt 1: đọc, chuẩn hóa một file và chia dòng vào các phân vùng
+
+    Mỗi file có file tạm riêng cho từng phân vùng nên các worker không ghi chung file.
+    Trả về (số dòng, lỗi hoặc None); file lỗi không để lại dữ liệu tạm.
+    """
+    rows = 0
+    try:
+        for chunk in iter_dataset(path, FIELDNAMES, chunksize, as_text=True):
+            chunk = _normalize_chunk(chunk)
+            chunk.insert(0, '_row', np.arange(rows, rows + len(chunk)))
+            rows += len(chunk)
+            hashes = pd.util.hash_pandas_object(chunk[DEDUP_COLUMNS], index=False).to_numpy()
+            for p, part in chunk.groupby(hashes % np.uint64(partitions), sort=False):
+                spill_path = _spill_path(workdir, p, index)
+                part.to_csv(spill_path, mode='a', index=False, header=not os.path.exists(spill_path))
+    except Exception as e:
+        for p in range(partitions):
+            if os.path.exists(_spill_path(workdir, p, index)):
+                os.remove(_spill_path(workdir, p, index))
+        return rows, e
+    return rows, None
+
+
+def _dedupe_partition(partition, offsets, workdir, keep_path, total_rows):
+    """Worker lượt 2: khử trùng lặp một phân vùng, đánh dấu dòng giữ lại trong keep_path
+
+    offsets[i] là số thứ tự toàn cục của dòng đầu file i (None nếu file lỗi).
+    Các phân vùng rời nhau nên nhiều worker ghi chung mảng keep (memmap) an toàn.
+    """
+    parts = []
+    for index, offset in enumerate(offsets):
+        spill_path = _spill_path(workdir, partition, index)
+        if offset is None or not os.path.exists(spill_path):
+            continue
+        part = pd.read_csv(spill_path, keep_default_na=False,
+                           dtype={'_row': np.int64, 'input': str, 'output': str, 'topic': str})
+        part['_row'] += offset
+        parts.append(part)
+        os.remove(spill_path)
+    if not parts:
+        return 0
+    merged = pd.concat(parts, ignore_index=True).drop_duplicates(subset=DEDUP_COLUMNS, keep='first')
+    keep = np.memmap(keep_path, dtype=bool, mode='r+', shape=(total_rows,))
+    keep[merged['_row'].to_numpy()] = True
+    keep.flush()
+    return len(merged)
+
+
+def _write_kept(path, offset, rows, keep_path, total_rows, output_path, chunksize):
+    """Worker lượt 3: ghi các dòng được giữ của một file ra file tạm riêng (CSV không header hoặc Parquet)
+
+    Chỉ đọc rows dòng đầu (số dòng đọc được ở lượt 1): dòng được ghi thêm vào
+    file trong lúc gộp (vd. file round của marathon đang chạy) không có cờ
+    giữ/bỏ và để lại cho lần gộp sau.
+    """
+    keep = np.memmap(keep_path, dtype=bool, mode='r', shape=(total_rows,))
+    parquet_writer = ParquetDatasetWriter(output_path) if is_parquet(output_path) else None
+    if not parquet_writer:
+        open(output_path, 'w', encoding='utf-8').close()
+    end = offset + rows
+    for chunk in iter_dataset(path, FIELDNAMES, chunksize, as_text=True):
+        chunk = chunk.iloc[:end - offset]
+        mask = np.asarray(keep[offset:offset + len(chunk)])
+        offset += len(chunk)
+        chunk = _normalize_chunk(chunk)[mask]
+        if parquet_writer:
+            parquet_writer.write_frame(chunk)
+        else:
+            chunk.to_csv(output_path, mode='a', header=False, index=False)
+        if offset >= end:
+            break
+    if parquet_writer:
+        parquet_writer.close()
+    return output_path
+
+
+def merge_datasets(files, output_path, memory_mb=None, chunksize=None, on_file=None, workers=None):
+    """Gộp các file CSV/Parquet vào output_path, bỏ dòng trùng (input, output)
+
+    Kết quả giống pd.concat + drop_duplicates(keep='first') nhưng bộ nhớ
+    không phụ thuộc tổng dung lượng dữ liệu:
+    1. Mỗi file được đọc theo chunk, chuẩn hóa và ghi vào file tạm của phân vùng
+       hash(input, output) % số phân vùng.
+    2. Khử trùng lặp từng phân vùng (các dòng giống nhau luôn cùng phân vùng),
+       đánh dấu dòng giữ lại trong một mảng bool 1 byte/dòng trên đĩa.
+    3. Đọc lại từng file (đến số dòng đã đọc ở lượt 1), lọc các dòng được giữ
+       rồi nối kết quả theo thứ tự file.
+
+    Cả ba lượt chạy song song trên workers process (mặc định MERGE_WORKERS).
+    on_file(path, rows, error): callback sau khi đọc xong mỗi file, gọi theo thứ tự files.
+    Trả về dict thống kê.
+    """
+    chunksize = chunksize or MERGE_CHUNK_ROWS
+    workers = max(1, workers or default_workers())
+    partitions = plan_partitions(files, memory_mb)
+    workdir = tempfile.mkdtemp(prefix='stream_merge_')
+    stats = {'files': 0, 'rows': 0, 'unique': 0, 'duplicates': 0, 'partitions': partitions,
+             'workers': workers, 'failed': []}
+    try:
+        # Lượt 1: đọc và chia dòng vào các phân vùng, kết quả về theo thứ tự file
+        offsets = []
+        file_rows = []
+        total_rows = 0
+        tasks = [(index, path, partitions, workdir, chunksize) for index, path in enumerate(files)]
+        for path, (rows, error) in zip(files, _map_in_order(_spill_file, tasks, workers)):
+            if error:
+                offsets.append(None)
+                stats['failed'].append(path)
+            else:
+                offsets.append(total_rows)
+                total_rows += rows
+            file_rows.append(rows)
+            if on_file:
+                on_file(path, rows, error)
+
+        merged_files = [(path, offset, rows) for path, offset, rows in zip(files, offsets, file_rows)
+                        if offset is not None]
+        # Không đọc được file nào thì không tạo file kết quả
+        if not merged_files:
+            return stats
+
+        # Lượt 2: khử trùng lặp song song từng phân vùng
+        keep_path = os.path.join(workdir, 'keep.bin')
+        keep_size = max(total_rows, 1)
+        np.memmap(keep_path, dtype=bool, mode='w+', shape=(keep_size,)).flush()
+        tasks = [(p, offsets, workdir, keep_path, keep_size) for p in range(partitions)]
+        unique = sum(_map_in_order(_dedupe_partition, tasks, workers))
+
+        # Lượt 3: lọc song song từng file, nối kết quả theo đúng thứ tự ban đầu
+        extension = '.parquet' if is_parquet(output_path) else '.csv'
+        tasks = [(path, offset, rows, keep_path, keep_size, os.path.join(workdir, f'kept_{i}{extension}'),
+                  chunksize) for i, (path, offset, rows) in enumerate(merged_files)]
+        temp_output = os.path.join(workdir, 'merged' + extension)
+        if is_parquet(output_path):
+            with ParquetDatasetWriter(temp_output) as writer:
+                for kept_path in _map_in_order(_write_kept, tasks, workers):
+                    writer.append_file(kept_path)
+                    os.remove(kept_path)
+        else:
+            pd.DataFrame(columns=FIELDNAMES).to_csv(temp_output, index=False)
+            with open(temp_output, 'ab') as output:
+                for kept_path in _map_in_order(_write_kept, tasks, workers):
+                    with open(kept_path, 'rb') as kept:
+                        shutil.copyfileobj(kept, output)
+                    os.remove(kept_path)
+        replace_dataset(temp_output, output_path)
+
+        stats['files'] = len(merged_files)
+        stats['rows'] = total_rows
+        stats['unique'] = unique
+        stats['duplicates'] = total_rows - unique
+        return stats
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    """Gộp các file dataset từ dòng lệnh"""
+    parser = argparse.ArgumentParser(description="Gộp nhiều dataset CSV/Parquet lớn, bỏ dòng trùng lặp")
+    parser.add_argument('files', nargs='+', help='Các file CSV/Parquet cần gộp (theo thứ tự ưu tiên giữ lại)')
+    parser.add_argument('-o', '--output', required=True, help='File kết quả (.csv hoặc .parquet)')
+    parser.add_argument('--memory-mb', type=float, default=None,
+                        help='Trần bộ nhớ (MB) của mỗi process khử trùng lặp (mặc định MERGE_MEMORY_MB)')
+    parser.add_argument('--chunksize', type=int, default=None, help='Số dòng mỗi chunk khi đọc file')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Số process song song (mặc định MERGE_WORKERS hoặc số core)')
+    args = parser.parse_args()
+
+    def report(path, rows, error):
+        if error:
+            print(f"   ❌ {path}: {error}")
+        else:
+            print(f"   ✅ {path}: {rows} dòng")
+
+    try:
+        stats = merge_datasets(args.files, args.output, args.memory_mb, args.chunksize,
+                               on_file=report, workers=args.workers)
+    except (ImportError, OSError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"📊 {stats['rows']} dòng → {stats['unique']} dòng duy nhất "
+          f"(bỏ {stats['duplicates']} dòng trùng, {stats['partitions']} phân vùng, {stats['workers']} process)")
+    print(f"📁 Đã lưu: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Topic Scheduler - Lập lịch chủ đề theo hiệu suất sinh cặp mới
+Theo dõi số cặp duy nhất thu được trên mỗi request và trên mỗi 1.000 token của
+từng chủ đề, dồn request cho chủ đề còn thiếu chỉ tiêu và có hiệu suất cao,
+ngừng chi tiêu cho chủ đề đã bão hòa (phần lớn cặp sinh ra bị loại vì trùng)
+"""
+import os
+import random
+from dotenv import load_dotenv
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+# Chỉ tiêu số cặp của mỗi chủ đề (0 = không giới hạn, chỉ cân bằng giữa các chủ đề)
+TOPIC_QUOTA = int(os.getenv('TOPIC_QUOTA', '0'))
+# Chỉ tiêu riêng từng chủ đề, vd. "1:5000,7:2000" (ghi đè TOPIC_QUOTA)
+TOPIC_QUOTAS = os.getenv('TOPIC_QUOTAS', '')
+# Chủ đề bị coi là bão hòa khi tỉ lệ trùng gần đây đạt ngưỡng này
+SATURATION_DUPLICATE_RATE = float(os.getenv('SATURATION_DUPLICATE_RATE', '0.9'))
+# Số request tối thiểu trước khi đánh giá hiệu suất / bão hòa của một chủ đề
+SCHEDULER_MIN_REQUESTS = int(os.getenv('SCHEDULER_MIN_REQUESTS', '3'))
+# Chủ đề bão hòa được thử lại bằng một request nhỏ sau mỗi N lượt (0 = bỏ hẳn)
+SATURATION_PROBE_ROUNDS = int(os.getenv('SATURATION_PROBE_ROUNDS', '10'))
+
+# Trọng số của quan sát mới trong trung bình trượt (EWMA)
+SMOOTHING = 0.3
+# Hiệu suất tương đối tối thiểu: chủ đề kém vẫn được một phần nhỏ để tiếp tục đo
+MIN_EFFICIENCY = 0.1
+# Số cặp tối thiểu cho một chủ đề trong một lượt (cũng là cỡ request thử lại)
+MIN_PAIRS_PER_TOPIC = 5
+
+STATS_FIELDS = ('requests', 'pairs_delivered', 'duplicates', 'input_tokens')
+
+
+def parse_quotas(spec):
+    """Đọc chỉ tiêu dạng "1:5000,7:2000" thành {'1': 5000, '7': 2000}"""
+    quotas = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        topic_key, _, value = item.partition(':')
+        try:
+            quotas[topic_key.strip()] = int(value)
+        except ValueError:
+            raise ValueError(f"❌ Chỉ tiêu không hợp lệ: {item} (dạng chủ_đề:số_cặp)")
+    return quotas
+
+
+class TopicScheduler:
+    """Phân bổ số cặp cho từng chủ đề dựa trên chỉ tiêu và hiệu suất đo được
+
+    Hiệu suất của mỗi chủ đề là trung bình trượt của số cặp duy nhất trên mỗi
+    request và trên mỗi 1.000 token đầu vào, cập nhật qua observe() sau mỗi
+    lần sinh xong (đọc phần chênh lệch của generator.topic_stats). Chủ đề
+    chưa đủ SCHEDULER_MIN_REQUESTS request được coi là hiệu suất tốt nhất để
+    luôn được đo thử.
+    """
+
+    def __init__(self, generator, quotas=None, default_quota=None, saturation_rate=None,
+                 min_requests=None, probe_rounds=None, state=None):
+        """Khởi tạo scheduler cho các chủ đề của generator
+
+        quotas: dict {khóa chủ đề: chỉ tiêu} (mặc định đọc TOPIC_QUOTAS)
+        default_quota: chỉ tiêu cho chủ đề không có trong quotas (mặc định TOPIC_QUOTA)
+        state: trạng thái từ to_dict() (vd. lưu trong checkpoint marathon)
+        """
+        self.generator = generator
+        self.quotas = parse_quotas(TOPIC_QUOTAS) if quotas is None else dict(quotas)
+        self.default_quota = TOPIC_QUOTA if default_quota is None else default_quota
+        self.saturation_rate = saturation_rate or SATURATION_DUPLICATE_RATE
+        self.min_requests = SCHEDULER_MIN_REQUESTS if min_requests is None else min_requests
+        self.probe_rounds = SATURATION_PROBE_ROUNDS if probe_rounds is None else probe_rounds
+        self.topics = {}
+        self._picks = 0
+
+        saved = (state or {}).get('topics', {})
+        self.round = (state or {}).get('round', 0)
+        for topic_key in generator.topics:
+            self.topics[topic_key] = saved.get(topic_key) or self._initial(topic_key)
+            self.topics[topic_key]['seen'] = self._snapshot(topic_key)
+
+    def _snapshot(self, topic_key):
+        stats = self.generator._topic_stats(topic_key)
+        return {field: stats.get(field, 0) for field in STATS_FIELDS}
+
+    def _initial(self, topic_key):
+        """Ước lượng ban đầu từ số liệu tích lũy (vd. sau khi khôi phục topic_stats)"""
+        stats = self.generator._topic_stats(topic_key)
+        delivered = stats['pairs_delivered']
+        return {
+            'observed': stats['requests'],
+            'per_request': delivered / stats['requests'] if stats['requests'] else None,
+            'per_1k_tokens': delivered * 1000 / stats['input_tokens'] if stats.get('input_tokens') else None,
+            'duplicate_rate': self.generator.duplicate_rate(topic_key),
+            'saturated_at': None,
+        }
+
+    def quota(self, topic_key):
+        """Chỉ tiêu của chủ đề (0 = không giới hạn)"""
+        return self.quotas.get(topic_key, self.default_quota)
+
+    def delivered(self, topic_key):
+        return self.generator._topic_stats(topic_key)['pairs_delivered']
+
+    def is_filled(self, topic_key):
+        quota = self.quota(topic_key)
+        return bool(quota) and self.delivered(topic_key) >= quota
+
+    def is_saturated(self, topic_key):
+        return self.topics[topic_key]['saturated_at'] is not None
+
+    def observe(self, topic_key):
+        """Cập nhật hiệu suất của chủ đề từ phần topic_stats tăng thêm kể từ lần trước"""
+        topic = self.topics[topic_key]
+        current = self._snapshot(topic_key)
+        delta = {field: current[field] - topic['seen'][field] for field in STATS_FIELDS}
+        topic['seen'] = current
+        if not delta['requests']:
+            return
+
+        def smooth(old, value):
+            return value if old is None else old + SMOOTHING * (value - old)
+
+        delivered = delta['pairs_delivered']
+        topic['observed'] += delta['requests']
+        topic['per_request'] = smooth(topic['per_request'], delivered / delta['requests'])
+        if delta['input_tokens']:
+            topic['per_1k_tokens'] = smooth(topic['per_1k_tokens'], delivered * 1000 / delta['input_tokens'])
+        seen = delivered + delta['duplicates']
+        if seen:
+            topic['duplicate_rate'] = smooth(topic['duplicate_rate'], delta['duplicates'] / seen)
+
+        if topic['observed'] < self.min_requests:
+            return
+        if topic['duplicate_rate'] >= self.saturation_rate:
+            if topic['saturated_at'] is None:
+                print(f"🧊 Chủ đề {topic_key} đã bão hòa (trùng {topic['duplicate_rate']:.0%}), tạm ngừng sinh")
+            topic['saturated_at'] = self.round
+        elif topic['saturated_at'] is not None:
+            print(f"🌱 Chủ đề {topic_key} sinh được cặp mới trở lại (trùng {topic['duplicate_rate']:.0%})")
+            topic['saturated_at'] = None
+
+    def _efficiency(self, topic_keys):
+        """Hiệu suất tương đối (0..1] so với chủ đề tốt nhất, ưu tiên số cặp trên token"""
+        metric = 'per_1k_tokens' if all(self.topics[key]['per_1k_tokens'] is not None
+                                        for key in topic_keys if self.topics[key]['observed']) else 'per_request'
+        measured = {key: self.topics[key][metric] for key in topic_keys
+                    if self.topics[key]['observed'] >= self.min_requests and self.topics[key][metric] is not None}
+        best = max(measured.values(), default=0)
+        return {key: max(MIN_EFFICIENCY, measured[key] / best) if key in measured and best else 1.0
+                for key in topic_keys}
+
+    def _need(self, topic_keys, batch_size):
+        """Mức thiếu (0..1]: theo chỉ tiêu, hoặc so với chủ đề nhiều cặp nhất nếu không có chỉ tiêu"""
+        most = max((self.delivered(key) for key in topic_keys), default=0)
+        need = {}
+        for key in topic_keys:
+            quota = self.quota(key)
+            target = quota if quota else most + batch_size
+            need[key] = 1 - self.delivered(key) / target
+        return need
+
+    def _probes(self):
+        """Chủ đề bão hòa đã đến hạn thử lại"""
+        if not self.probe_rounds:
+            return []
+        return [key for key, topic in self.topics.items()
+                if topic['saturated_at'] is not None and not self.is_filled(key)
+                and self.round - topic['saturated_at'] >= self.probe_rounds]
+
+    def active_topics(self):
+        return [key for key in self.topics if not self.is_filled(key) and not self.is_saturated(key)]
+
+    def scores(self, batch_size=30):
+        """Điểm ưu tiên của các chủ đề đang sinh: mức thiếu × hiệu suất"""
+        active = self.active_topics()
+        need = self._need(active, batch_size)
+        efficiency = self._efficiency(active)
+        return {key: need[key] * efficiency[key] for key in active}
+
+    def plan_round(self, total_pairs, batch_size=30):
+        """Phân bổ khoảng total_pairs cặp cho một lượt, trả về {khóa chủ đề: số cặp}
+
+        Chủ đề xếp theo điểm ưu tiên giảm dần (request được gửi theo thứ tự
+        này); mỗi chủ đề nhận từ MIN_PAIRS_PER_TOPIC đến 2 × batch_size cặp,
+        không vượt phần còn thiếu của chỉ tiêu. Chủ đề bão hòa chỉ nhận một
+        request thử nhỏ mỗi SATURATION_PROBE_ROUNDS lượt. Trả về dict rỗng
+        khi mọi chủ đề đã đủ chỉ tiêu hoặc bão hòa (không nên sinh tiếp).
+        """
+        self.round += 1
+        scores = self.scores(batch_size)
+        probes = self._probes()
+        if not scores:
+            # Không còn chủ đề nào đáng sinh: dừng hẳn thay vì chỉ chạy các request thử
+            return {}
+
+        total_score = sum(scores.values())
+        plan = {}
+        for key in sorted(scores, key=lambda key: (-scores[key], int(key) if key.isdigit() else key)):
+            count = round(total_pairs * scores[key] / total_score)
+            count = min(max(count, MIN_PAIRS_PER_TOPIC), 2 * batch_size)
+            if self.quota(key):
+                count = min(count, self.quota(key) - self.delivered(key))
+            plan[key] = count
+        for key in probes:
+            plan[key] = MIN_PAIRS_PER_TOPIC
+            self.topics[key]['saturated_at'] = self.round
+        return plan
+
+    def pick(self):
+        """Chọn chủ đề cho một request lẻ (generate_dataset), ngẫu nhiên theo điểm ưu tiên
+
+        Trả về None khi mọi chủ đề đã đủ chỉ tiêu hoặc bão hòa.
+        """
+        self._picks += 1
+        if self._picks % len(self.topics) == 0:
+            self.round += 1
+        probes = self._probes()
+        if probes:
+            self.topics[probes[0]]['saturated_at'] = self.round
+            return probes[0]
+        scores = self.scores()
+        if not scores:
+            return None
+        keys = list(scores)
+        return random.choices(keys, weights=[scores[key] for key in keys])[0]
+
+    def describe(self):
+        active = len(self.active_topics())
+        saturated = sum(1 for key in self.topics if self.is_saturated(key))
+        filled = sum(1 for key in self.topics if self.is_filled(key))
+        return f"{active} chủ đề đang sinh, {saturated} bão hòa, {filled} đủ chỉ tiêu"
+
+    def print_table(self):
+        """In hiệu suất từng chủ đề: cặp/request, cặp/1k token, tỉ lệ trùng, trạng thái"""
+        print("🎯 Lịch chủ đề theo hiệu suất:")
+        print("   Chủ đề |   Đã có / Chỉ tiêu | Cặp/request | Cặp/1k token | Trùng | Trạng thái")
+        for key in sorted(self.topics, key=lambda key: int(key) if key.isdigit() else 0):
+            topic = self.topics[key]
+            quota = self.quota(key)
+            status = 'đủ chỉ tiêu' if self.is_filled(key) else 'bão hòa' if self.is_saturated(key) else 'đang sinh'
+            per_request = f"{topic['per_request']:.1f}" if topic['per_request'] is not None else '-'
+            per_1k = f"{topic['per_1k_tokens']:.1f}" if topic['per_1k_tokens'] is not None else '-'
+            print(f"   {key:>6} | {self.delivered(key):>8} / {quota or '∞':>7} | {per_request:>11} | "
+                  f"{per_1k:>12} | {topic['duplicate_rate']:>5.0%} | {status}")
+
+    def to_dict(self):
+        """Trạng thái để lưu checkpoint (không gồm ảnh chụp topic_stats)"""
+        return {'round': self.round,
+                'topics': {key: {field: value for field, value in topic.items() if field != 'seen'}
+                           for key, topic in self.topics.items()}}
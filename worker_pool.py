@@ -0,0 +1,571 @@
+"""
+Worker Pool - Sinh dữ liệu bằng nhiều tiến trình, mỗi tiến trình một API key và quota riêng
+Coordinator phát các đơn vị việc (chủ đề, số cặp) từ một hàng đợi SQLite bền vững,
+nhận các cặp Q&A stream về và ghi qua một writer duy nhất; việc của worker bị chết,
+bị treo hoặc bị giới hạn quota được giao lại cho worker khác
+"""
+import os
+import sys
+import time
+import queue
+import signal
+import asyncio
+import sqlite3
+import argparse
+import multiprocessing
+from datetime import datetime
+from dotenv import load_dotenv
+from dedup_index import DedupIndex
+from marathon_journal import MarathonJournal
+from dataset_io import dataset_extension
+from metrics import MetricsRecorder
+
+# Tải cấu hình từ file .env
+load_dotenv()
+
+DEFAULT_QUEUE_PATH = os.getenv('POOL_QUEUE_PATH', os.path.join('.qa_cache', 'work_queue.sqlite3'))
+# Số worker khi dùng backend giả lập (0 = số nhân CPU); với Gemini là số API key
+POOL_WORKERS = int(os.getenv('POOL_WORKERS', '0'))
+# Số đơn vị việc mỗi worker chạy đồng thời (trên event loop của worker)
+WORKER_UNITS_IN_FLIGHT = int(os.getenv('WORKER_UNITS_IN_FLIGHT', '2'))
+# Đơn vị không có cặp mới trong N giây thì bị thu hồi và giao lại
+UNIT_LEASE_SECONDS = float(os.getenv('UNIT_LEASE_SECONDS', '300'))
+UNIT_MAX_ATTEMPTS = int(os.getenv('UNIT_MAX_ATTEMPTS', '5'))
+# Worker bị giới hạn quota tạm nghỉ N giây (gấp đôi sau mỗi lần liên tiếp)
+WORKER_COOLDOWN_SECONDS = float(os.getenv('WORKER_COOLDOWN_SECONDS', '30'))
+WORKER_MAX_RESTARTS = int(os.getenv('WORKER_MAX_RESTARTS', '3'))
+# Ghi dữ liệu, chỉ mục dedup và tiến độ hàng đợi xuống đĩa sau mỗi N giây
+COMMIT_SECONDS = 1.0
+
+
+def api_keys():
+    """Các API key trong GOOGLE_API_KEYS (phân tách bằng dấu phẩy), hoặc GOOGLE_API_KEY"""
+    keys = [key.strip() for key in os.getenv('GOOGLE_API_KEYS', '').split(',') if key.strip()]
+    if not keys and os.getenv('GOOGLE_API_KEY'):
+        keys = [os.getenv('GOOGLE_API_KEY')]
+    return keys
+
+
+def backend_specs(stub=False, workers=None):
+    """Danh sách cấu hình backend cho từng worker: ('gemini', key) hoặc ('stub', số thứ tự)"""
+    if stub:
+        count = workers or POOL_WORKERS or os.cpu_count() or 1
+        return [('stub', index) for index in range(count)]
+    keys = api_keys()
+    if not keys:
+        raise ValueError("❌ Không tìm thấy GOOGLE_API_KEYS / GOOGLE_API_KEY trong file .env")
+    return [('gemini', key) for key in keys[:workers or len(keys)]]
+
+
+def create_worker_backend(spec):
+    """Tạo backend trong tiến trình worker theo cấu hình từ backend_specs"""
+    from llm_backends import GeminiBackend, StubBackend
+
+    kind, value = spec
+    if kind == 'gemini':
+        return GeminiBackend(api_key=value)
+    backend = StubBackend.from_env()
+    if os.getenv('STUB_SEED'):
+        # Mỗi worker một chuỗi ngẫu nhiên riêng nhưng vẫn tái lập được
+        backend.random.seed(int(os.getenv('STUB_SEED')) + value)
+    return backend
+
+
+class WorkQueue:
+    def __init__(self, path=None):
+        """Hàng đợi đơn vị việc trong SQLite, giữ nguyên qua các lần chạy
+
+        Mỗi đơn vị là (chủ đề, số cặp) với trạng thái pending / leased / done /
+        failed và số cặp đã nhận; chỉ coordinator đọc ghi file này.
+        """
+        self.path = path or DEFAULT_QUEUE_PATH
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS units (
+                id INTEGER PRIMARY KEY,
+                batch INTEGER NOT NULL,
+                topic TEXT NOT NULL,
+                num_pairs INTEGER NOT NULL,
+                delivered INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_units_status ON units(status, id)")
+        self.conn.commit()
+        # Số cặp đã nhận chưa ghi vào bảng (chỉ ghi ở commit(), sau khi dữ liệu đã xuống đĩa)
+        self._delivered = {}
+
+    def recover(self):
+        """Đưa các đơn vị đang giao dở (lần chạy trước bị dừng) về hàng chờ, trả về số đơn vị"""
+        cursor = self.conn.execute("UPDATE units SET status = 'pending', worker = NULL, updated = ? "
+                                   "WHERE status = 'leased'", (time.time(),))
+        self.conn.commit()
+        return cursor.rowcount
+
+    def enqueue(self, topic_counts):
+        """Thêm một lô đơn vị {chủ đề: số cặp}, trả về số thứ tự lô"""
+        now = time.time()
+        batch = self.conn.execute("SELECT COALESCE(MAX(batch), 0) + 1 FROM units").fetchone()[0]
+        self.conn.executemany(
+            "INSERT INTO units (batch, topic, num_pairs, created, updated) VALUES (?, ?, ?, ?, ?)",
+            [(batch, topic_key, num_pairs, now, now) for topic_key, num_pairs in topic_counts.items()])
+        self.conn.commit()
+        return batch
+
+    def lease(self, worker):
+        """Giao đơn vị chờ lâu nhất cho worker, trả về dict hoặc None nếu hết việc"""
+        row = self.conn.execute("SELECT * FROM units WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+        if row is None:
+            return None
+        self.conn.execute("UPDATE units SET status = 'leased', worker = ?, updated = ? WHERE id = ?",
+                          (worker, time.time(), row['id']))
+        self.conn.commit()
+        return self.get(row['id'])
+
+    def get(self, unit_id):
+        row = self.conn.execute("SELECT * FROM units WHERE id = ?", (unit_id,)).fetchone()
+        if row is None:
+            return None
+        unit = dict(row)
+        unit['delivered'] += self._delivered.get(unit_id, 0)
+        return unit
+
+    def add_pairs(self, unit_id, count=1):
+        """Cộng số cặp đã nhận (được ghi vào bảng ở lần commit() kế tiếp)"""
+        self._delivered[unit_id] = self._delivered.get(unit_id, 0) + count
+
+    def complete(self, unit_id):
+        self.conn.execute("UPDATE units SET status = 'done', worker = NULL, error = NULL, updated = ? "
+                          "WHERE id = ?", (time.time(), unit_id))
+        self.conn.commit()
+
+    def release(self, unit_id, error, max_attempts=None, failed=True):
+        """Trả đơn vị về hàng chờ để giao lại; quá max_attempts lần thì đánh dấu 'failed'
+
+        failed=False khi lần giao vẫn có tiến triển (vd. chỉ thiếu do cặp trùng
+        bị loại): không tính vào số lần thử. Trả về trạng thái mới.
+        """
+        max_attempts = max_attempts or UNIT_MAX_ATTEMPTS
+        unit = self.get(unit_id)
+        attempts = unit['attempts'] + 1 if failed else unit['attempts']
+        status = 'failed' if failed and attempts >= max_attempts else 'pending'
+        self.conn.execute("UPDATE units SET status = ?, worker = NULL, attempts = ?, error = ?, "
+                          "updated = ? WHERE id = ?", (status, attempts, str(error)[:500], time.time(), unit_id))
+        self.conn.commit()
+        return status
+
+    def active(self):
+        """Số đơn vị còn chờ hoặc đang được giao"""
+        return self.conn.execute("SELECT COUNT(*) FROM units WHERE status IN ('pending', 'leased')").fetchone()[0]
+
+    def counts(self):
+        """{trạng thái: số đơn vị}"""
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM units GROUP BY status").fetchall())
+
+    def commit(self):
+        """Ghi số cặp đã nhận của các đơn vị; gọi sau khi dữ liệu tương ứng đã được fsync"""
+        self.conn.executemany("UPDATE units SET delivered = delivered + ? WHERE id = ?",
+                              [(count, unit_id) for unit_id, count in self._delivered.items()])
+        self._delivered = {}
+        self.conn.commit()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def describe(self):
+        """Mô tả ngắn để in ra màn hình"""
+        counts = self.counts()
+        return " | ".join(f"{status}: {counts.get(status, 0)}" for status in ('pending', 'leased', 'done', 'failed'))
+
+
+async def _run_unit(worker_id, generator, results, unit_id, lease, topic_key, num_pairs):
+    """Sinh một đơn vị việc, gửi từng cặp về coordinator rồi báo kết quả
+
+    Mọi message mang mã lần giao (lease) để coordinator bỏ các cặp của lần
+    giao đã bị thu hồi.
+    """
+    quota_errors = generator.rate_limiter.quota_errors
+    sent = 0
+    error = None
+
+    def on_pair(qa):
+        nonlocal sent
+        sent += 1
+        results.put(('pair', worker_id, unit_id, lease, qa))
+
+    try:
+        await generator.generate_qa_pairs_stream_async(topic_key, num_pairs, on_pair)
+    except Exception as e:
+        error = str(e)
+    throttled = generator.rate_limiter.quota_errors > quota_errors
+    results.put(('done', worker_id, unit_id, lease, sent, throttled, error))
+
+
+async def _worker_loop(worker_id, generator, inbox, results):
+    """Nhận đơn vị việc từ inbox và chạy đồng thời trên event loop của worker; None để dừng"""
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    while True:
+        message = await loop.run_in_executor(None, inbox.get)
+        if message is None:
+            break
+        task = asyncio.ensure_future(_run_unit(worker_id, generator, results, *message))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+def worker_main(worker_id, spec, inbox, results):
+    """Điểm vào của tiến trình worker: một backend, một rate limiter, một event loop
+
+    Worker không tự chống trùng lặp và không dùng response cache: coordinator
+    là nơi duy nhất ghi dữ liệu và chỉ mục dedup.
+    """
+    # Ctrl+C do coordinator xử lý (dừng phát việc, chờ các đơn vị đang chạy)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from generator_google import QAGenerator
+
+    try:
+        backend = create_worker_backend(spec)
+        # Mỗi worker một cặp file metrics riêng (worker_<id>_events.jsonl, worker_<id>.prom)
+        metrics = MetricsRecorder.from_env(f"worker_{worker_id}", labels={
+            'backend': backend.name, 'model': backend.model_name, 'worker': worker_id})
+        generator = QAGenerator(backend=backend, cache=False, fresh=True, dedup=False, metrics=metrics or False)
+    except Exception as e:
+        results.put(('fatal', worker_id, str(e)))
+        return
+    try:
+        asyncio.run(_worker_loop(worker_id, generator, inbox, results))
+    finally:
+        if generator.metrics is not None:
+            generator.metrics.close()
+
+
+class _Worker:
+    """Trạng thái của một tiến trình worker phía coordinator"""
+
+    def __init__(self, worker_id, spec):
+        self.id = worker_id
+        self.spec = spec
+        self.name = f"worker-{worker_id}"
+        self.process = None
+        self.inbox = None
+        self.units = {}  # unit_id -> thời điểm nhận cặp gần nhất
+        self.leases = {}  # unit_id -> mã lần giao hiện tại
+        self.requested = {}  # unit_id -> số cặp đã yêu cầu worker sinh trong lần giao này
+        self.cooldown_until = 0.0
+        self.throttles = 0
+        self.restarts = 0
+        self.pairs = 0
+        self.fatal = None
+        self.dead = False
+
+
+class WorkerPool:
+    def __init__(self, specs, work_queue=None, units_in_flight=None, dedup=None, lease_seconds=None,
+                 cooldown_seconds=None, max_attempts=None):
+        """Coordinator điều phối nhiều tiến trình worker
+
+        specs: cấu hình backend của từng worker (xem backend_specs), mỗi worker
+        một API key nên có quota và rate limiter riêng.
+        work_queue: WorkQueue (mặc định POOL_QUEUE_PATH); việc còn dở của lần
+        chạy trước được làm tiếp.
+        dedup: DedupIndex dùng chung (mặc định theo DEDUP_INDEX, False để tắt).
+        """
+        self.workers = [_Worker(index, spec) for index, spec in enumerate(specs)]
+        self.queue = work_queue or WorkQueue()
+        self.units_in_flight = max(1, units_in_flight or WORKER_UNITS_IN_FLIGHT)
+        if dedup is None:
+            dedup = DedupIndex.from_env()
+        self.dedup = dedup if dedup is not False else None
+        self.lease_seconds = lease_seconds or UNIT_LEASE_SECONDS
+        self.cooldown_seconds = cooldown_seconds or WORKER_COOLDOWN_SECONDS
+        self.max_attempts = max_attempts or UNIT_MAX_ATTEMPTS
+        self.context = multiprocessing.get_context()
+        self.results = self.context.Queue()
+        self.running = True
+        self.force_stop = False
+        self.total_generated = 0
+        self.duplicates = 0
+        self.stale_pairs = 0
+        self.reassigned = 0
+        self._next_lease = 0
+
+        self.session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.rounds_dir = f"marathon_rounds_{self.session_id}"
+        self.final_dir = "marathon_finals"
+        os.makedirs(self.final_dir, exist_ok=True)
+        self.journal = MarathonJournal(self.rounds_dir)
+
+    def signal_handler(self, signum, frame):
+        """Ctrl+C lần đầu: ngừng phát việc và chờ; lần hai: dừng ngay"""
+        if not self.running:
+            print("\n⛔ Dừng ngay, các đơn vị dở dang sẽ được làm tiếp ở lần chạy sau")
+            self.force_stop = True
+            return
+        print("\n\n🛑 Nhận tín hiệu dừng... ⏳ Đang chờ các worker hoàn tất việc đang làm (Ctrl+C lần nữa để dừng ngay)")
+        self.running = False
+
+    def _start(self, worker):
+        worker.inbox = self.context.Queue()
+        worker.process = self.context.Process(target=worker_main, name=worker.name, daemon=True,
+                                              args=(worker.id, worker.spec, worker.inbox, self.results))
+        worker.process.start()
+
+    def _alive(self):
+        return [worker for worker in self.workers if not worker.dead]
+
+    def _assign(self):
+        """Giao việc lần lượt cho từng worker còn sống, không nghỉ và còn chỗ trống"""
+        now = time.time()
+        assigned = True
+        while assigned:
+            assigned = False
+            for worker in self._alive():
+                if worker.cooldown_until > now or len(worker.units) >= self.units_in_flight:
+                    continue
+                unit = self.queue.lease(worker.name)
+                if unit is None:
+                    return
+                remaining = unit['num_pairs'] - unit['delivered']
+                self._next_lease += 1
+                worker.inbox.put((unit['id'], self._next_lease, unit['topic'], remaining))
+                worker.units[unit['id']] = now
+                worker.leases[unit['id']] = self._next_lease
+                worker.requested[unit['id']] = remaining
+                assigned = True
+
+    def _release(self, worker, unit_id, reason, failed=True):
+        worker.units.pop(unit_id, None)
+        worker.leases.pop(unit_id, None)
+        worker.requested.pop(unit_id, None)
+        status = self.queue.release(unit_id, reason, self.max_attempts, failed)
+        self.reassigned += status == 'pending'
+        unit = self.queue.get(unit_id)
+        action = "giao lại" if status == 'pending' else "bỏ qua (quá số lần thử)"
+        print(f"   ↪️ Đơn vị {unit_id} (chủ đề {unit['topic']}, còn thiếu "
+              f"{unit['num_pairs'] - unit['delivered']} cặp) của {worker.name}: {reason} → {action}")
+
+    def _handle(self, message):
+        kind, worker_id = message[0], message[1]
+        worker = self.workers[worker_id]
+        if kind == 'pair':
+            unit_id, lease, qa = message[2:]
+            if worker.leases.get(unit_id) != lease:
+                self.stale_pairs += 1
+                return  # Lần giao đã bị thu hồi (quá hạn) và có thể đã giao cho worker khác
+            worker.units[unit_id] = time.time()
+            if self.dedup is not None and not self.dedup.add_pair(qa):
+                self.duplicates += 1
+                return
+            self.journal.append(qa)
+            self.queue.add_pairs(unit_id)
+            self.total_generated += 1
+            worker.pairs += 1
+        elif kind == 'done':
+            unit_id, lease, sent, throttled, error = message[2:]
+            if throttled:
+                worker.throttles += 1
+                pause = self.cooldown_seconds * 2 ** min(worker.throttles - 1, 5)
+                worker.cooldown_until = time.time() + pause
+                print(f"   🧊 {worker.name} bị giới hạn quota, tạm nghỉ {pause:.0f}s")
+            else:
+                worker.throttles = 0
+            if worker.leases.get(unit_id) != lease:
+                return  # Đơn vị đã bị thu hồi (quá hạn) và giao cho worker khác
+            # Dữ liệu của đơn vị phải xuống đĩa trước khi đơn vị được đóng/giao lại
+            self._commit()
+            unit = self.queue.get(unit_id)
+            requested = worker.requested.get(unit_id, 0)
+            if unit['delivered'] >= unit['num_pairs']:
+                worker.units.pop(unit_id)
+                worker.leases.pop(unit_id, None)
+                worker.requested.pop(unit_id, None)
+                self.queue.complete(unit_id)
+            elif not error and not throttled and sent >= requested:
+                # Worker gửi đủ nhưng coordinator loại cặp trùng: giao lại phần thiếu,
+                # chỉ tính là một lần thử thất bại nếu không thu được cặp mới nào
+                new_pairs = unit['delivered'] - (unit['num_pairs'] - requested)
+                self._release(worker, unit_id, f"{sent - new_pairs} cặp trùng lặp", failed=new_pairs <= 0)
+            else:
+                reason = error or ("bị giới hạn quota" if throttled else f"worker gửi {sent} cặp")
+                self._release(worker, unit_id, reason)
+        elif kind == 'fatal':
+            worker.fatal = message[2]
+            print(f"   ❌ {worker.name} không khởi động được: {worker.fatal}")
+
+    def _receive(self, timeout=0.5):
+        """Xử lý các message từ worker (chờ tối đa timeout giây cho message đầu tiên)"""
+        try:
+            message = self.results.get(timeout=timeout)
+        except queue.Empty:
+            return
+        self._handle(message)
+        for _ in range(10_000):
+            try:
+                message = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self._handle(message)
+
+    def _check_workers(self):
+        """Thu hồi việc của worker đã chết hoặc quá hạn, khởi động lại worker khi cần"""
+        now = time.time()
+        for worker in self._alive():
+            if not worker.process.is_alive():
+                # Nhận nốt các cặp worker đã gửi trước khi chết
+                self._receive(timeout=0)
+                for unit_id in list(worker.units):
+                    self._release(worker, unit_id, f"worker dừng (mã {worker.process.exitcode})")
+                if worker.fatal or worker.restarts >= WORKER_MAX_RESTARTS or not self.running:
+                    worker.dead = True
+                    continue
+                worker.restarts += 1
+                print(f"   🔄 Khởi động lại {worker.name} (lần {worker.restarts})")
+                self._start(worker)
+                continue
+            for unit_id, last_progress in list(worker.units.items()):
+                if now - last_progress > self.lease_seconds:
+                    self._release(worker, unit_id, f"không có tiến triển sau {self.lease_seconds:.0f}s")
+
+    def _commit(self):
+        """Thứ tự ghi: dữ liệu → chỉ mục dedup → tiến độ hàng đợi"""
+        self.journal.sync()
+        if self.dedup is not None:
+            self.dedup.flush()
+        self.queue.commit()
+
+    def run(self, rounds=0, num_pairs=30, topic_keys=None):
+        """Chạy cho đến khi hết việc (rounds > 0) hoặc đến khi Ctrl+C (rounds = 0)
+
+        Mỗi lượt là một lô đơn vị, mỗi chủ đề một đơn vị num_pairs cặp. Ở chế
+        độ liên tục, lô mới được thêm khi hàng đợi sắp cạn. Trả về số cặp mới.
+        """
+        from generator_google import TOPICS
+
+        topic_keys = topic_keys or sorted(TOPICS, key=int)
+        round_counts = {topic_key: num_pairs for topic_key in topic_keys}
+        recovered = self.queue.recover()
+        if recovered:
+            print(f"♻️ Làm tiếp {recovered} đơn vị dở dang của lần chạy trước")
+        if rounds and not self.queue.active():
+            for _ in range(rounds):
+                self.queue.enqueue(round_counts)
+
+        print(f"👷 {len(self.workers)} worker | {self.units_in_flight} đơn vị/worker | hàng đợi: {self.queue.path}")
+        print("⏹️  Nhấn Ctrl+C để dừng an toàn\n")
+        previous_handler = signal.signal(signal.SIGINT, self.signal_handler)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.journal.start_round(1, timestamp)
+        for worker in self.workers:
+            self._start(worker)
+
+        start_time = time.time()
+        last_commit = last_report = time.time()
+        try:
+            while not self.force_stop:
+                busy = any(worker.units for worker in self.workers)
+                if not self.running and not busy:
+                    break
+                if self.running:
+                    if not rounds and self.queue.active() < len(self.workers) * self.units_in_flight:
+                        self.queue.enqueue(round_counts)
+                    self._assign()
+                    if not self.queue.active():
+                        break
+                if not self._alive():
+                    print("❌ Không còn worker nào hoạt động")
+                    break
+                self._receive()
+                self._check_workers()
+                now = time.time()
+                if now - last_commit >= COMMIT_SECONDS:
+                    self._commit()
+                    last_commit = now
+                if now - last_report >= 30:
+                    rate = self.total_generated / ((now - start_time) / 60)
+                    print(f"📈 {self.total_generated} cặp | {rate:.1f} cặp/phút | {self.queue.describe()}")
+                    last_report = now
+        finally:
+            self._stop()
+            signal.signal(signal.SIGINT, previous_handler)
+        return self.total_generated
+
+    def _stop(self):
+        """Dừng các worker; đơn vị chưa xong được trả về hàng chờ cho lần chạy sau"""
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.inbox.put(None)
+        deadline = time.time() + (0 if self.force_stop else 10)
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            worker.process.join(max(0.0, deadline - time.time()))
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+        self._receive(timeout=0)
+        self._commit()
+        self.queue.recover()
+
+    def save_final_results(self):
+        """Ghép file round thành file final, in tổng kết; trả về đường dẫn final hoặc None"""
+        print("\n📊 === TỔNG KẾT WORKER POOL ===")
+        self.journal.close()
+        for worker in self.workers:
+            print(f"   👷 {worker.name}: {worker.pairs} cặp | khởi động lại {worker.restarts} lần"
+                  f"{' | lỗi: ' + worker.fatal if worker.fatal else ''}")
+        print(f"📝 Tổng số câu: {self.total_generated} | trùng lặp bỏ qua: {self.duplicates} | "
+              f"giao lại: {self.reassigned} | cặp của lần giao đã thu hồi: {self.stale_pairs}")
+        print(f"📋 Hàng đợi: {self.queue.describe()}")
+        if self.dedup is not None:
+            self.dedup.close()
+        self.queue.close()
+        if not self.journal.total_rows:
+            print("📭 Không có dữ liệu để lưu.")
+            return None
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        final_path = os.path.join(self.final_dir, f"marathon_final_{timestamp}{dataset_extension()}")
+        rows = self.journal.build_final(final_path)
+        print(f"🎯 FILE FINAL: {os.path.abspath(final_path)} ({rows} dòng)")
+        return final_path
+
+
+def main():
+    """Chạy worker pool từ dòng lệnh"""
+    parser = argparse.ArgumentParser(description="Sinh dữ liệu bằng nhiều tiến trình, mỗi tiến trình một API key")
+    parser.add_argument('--rounds', type=int, default=0, help='Số lượt (mặc định 0: chạy đến khi Ctrl+C)')
+    parser.add_argument('--pairs', type=int, default=30, help='Số cặp mỗi chủ đề mỗi lượt')
+    parser.add_argument('--stub', action='store_true', help='Dùng backend giả lập (STUB_* trong .env)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Số worker (giả lập: mặc định POOL_WORKERS; Gemini: tối đa số API key)')
+    parser.add_argument('--in-flight', type=int, default=None, help='Số đơn vị mỗi worker chạy đồng thời')
+    parser.add_argument('--queue', default=None, help='File hàng đợi (mặc định POOL_QUEUE_PATH)')
+    args = parser.parse_args()
+
+    try:
+        specs = backend_specs(args.stub, args.workers)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    print("🏭 WORKER POOL - SINH DỮ LIỆU SONG SONG NHIỀU TIẾN TRÌNH")
+    print("=" * 60)
+    pool = WorkerPool(specs, WorkQueue(args.queue), args.in_flight)
+    pool.run(args.rounds, args.pairs)
+    pool.save_final_results()
+
+
+if __name__ == "__main__":
+    main()